@@ -0,0 +1,138 @@
+import os
+from datetime import datetime, timedelta
+from airflow.models import DAG
+from airflow.models.param import Param
+from airflow.providers.postgres.operators.postgres import PostgresOperator
+from airflow.utils.task_group import TaskGroup
+from airflow.operators.python_operator import PythonOperator
+from airflow.operators.python import ShortCircuitOperator
+from utils.main import backfill_crypto, is_redshift_backend
+from utils.config import var, search_path_sql
+from utils.settings import LOCAL_TZ, USE_ROLLUP
+
+doc_md = """
+## Batched backfill of the crypto table in Redshift
+## SUMARY:
+-----
+- DAG Name:
+    `crypto_backfill`
+- Owner:
+    `Victor Velasco`
+### Description:
+    Este proceso se ejecuta de forma manual con los parámetros start_date y end_date, carga todos
+    los intervalos diarios del rango en una sola carga masiva y un solo MERGE sobre la tabla crypto,
+    cada fila conserva el updated_at y executed_at de su intervalo. Por defecto lee los snapshots en
+    Parquet del lake, con source cache usa las respuestas de coinAPI guardadas en cache. Nunca consulta
+    coinAPI y falla si algún intervalo del rango no tiene snapshot. Los días ya compactados en
+    crypto_daily y crypto_monthly (anteriores a compactado_hasta de crypto_retention) se omiten.
+    Reemplaza a `airflow dags backfill crypto_data` para rangos largos.
+"""
+
+# ---------- Globals ---------------
+dag_id = "crypto_backfill"
+queries_base_path = os.path.join(os.path.dirname(__file__), "sql")
+default_args = {
+    "owner": "victor.velasco",
+    "retries": 1,
+    "retry_delay": timedelta(minutes=5),
+}
+
+# -------- Variables ---------------------
+dwh_host = var("DB_HOST")
+dwh_user = var("DB_USER")
+dwh_name = var("DB_NAME")
+dwh_port = var("DB_PORT")
+dwh_password = var("DB_PASSWORD")
+dwh_schema = var("DB_SCHEMA")
+# redshift or duckdb, the duckdb backend runs the backfill on a local file and skips the Redshift DDL
+dwh_backend = var("DWH_BACKEND", "redshift")
+api_key = var("API_KEY")
+table_name = "crypto"
+base_currencies = ["USD", "EUR", "GTQ", "MXN"]
+max_workers = 4
+base_url = "https://rest.coinapi.io/v1/exchangerate"
+load_method = "auto"
+update_watermark = True
+# Same rollup setting as crypto_data, see CRYPTO_USE_ROLLUP in utils.settings
+use_rollup = USE_ROLLUP
+
+# ------------- DAG -----------------------
+with DAG(
+    dag_id=dag_id,
+    default_args=default_args,
+    max_active_runs=1,
+    schedule_interval=None,
+    start_date=datetime(2023, 12, 1, tzinfo=LOCAL_TZ),
+    description="Este proceso carga un rango de fechas de criptodivisas en una sola pasada, se ejecuta de forma manual",
+    catchup=False,
+    doc_md=doc_md,
+    tags=["maintenance"],
+    template_searchpath=queries_base_path,
+    params={
+        "start_date": Param("2023-12-01", type="string", format="date"),
+        "end_date": Param("2023-12-31", type="string", format="date"),
+        "source": Param("lake", enum=["lake", "cache"]),
+    },
+) as dag:
+    # -------------- Tasks ----------------
+    is_redshift_backend_crypto = ShortCircuitOperator(
+        task_id="is_redshift_backend",
+        python_callable=is_redshift_backend,
+        op_kwargs={"dwh_backend": dwh_backend},
+        #  Only the DDL tasks are skipped, the tasks after them run with none_failed
+        ignore_downstream_trigger_rules=False,
+    )
+
+    with TaskGroup("BUILD_TABLES_CRYPTO", prefix_group_id=False) as build_tables_crypto:
+        create_tbl_crypto = PostgresOperator(
+            task_id="create_tbl_crypto",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO.sql"),
+        )
+
+        create_tbl_crypto_watermark = PostgresOperator(
+            task_id="create_tbl_crypto_watermark",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_WATERMARK.sql"),
+        )
+
+        create_tbl_crypto_hist_avg = PostgresOperator(
+            task_id="create_tbl_crypto_hist_avg",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_HIST_AVG.sql"),
+        )
+
+        create_tbl_crypto_retention = PostgresOperator(
+            task_id="create_tbl_crypto_retention",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_RETENTION.sql"),
+        )
+
+    backfill_data_crypto = PythonOperator(
+        task_id="backfill_crypto_data",
+        python_callable=backfill_crypto,
+        trigger_rule="none_failed",
+        op_kwargs={
+            "table_name": table_name,
+            "base_currencies": base_currencies,
+            "max_workers": max_workers,
+            "base_url": base_url,
+            "dwh_host": dwh_host,
+            "dwh_user": dwh_user,
+            "dwh_name": dwh_name,
+            "dwh_port": dwh_port,
+            "dwh_schema": dwh_schema,
+            "dwh_password": dwh_password,
+            "api_key": api_key,
+            "start_date": "{{ params.start_date }}",
+            "end_date": "{{ params.end_date }}",
+            "source": "{{ params.source }}",
+            "load_method": load_method,
+            "update_watermark": update_watermark,
+            "rollup": use_rollup,
+            "dwh_backend": dwh_backend,
+        },
+    )
+
+# ---------------- Execution Order ------------------
+is_redshift_backend_crypto >> build_tables_crypto >> backfill_data_crypto
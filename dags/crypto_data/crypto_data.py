@@ -1,13 +1,23 @@
 import os
 from datetime import datetime, timedelta
-from airflow.models import DAG, Variable
+from airflow.models import DAG
 from airflow.operators.bash import BashOperator
 from airflow.providers.postgres.operators.postgres import PostgresOperator
 from airflow.utils.task_group import TaskGroup
 from airflow.providers.http.sensors.http import HttpSensor
+from airflow.sensors.python import PythonSensor
 from airflow.operators.python_operator import PythonOperator
-from utils.main import extract_transform_load_crypto, send_alert_summary
-from utils.settings import LOCAL_TZ
+from airflow.operators.python import ShortCircuitOperator
+from utils.main import (
+    is_redshift_backend,
+    probe_crypto_api,
+    extract_transform_load_crypto,
+    send_alert_summary,
+    update_crypto_analytics,
+    compact_crypto_tiers,
+)
+from utils.config import var, search_path_sql
+from utils.settings import LOCAL_TZ, USE_ROLLUP
 
 doc_md = """
 ## Refresh of staging schemas in Redshift
@@ -35,21 +45,59 @@ default_args = {
 }
 
 # -------- Variables ---------------------
-dwh_host = Variable.get("DB_HOST")
-dwh_user = Variable.get("DB_USER")
-dwh_name = Variable.get("DB_NAME")
-dwh_port = Variable.get("DB_PORT")
-dwh_password = Variable.get("DB_PASSWORD")
-dwh_schema = Variable.get("DB_SCHEMA")
-api_key = Variable.get("API_KEY")
-email_sender = Variable.get("EMAIL_SENDER")
-email_receiver = Variable.get("EMAIL_RECEIVER")
-email_smtp_secret = Variable.get("GMAIL_SMTP_SECRET")
+dwh_host = var("DB_HOST")
+dwh_user = var("DB_USER")
+dwh_name = var("DB_NAME")
+dwh_port = var("DB_PORT")
+dwh_password = var("DB_PASSWORD")
+dwh_schema = var("DB_SCHEMA")
+# redshift or duckdb, the duckdb backend runs every task on a local file and skips the Redshift DDL
+dwh_backend = var("DWH_BACKEND", "redshift")
+api_key = var("API_KEY")
+email_sender = var("EMAIL_SENDER")
+email_receiver = var("EMAIL_RECEIVER")
+email_smtp_secret = var("GMAIL_SMTP_SECRET")
+# JSON list of {"email", "min_price", "max_price", "top_k"}, empty sends one alert to EMAIL_RECEIVER
+alert_subscribers = var("ALERT_SUBSCRIBERS", "[]")
 table_name = "crypto"
 base_currency = "USD"
+base_currencies = ["USD", "EUR", "GTQ", "MXN"]
+max_workers = 4
+# Backfill runs only replay cached CoinAPI responses, the rest of runs fill the cache
+cache_mode = "{{ 'replay' if dag_run.run_type == 'backfill' else 'read_write' }}"
+# COPY from S3 on Redshift when a staging bucket is configured, to_sql otherwise
+load_method = "auto"
+# Load staging with this many parallel connections split by a hash of Moneda, then one MERGE.
+# Only used with the PostgreSQL copy method and each shard commits on its own
+load_shards = 1
+# Only merge rows newer than the per coin watermark, staging keeps the full snapshot
+incremental_load = True
+# Only merge rows whose hash of price and timestamp changed since the last load. The hash
+# includes created_at so it is redundant with incremental_load, enable only one of them
+change_detection = False
+# Land every snapshot as Parquet, re-runs read it from the lake instead of CoinAPI
+lake_mode = "read_write"
 base_url = "https://rest.coinapi.io/v1/exchangerate"
+# The availability sensor fetches the real snapshots into the cache instead of probing BTC/USD
+probe_with_fetch = True
 min_price = 0
 max_price = 50000
+# Compute the summary with one query inside the warehouse, it wins over the handoff
+summary_pushdown = True
+# Hand the staged frame from the load task to the summary task, only history is queried.
+# Used when the pushdown is off or there are subscribers, which the pushdown does not serve
+summary_handoff = True
+top_k = 5
+# SMTP connections shared by the subscriber alerts
+smtp_pool_size = 2
+# Flag coins whose return is a z-score outlier against their streaming statistics
+detect_anomalies = True
+# Keep the historical averages in crypto_hist_avg and read them from there, shared with the
+# intraday and backfill DAGs through CRYPTO_USE_ROLLUP (see utils.settings)
+use_rollup = USE_ROLLUP
+# Without the rollup read the averages from the daily and monthly tiers, which keep the rows
+# pruned by compact_crypto_tiers. With both off only the unpruned rows of crypto are averaged
+use_tiers = True
 
 # ------------- DAG -----------------------
 with DAG(
@@ -66,39 +114,133 @@ with DAG(
 ) as dag:
     # -------------- Tasks ----------------
 
-    is_coin_api_available = HttpSensor(
-        task_id="is_coin_api_available",
-        http_conn_id="coin_api",
-        endpoint="v1/exchangerate/BTC/USD",
-        response_check=lambda response: response.status_code == 200,
-        poke_interval=5,
-        timeout=20,
-    )
+    if probe_with_fetch:
+        is_coin_api_available = PythonSensor(
+            task_id="is_coin_api_available",
+            python_callable=probe_crypto_api,
+            op_kwargs={
+                "base_url": base_url,
+                "api_key": api_key,
+                "base_currencies": base_currencies,
+                "max_workers": max_workers,
+                "cache_mode": cache_mode,
+                "data_interval_start": "{{ data_interval_start | ts }}",
+                "data_interval_end": "{{ data_interval_end | ts }}",
+            },
+            poke_interval=60,
+            timeout=15 * 60,
+            mode="reschedule",
+        )
+    else:
+        is_coin_api_available = HttpSensor(
+            task_id="is_coin_api_available",
+            http_conn_id="coin_api",
+            endpoint="v1/exchangerate/BTC/USD",
+            response_check=lambda response: response.status_code == 200,
+            poke_interval=5,
+            timeout=20,
+        )
 
     start_etl_process = BashOperator(
         task_id="start_etl_process", bash_command="echo 'Comenzando proceso ETL'"
     )
+
+    is_redshift_backend_crypto = ShortCircuitOperator(
+        task_id="is_redshift_backend",
+        python_callable=is_redshift_backend,
+        op_kwargs={"dwh_backend": dwh_backend},
+        #  Only the DDL tasks are skipped, the tasks after them run with none_failed
+        ignore_downstream_trigger_rules=False,
+    )
+
     with TaskGroup("BUILD_TABLES_CRYPTO", prefix_group_id=False) as build_tables_crypto:
         create_tbl_crypto_stg = PostgresOperator(
             task_id="create_tbl_crypto_stg",
             postgres_conn_id="redshift_conn",
-            sql="CREATE_STG_TBL_CRYPTO.sql",
-            hook_params={"options": f"-c search_path={dwh_schema}"},
+            sql=search_path_sql("CREATE_STG_TBL_CRYPTO.sql"),
+        )
+
+        create_tbl_crypto_stg_merge = PostgresOperator(
+            task_id="create_tbl_crypto_stg_merge",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_STG_MERGE.sql"),
+        )
+
+        create_tbl_crypto_stg_load = PostgresOperator(
+            task_id="create_tbl_crypto_stg_load",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_STG_LOAD.sql"),
         )
 
         create_tbl_crypto = PostgresOperator(
             task_id="create_tbl_crypto",
             postgres_conn_id="redshift_conn",
-            sql="CREATE_TBL_CRYPTO.sql",
-            hook_params={"options": f"-c search_path={dwh_schema}"},
+            sql=search_path_sql("CREATE_TBL_CRYPTO.sql"),
+        )
+
+        create_tbl_crypto_watermark = PostgresOperator(
+            task_id="create_tbl_crypto_watermark",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_WATERMARK.sql"),
+        )
+
+        create_tbl_crypto_hist_avg = PostgresOperator(
+            task_id="create_tbl_crypto_hist_avg",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_HIST_AVG.sql"),
+        )
+
+        create_tbl_crypto_analytics = PostgresOperator(
+            task_id="create_tbl_crypto_analytics",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_ANALYTICS.sql"),
+        )
+
+        create_tbl_crypto_fingerprint = PostgresOperator(
+            task_id="create_tbl_crypto_fingerprint",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_FINGERPRINT.sql"),
+        )
+
+        create_tbl_crypto_daily = PostgresOperator(
+            task_id="create_tbl_crypto_daily",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_DAILY.sql"),
+        )
+
+        create_tbl_crypto_monthly = PostgresOperator(
+            task_id="create_tbl_crypto_monthly",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_MONTHLY.sql"),
+        )
+
+        create_tbl_crypto_retention = PostgresOperator(
+            task_id="create_tbl_crypto_retention",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_RETENTION.sql"),
+        )
+
+        create_tbl_crypto_stg_batch = PostgresOperator(
+            task_id="create_tbl_crypto_stg_batch",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_STG_BATCH.sql"),
+        )
+
+        create_tbl_crypto_batch_merge = PostgresOperator(
+            task_id="create_tbl_crypto_batch_merge",
+            postgres_conn_id="redshift_conn",
+            sql=search_path_sql("CREATE_TBL_CRYPTO_BATCH_MERGE.sql"),
         )
 
     load_data_crypto = PythonOperator(
         task_id="load_crypto_data",
         python_callable=extract_transform_load_crypto,
+        trigger_rule="none_failed",
         op_kwargs={
             "table_name": table_name,
             "base_currency": base_currency,
+            "base_currencies": base_currencies,
+            "max_workers": max_workers,
             "base_url": base_url,
             "dwh_host": dwh_host,
             "dwh_user": dwh_user,
@@ -107,6 +249,18 @@ with DAG(
             "dwh_schema": dwh_schema,
             "dwh_password": dwh_password,
             "api_key": api_key,
+            "cache_mode": cache_mode,
+            "load_method": load_method,
+            "incremental": incremental_load,
+            "change_detection": change_detection,
+            "rollup": use_rollup,
+            "lake_mode": lake_mode,
+            "handoff": summary_handoff,
+            "load_shards": load_shards,
+            "detect_anomalies": detect_anomalies,
+            "dwh_backend": dwh_backend,
+            "data_interval_start": "{{ data_interval_start | ts }}",
+            "data_interval_end": "{{ data_interval_end | ts }}",
             "executed_at": "'{{ data_interval_end | ds }}'",
             "updated_at": "'{{ data_interval_end | ts }}'",
         },
@@ -131,6 +285,49 @@ with DAG(
             "email_smtp_secret": email_smtp_secret,
             "dag_name": "{{ dag }}",
             "ds": "{{ ds }}",
+            "base_currency": base_currency,
+            "pushdown": summary_pushdown,
+            "top_k": top_k,
+            "use_rollup": use_rollup,
+            "use_tiers": use_tiers,
+            "handoff_path": "{{ ti.xcom_pull(task_ids='load_crypto_data')['handoff_path'] or '' }}",
+            "subscribers": alert_subscribers,
+            "smtp_pool_size": smtp_pool_size,
+            "anomalies": "{{ ti.xcom_pull(task_ids='load_crypto_data')['anomalies'] | tojson }}",
+            "dwh_backend": dwh_backend,
+        },
+    )
+
+    update_analytics_crypto = PythonOperator(
+        task_id="update_crypto_analytics",
+        python_callable=update_crypto_analytics,
+        op_kwargs={
+            "table_name": table_name,
+            "dwh_host": dwh_host,
+            "dwh_user": dwh_user,
+            "dwh_name": dwh_name,
+            "dwh_port": dwh_port,
+            "dwh_schema": dwh_schema,
+            "dwh_password": dwh_password,
+            "executed_at": "{{ data_interval_end | ds }}",
+            "load_method": load_method,
+            "dwh_backend": dwh_backend,
+        },
+    )
+
+    compact_tiers_crypto = PythonOperator(
+        task_id="compact_crypto_tiers",
+        python_callable=compact_crypto_tiers,
+        op_kwargs={
+            "table_name": table_name,
+            "dwh_host": dwh_host,
+            "dwh_user": dwh_user,
+            "dwh_name": dwh_name,
+            "dwh_port": dwh_port,
+            "dwh_schema": dwh_schema,
+            "dwh_password": dwh_password,
+            "compact_until": "{{ data_interval_end | ds }}",
+            "dwh_backend": dwh_backend,
         },
     )
 
@@ -141,11 +338,14 @@ with DAG(
 # ---------------- Execution Order ------------------
 is_coin_api_available >> start_etl_process
 
-start_etl_process >> build_tables_crypto
+start_etl_process >> is_redshift_backend_crypto >> build_tables_crypto
 
 build_tables_crypto >> load_data_crypto
 build_tables_crypto >> load_data_crypto
 
 load_data_crypto >> end_etl_process
+load_data_crypto >> update_analytics_crypto
+# The analytics read the raw rows of their window before the pruning
+update_analytics_crypto >> compact_tiers_crypto
 
 end_etl_process >> send_email_alert
@@ -0,0 +1,114 @@
+import os
+from datetime import datetime, timedelta
+from airflow.models import DAG
+from airflow.operators.python_operator import PythonOperator
+from utils.main import ingest_crypto_batch, merge_crypto_batches
+from utils.config import var
+from utils.settings import LOCAL_TZ, USE_ROLLUP
+
+doc_md = """
+## Intraday micro-batch ingestion of crypto prices in Redshift
+## SUMARY:
+-----
+- DAG Name:
+    `crypto_intraday`
+- Owner:
+    `Victor Velasco`
+### Description:
+    Este proceso se ejecuta cada pocos minutos, agrega el snapshot actual de coinAPI como un micro-batch
+    a la tabla append-only crypto_stg_batch (sin DDL ni MERGE por ejecución) y, cuando hay suficientes
+    batches acumulados, los aplica sobre la tabla crypto con un solo MERGE.
+    Las tablas se crean en el DAG `crypto_data`, con el backend duckdb las crea la tarea al conectarse.
+"""
+
+# ---------- Globals ---------------
+dag_id = "crypto_intraday"
+schedule_interval = "*/5 * * * *"
+queries_base_path = os.path.join(os.path.dirname(__file__), "sql")
+default_args = {
+    "owner": "victor.velasco",
+    "retries": 1,
+    "retry_delay": timedelta(minutes=1),
+}
+
+# -------- Variables ---------------------
+dwh_host = var("DB_HOST")
+dwh_user = var("DB_USER")
+dwh_name = var("DB_NAME")
+dwh_port = var("DB_PORT")
+dwh_password = var("DB_PASSWORD")
+dwh_schema = var("DB_SCHEMA")
+# redshift or duckdb, the duckdb backend runs the batches on a local file
+dwh_backend = var("DWH_BACKEND", "redshift")
+api_key = var("API_KEY")
+table_name = "crypto"
+base_currencies = ["USD", "EUR", "GTQ", "MXN"]
+max_workers = 4
+base_url = "https://rest.coinapi.io/v1/exchangerate"
+load_method = "auto"
+lake_mode = "write"
+# Merge the accumulated batches about once per hour
+merge_every_batches = 12
+update_watermark = True
+# Same rollup setting as crypto_data, see CRYPTO_USE_ROLLUP in utils.settings
+use_rollup = USE_ROLLUP
+
+# ------------- DAG -----------------------
+with DAG(
+    dag_id=dag_id,
+    default_args=default_args,
+    max_active_runs=1,
+    schedule_interval=schedule_interval,
+    start_date=datetime(2023, 12, 1, tzinfo=LOCAL_TZ),
+    description="Este proceso agrega micro-batches de criptodivisas cada 5 minutos y los aplica sobre la tabla crypto de forma periódica",
+    catchup=False,
+    doc_md=doc_md,
+    tags=["staging", "intraday"],
+    template_searchpath=queries_base_path,
+) as dag:
+    # -------------- Tasks ----------------
+
+    ingest_batch_crypto = PythonOperator(
+        task_id="ingest_crypto_batch",
+        python_callable=ingest_crypto_batch,
+        op_kwargs={
+            "table_name": table_name,
+            "base_currencies": base_currencies,
+            "max_workers": max_workers,
+            "base_url": base_url,
+            "dwh_host": dwh_host,
+            "dwh_user": dwh_user,
+            "dwh_name": dwh_name,
+            "dwh_port": dwh_port,
+            "dwh_schema": dwh_schema,
+            "dwh_password": dwh_password,
+            "api_key": api_key,
+            "load_method": load_method,
+            "lake_mode": lake_mode,
+            "batch_id": "{{ data_interval_end | ts_nodash }}",
+            "data_interval_start": "{{ data_interval_start | ts }}",
+            "data_interval_end": "{{ data_interval_end | ts }}",
+            "dwh_backend": dwh_backend,
+        },
+    )
+
+    merge_batches_crypto = PythonOperator(
+        task_id="merge_crypto_batches",
+        python_callable=merge_crypto_batches,
+        op_kwargs={
+            "table_name": table_name,
+            "dwh_host": dwh_host,
+            "dwh_user": dwh_user,
+            "dwh_name": dwh_name,
+            "dwh_port": dwh_port,
+            "dwh_schema": dwh_schema,
+            "dwh_password": dwh_password,
+            "min_batches": merge_every_batches,
+            "update_watermark": update_watermark,
+            "rollup": use_rollup,
+            "dwh_backend": dwh_backend,
+        },
+    )
+
+# ---------------- Execution Order ------------------
+ingest_batch_crypto >> merge_batches_crypto
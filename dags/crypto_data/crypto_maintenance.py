@@ -0,0 +1,113 @@
+import os
+from datetime import datetime, timedelta
+from airflow.models import DAG
+from airflow.providers.postgres.operators.postgres import PostgresOperator
+from airflow.operators.python_operator import PythonOperator
+from airflow.operators.python import ShortCircuitOperator
+from utils.main import is_redshift_backend, rebuild_rollup_crypto
+from utils.config import var, search_path_sql
+from utils.settings import LOCAL_TZ
+
+doc_md = """
+## Maintenance of the crypto tables in Redshift
+## SUMARY:
+-----
+- DAG Name:
+    `crypto_maintenance`
+- Owner:
+    `Victor Velasco`
+### Description:
+    Este proceso se ejecuta de forma manual para reparar las tablas derivadas de la tabla crypto,
+    reconstruye la tabla de promedios históricos crypto_hist_avg a partir de todo el histórico,
+    las filas podadas de crypto se leen de los niveles crypto_daily y crypto_monthly.
+"""
+
+# ---------- Globals ---------------
+dag_id = "crypto_maintenance"
+queries_base_path = os.path.join(os.path.dirname(__file__), "sql")
+default_args = {
+    "owner": "victor.velasco",
+    "retries": 1,
+    "retry_delay": timedelta(minutes=5),
+}
+
+# -------- Variables ---------------------
+dwh_host = var("DB_HOST")
+dwh_user = var("DB_USER")
+dwh_name = var("DB_NAME")
+dwh_port = var("DB_PORT")
+dwh_password = var("DB_PASSWORD")
+dwh_schema = var("DB_SCHEMA")
+# redshift or duckdb, the duckdb backend rebuilds the rollup on a local file and skips the Redshift DDL
+dwh_backend = var("DWH_BACKEND", "redshift")
+table_name = "crypto"
+
+# ------------- DAG -----------------------
+with DAG(
+    dag_id=dag_id,
+    default_args=default_args,
+    max_active_runs=1,
+    schedule_interval=None,
+    start_date=datetime(2023, 12, 1, tzinfo=LOCAL_TZ),
+    description="Este proceso reconstruye las tablas derivadas de crypto, se ejecuta de forma manual",
+    catchup=False,
+    doc_md=doc_md,
+    tags=["maintenance"],
+    template_searchpath=queries_base_path,
+) as dag:
+    # -------------- Tasks ----------------
+    is_redshift_backend_crypto = ShortCircuitOperator(
+        task_id="is_redshift_backend",
+        python_callable=is_redshift_backend,
+        op_kwargs={"dwh_backend": dwh_backend},
+        #  Only the DDL tasks are skipped, the tasks after them run with none_failed
+        ignore_downstream_trigger_rules=False,
+    )
+
+    create_tbl_crypto_hist_avg = PostgresOperator(
+        task_id="create_tbl_crypto_hist_avg",
+        postgres_conn_id="redshift_conn",
+        sql=search_path_sql("CREATE_TBL_CRYPTO_HIST_AVG.sql"),
+    )
+
+    create_tbl_crypto_daily = PostgresOperator(
+        task_id="create_tbl_crypto_daily",
+        postgres_conn_id="redshift_conn",
+        sql=search_path_sql("CREATE_TBL_CRYPTO_DAILY.sql"),
+    )
+
+    create_tbl_crypto_monthly = PostgresOperator(
+        task_id="create_tbl_crypto_monthly",
+        postgres_conn_id="redshift_conn",
+        sql=search_path_sql("CREATE_TBL_CRYPTO_MONTHLY.sql"),
+    )
+
+    create_tbl_crypto_retention = PostgresOperator(
+        task_id="create_tbl_crypto_retention",
+        postgres_conn_id="redshift_conn",
+        sql=search_path_sql("CREATE_TBL_CRYPTO_RETENTION.sql"),
+    )
+
+    rebuild_crypto_hist_avg = PythonOperator(
+        task_id="rebuild_crypto_hist_avg",
+        python_callable=rebuild_rollup_crypto,
+        trigger_rule="none_failed",
+        op_kwargs={
+            "table_name": table_name,
+            "dwh_host": dwh_host,
+            "dwh_user": dwh_user,
+            "dwh_name": dwh_name,
+            "dwh_port": dwh_port,
+            "dwh_schema": dwh_schema,
+            "dwh_password": dwh_password,
+            "dwh_backend": dwh_backend,
+        },
+    )
+
+# ---------------- Execution Order ------------------
+is_redshift_backend_crypto >> [
+    create_tbl_crypto_hist_avg,
+    create_tbl_crypto_daily,
+    create_tbl_crypto_monthly,
+    create_tbl_crypto_retention,
+] >> rebuild_crypto_hist_avg
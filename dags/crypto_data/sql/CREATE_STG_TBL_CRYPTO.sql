@@ -1,8 +1,9 @@
 CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_stg
 (
-Moneda varchar(256) primary key distkey,
+Moneda varchar(256) distkey,
 Base varchar(256),
 Precio float,
-created_at timestamp
+created_at timestamp,
+primary key(Moneda, Base)
 )
-sortkey(created_at); 
\ No newline at end of file
+sortkey(created_at);
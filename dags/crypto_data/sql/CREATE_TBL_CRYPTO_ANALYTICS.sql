@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_analytics
+(
+moneda varchar(256) distkey,
+base varchar(256),
+fecha date,
+precio float,
+ma_7 float,
+ma_30 float,
+ma_90 float,
+volatilidad_30 float,
+max_drawdown_90 float,
+momentum_30 float,
+primary key(moneda, base, fecha)
+)
+sortkey(fecha, moneda);
@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_daily
+(
+Moneda varchar(256) distkey,
+Base varchar(256),
+fecha date,
+apertura float,
+maximo float,
+minimo float,
+cierre float,
+suma_precio float,
+conteo bigint,
+apertura_at timestamp,
+cierre_at timestamp,
+primary key(Moneda, Base, fecha)
+)
+sortkey(fecha, Moneda, Base);
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_fingerprint
+(
+Moneda varchar(256) distkey,
+Base varchar(256),
+fingerprint bigint,
+primary key(Moneda, Base)
+)
+sortkey(Moneda, Base);
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_hist_avg
+(
+Moneda varchar(256) distkey,
+Base varchar(256),
+suma_precio float,
+conteo bigint,
+primary key(Moneda, Base)
+)
+sortkey(Moneda, Base);
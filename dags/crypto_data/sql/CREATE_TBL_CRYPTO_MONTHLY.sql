@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_monthly
+(
+Moneda varchar(256) distkey,
+Base varchar(256),
+mes date,
+apertura float,
+maximo float,
+minimo float,
+cierre float,
+suma_precio float,
+conteo bigint,
+primary key(Moneda, Base, mes)
+)
+sortkey(mes, Moneda, Base);
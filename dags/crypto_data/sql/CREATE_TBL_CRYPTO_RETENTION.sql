@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_retention
+(
+horizonte date,
+compactado_hasta date
+)
+diststyle all;
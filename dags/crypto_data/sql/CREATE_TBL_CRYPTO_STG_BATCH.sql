@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_stg_batch
+(
+Moneda varchar(256) distkey,
+Base varchar(256),
+Precio float,
+created_at timestamp,
+updated_at timestamp,
+executed_at date,
+batch_id varchar(64)
+)
+sortkey(batch_id, created_at);
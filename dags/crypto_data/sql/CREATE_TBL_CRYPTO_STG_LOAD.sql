@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS dani_gt_10_coderhouse.crypto_stg_load
+(
+Moneda varchar(256) distkey,
+Base varchar(256),
+Precio float,
+created_at timestamp,
+primary key(Moneda, Base)
+)
+sortkey(created_at);
@@ -0,0 +1,105 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.analytics import (  # noqa: E402
+    AnalyticsState,
+    DRAWDOWN_WINDOW,
+    KEYS,
+    MA_WINDOWS,
+    METRIC_COLUMNS,
+    MOMENTUM_WINDOW,
+    VOLATILITY_WINDOW,
+    compute_rolling_metrics,
+)
+
+DAYS = 200
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(7)
+    frames = []
+    for moneda, base in [("BTC", "USD"), ("ETH", "USD"), ("BTC", "EUR")]:
+        precio = 100 * np.exp(np.cumsum(rng.normal(0, 0.03, DAYS)))
+        frames.append(
+            pd.DataFrame(
+                {
+                    "moneda": moneda,
+                    "base": base,
+                    "fecha": pd.date_range("2023-01-01", periods=DAYS),
+                    "precio": precio,
+                }
+            )
+        )
+    df = pd.concat(frames, ignore_index=True)
+    #  Some days without price
+    return df[rng.random(len(df)) > 0.1].reset_index(drop=True)
+
+
+def _drawdown(window):
+    peak = np.fmax.accumulate(window)
+    return np.nanmin(np.where(np.isnan(window), np.inf, window / peak - 1))
+
+
+def pandas_reference(prices):
+    frames = []
+    for (moneda, base), group in prices.groupby(KEYS):
+        precio = group.set_index("fecha")["precio"].asfreq("D")
+        returns = np.log(precio / precio.shift(1))
+        reference = pd.DataFrame({"precio": precio})
+        for window in MA_WINDOWS:
+            reference[f"ma_{window}"] = precio.rolling(window, min_periods=1).mean()
+        reference[f"volatilidad_{VOLATILITY_WINDOW}"] = returns.rolling(
+            VOLATILITY_WINDOW, min_periods=2
+        ).std()
+        reference[f"max_drawdown_{DRAWDOWN_WINDOW}"] = precio.rolling(
+            DRAWDOWN_WINDOW, min_periods=1
+        ).apply(_drawdown, raw=True)
+        reference[f"momentum_{MOMENTUM_WINDOW}"] = precio / precio.shift(MOMENTUM_WINDOW) - 1
+        frames.append(
+            reference.dropna(subset=["precio"])
+            .reset_index()
+            .assign(moneda=moneda, base=base)
+        )
+    return _sorted(pd.concat(frames, ignore_index=True))
+
+
+def _sorted(df):
+    df = df.astype({"moneda": str, "base": str})
+    return df.sort_values(KEYS + ["fecha"]).reset_index(drop=True)[
+        KEYS + ["fecha", "precio"] + METRIC_COLUMNS
+    ]
+
+
+def test_rolling_metrics_match_pandas(prices):
+    result = _sorted(compute_rolling_metrics(prices))
+    pd.testing.assert_frame_equal(result, pandas_reference(prices), check_dtype=False)
+
+
+def test_incremental_update_matches_full_history(prices, tmp_path):
+    state = AnalyticsState(tmp_path, "crypto")
+    frames = [state.update(day) for _, day in prices.groupby("fecha")]
+    result = _sorted(pd.concat(frames, ignore_index=True))
+    pd.testing.assert_frame_equal(result, pandas_reference(prices), check_dtype=False)
+
+
+def test_update_recomputes_an_existing_day(prices, tmp_path):
+    state = AnalyticsState(tmp_path, "crypto")
+    last_day = prices["fecha"].max()
+    state.update(prices)
+    #  A later intraday merge changes the price of the last day
+    revised = prices[prices["fecha"] == last_day].assign(
+        precio=lambda df: df["precio"] * 1.05
+    )
+    result = _sorted(state.update(revised))
+
+    expected = pandas_reference(
+        pd.concat([prices[prices["fecha"] < last_day], revised], ignore_index=True)
+    )
+    expected = expected[expected["fecha"] == last_day].reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
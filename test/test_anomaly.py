@@ -0,0 +1,89 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.anomaly import ANOMALY_COLUMNS, AnomalyDetector  # noqa: E402
+
+try:
+    import pyarrow  # noqa: F401
+
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+MONEDAS = ["BTC", "ETH", "SOL", "USDT"]
+SNAPSHOTS = 30
+
+
+def _snapshot(prices, created_at):
+    return pd.DataFrame(
+        {
+            "Moneda": pd.Categorical(MONEDAS),
+            "Base": pd.Categorical(["USD"] * len(MONEDAS)),
+            "Precio": prices,
+            "created_at": created_at,
+        }
+    )
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(21)
+    prices = np.array([42000.0, 2200.0, 60.0, 1.0])
+    snapshots = []
+    for hour in range(SNAPSHOTS):
+        #  USDT keeps a flat price
+        prices = prices * np.exp(np.append(rng.normal(0, 0.01, 3), 0.0))
+        snapshots.append(_snapshot(prices, pd.Timestamp("2023-12-01") + pd.Timedelta(hours=hour)))
+    return snapshots
+
+
+@pytest.fixture
+def detector(tmp_path, history):
+    detector = AnomalyDetector(tmp_path, "crypto", z_threshold=4.0)
+    for snapshot in history:
+        assert detector.update(snapshot).empty
+    return detector
+
+
+def test_welford_statistics_match_numpy(detector, history):
+    prices = np.array([snapshot["Precio"][0] for snapshot in history])
+    returns = np.diff(np.log(prices))
+    btc = detector.state.loc[("BTC", "USD")]
+    assert btc["count"] == len(returns)
+    assert btc["mean"] == pytest.approx(returns.mean())
+    assert btc["m2"] / (btc["count"] - 1) == pytest.approx(returns.var(ddof=1))
+
+
+def test_a_jump_is_flagged(detector, history):
+    last = history[-1]
+    jump = _snapshot(last["Precio"] * [1.3, 1.0, 1.0, 1.0], last["created_at"] + pd.Timedelta(hours=1))
+    anomalies = detector.update(jump)
+    assert list(anomalies.columns) == ANOMALY_COLUMNS
+    assert anomalies["moneda"].tolist() == ["BTC"]
+    assert anomalies["retorno"][0] == pytest.approx(30.0)
+
+
+def test_a_flat_coin_never_gets_an_infinite_score(detector, history):
+    last = history[-1]
+    move = _snapshot(last["Precio"] * [1.0, 1.0, 1.0, 1.0001], last["created_at"] + pd.Timedelta(hours=1))
+    assert detector.update(move).empty
+
+
+def test_a_replayed_snapshot_is_not_counted_twice(detector, history):
+    count = detector.state["count"].copy()
+    assert detector.update(history[-1]).empty
+    pd.testing.assert_series_equal(detector.state["count"], count)
+
+
+@pytest.mark.skipif(not HAS_PARQUET, reason="pyarrow no disponible")
+def test_state_round_trip(tmp_path, detector):
+    detector.save()
+    restored = AnomalyDetector(tmp_path, "crypto")
+    pd.testing.assert_frame_equal(
+        restored.state.sort_index(), detector.state.sort_index(), check_index_type=False
+    )
@@ -0,0 +1,77 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import utils  # noqa: E402
+from utils.cache import ResponseCache  # noqa: E402
+
+START = "2023-12-01T06:00:00+00:00"
+END = "2023-12-02T06:00:00+00:00"
+RAW = b'{"asset_id_base": "USD", "rates": [{"asset_id_quote": "BTC", "rate": 0.00002}]}'
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+
+    def fake_api(base_currency, base_url, api_key, session=None, raw=False):
+        calls.append(base_currency)
+        return RAW
+
+    monkeypatch.setattr(utils, "get_coin_api_information", fake_api)
+    return calls
+
+
+def _get(cache):
+    return utils.get_coin_api_information_cached(
+        base_currency="USD",
+        base_url="https://rest.coinapi.io/v1/exchangerate",
+        api_key="key",
+        cache=cache,
+        data_interval_start=START,
+        data_interval_end=END,
+        raw=True,
+    )
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = ResponseCache(tmp_path)
+    key = cache.build_key("USD", START, END)
+    cache.put(key, RAW)
+    assert cache.get(key) == RAW
+    assert cache.get(cache.build_key("EUR", START, END)) is None
+
+
+def test_miss_calls_the_api_once(tmp_path, api_calls):
+    cache = ResponseCache(tmp_path)
+    assert _get(cache) == RAW
+    #  The second run of the interval is served from the cache
+    assert _get(cache) == RAW
+    assert api_calls == ["USD"]
+
+
+def test_replay_miss_never_calls_the_api(tmp_path, api_calls):
+    with pytest.raises(LookupError):
+        _get(ResponseCache(tmp_path, mode="replay"))
+    assert api_calls == []
+
+
+def test_replay_reads_the_cached_response(tmp_path, api_calls):
+    _get(ResponseCache(tmp_path))
+    assert _get(ResponseCache(tmp_path, mode="replay")) == RAW
+    assert api_calls == ["USD"]
+
+
+def test_evict_removes_the_oldest_entries_over_max_bytes(tmp_path):
+    cache = ResponseCache(tmp_path)
+    old, new = cache.build_key("USD", START, END), cache.build_key("EUR", START, END)
+    for age, key in ((60, old), (0, new)):
+        cache.put(key, RAW)
+        mtime = os.path.getmtime(cache._path(key)) - age
+        os.utime(cache._path(key), (mtime, mtime))
+    cache.max_bytes = os.path.getsize(cache._path(new))
+    cache.evict()
+    assert cache.get(old) is None
+    assert cache.get(new) == RAW
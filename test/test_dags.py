@@ -1,15 +1,63 @@
 import os
 import sys
+import json
+import subprocess
 import pytest
 from airflow.models import DagBag
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../dags"))
 
+ROOT_DIR = os.path.join(os.path.dirname(__file__), "..")
+# Seconds allowed to parse one DAG file, override with DAG_PARSE_BUDGET_SECONDS
+PARSE_BUDGET_SECONDS = float(os.getenv("DAG_PARSE_BUDGET_SECONDS", 2))
+HEAVY_MODULES = ["utils.utils", "utils.lake", "utils.handoff", "pandas", "pyarrow"]
+
+#  Parses the DAG folder in a clean interpreter and reports what the parse touched
+PARSE_SCRIPT = """
+import sys, json
+from airflow.models import DagBag, Variable
+calls = []
+Variable.get = classmethod(lambda cls, key, *args, **kwargs: calls.append(key))
+dag_bag = DagBag(dag_folder=sys.argv[1], include_examples=False)
+print(json.dumps({
+    "import_errors": dag_bag.import_errors,
+    "variable_calls": calls,
+    "heavy_modules": [m for m in sys.argv[2:] if m in sys.modules],
+    "durations": {s.file: s.duration.total_seconds() for s in dag_bag.dagbag_stats},
+}))
+"""
+
+
 @pytest.fixture(params=["../dags/"])
 def dag_bag(request):
     return DagBag(dag_folder=request.param, include_examples=False)
 
 
 def test_no_import_errors(dag_bag):
-    pass
-    #assert not dag_bag.import_errors
\ No newline at end of file
+    assert not dag_bag.import_errors
+
+
+@pytest.fixture(scope="module")
+def parse_report():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT_DIR, os.path.join(ROOT_DIR, "dags")]))
+    output = subprocess.run(
+        [sys.executable, "-c", PARSE_SCRIPT, os.path.join(ROOT_DIR, "dags"), *HEAVY_MODULES],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_parse_does_not_read_variables(parse_report):
+    assert parse_report["variable_calls"] == []
+
+
+def test_parse_does_not_import_heavy_modules(parse_report):
+    assert parse_report["heavy_modules"] == []
+
+
+def test_parse_time_budget(parse_report):
+    slow = {f: d for f, d in parse_report["durations"].items() if d > PARSE_BUDGET_SECONDS}
+    assert not slow
@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.utils import (  # noqa: E402
+    STG_DTYPES,
+    build_snapshot_frame,
+    summarize_stg_frame,
+    unify_categories,
+)
+
+
+def _raw(base, quotes):
+    return json.dumps(
+        {
+            "asset_id_base": base,
+            "rates": [
+                {"time": "2023-12-01T05:59:58.1234567Z", "asset_id_quote": quote, "rate": rate}
+                for rate, quote in enumerate(quotes, start=1)
+            ],
+        }
+    ).encode()
+
+
+@pytest.fixture
+def snapshot():
+    return build_snapshot_frame(
+        [_raw("USD", ["BTC", "ETH", "SOL"]), _raw("EUR", ["ETH", "ADA"])], ["USD", "EUR"]
+    )
+
+
+def test_snapshot_frame_keeps_the_currencies_as_categories(snapshot):
+    assert snapshot.dtypes["Moneda"] == "category"
+    assert snapshot.dtypes["Base"] == "category"
+    assert snapshot.dtypes["Precio"] == "float64"
+    assert snapshot["Moneda"].astype(str).tolist() == ["BTC", "ETH", "SOL", "ETH", "ADA"]
+    assert snapshot["Base"].astype(str).tolist() == ["USD"] * 3 + ["EUR"] * 2
+
+
+def test_snapshot_frame_fails_on_a_missing_currency():
+    with pytest.raises(ValueError):
+        build_snapshot_frame([_raw("USD", ["BTC"]), None], ["USD", "EUR"])
+
+
+def test_unify_categories_shares_the_categories():
+    left = pd.DataFrame({"moneda": ["BTC", "ETH"]}).astype("category")
+    right = pd.DataFrame({"moneda": ["ETH", "ADA"]}).astype("category")
+    left, right = unify_categories([left, right], ["moneda"])
+    assert left["moneda"].cat.categories.equals(right["moneda"].cat.categories)
+    assert pd.concat([left, right]).dtypes["moneda"] == "category"
+
+
+def test_summarize_stg_frame_uses_the_stg_dtypes(snapshot):
+    df = summarize_stg_frame(snapshot, base_currency="EUR")
+    assert df.dtypes.astype(str).to_dict() == STG_DTYPES
+    assert sorted(df["moneda"].astype(str)) == ["ADA", "ETH"]
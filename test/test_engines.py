@@ -0,0 +1,51 @@
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+pytest.importorskip("psycopg2")
+
+from utils import utils  # noqa: E402
+from utils.utils import connect_to_dwh, dispose_engines  # noqa: E402
+
+PARAMS = {
+    "dwh_host": "redshift.example.com",
+    "dwh_name": "dev",
+    "dwh_user": "etl",
+    "dwh_port": 5439,
+    "dwh_password": "secret",
+}
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    yield
+    dispose_engines()
+
+
+def test_same_parameters_reuse_the_engine():
+    engine = connect_to_dwh(**PARAMS)
+    assert connect_to_dwh(**PARAMS) is engine
+    assert connect_to_dwh(**{**PARAMS, "dwh_user": "alerts"}) is not engine
+    assert len(utils._ENGINES) == 2
+
+
+def test_pool_settings_are_part_of_the_key():
+    engine = connect_to_dwh(**PARAMS, pool_size=2, pool_recycle=60)
+    assert connect_to_dwh(**PARAMS, pool_size=3) is not engine
+    assert engine.pool.size() == 2
+    assert engine.pool._recycle == 60
+    assert engine.pool._pre_ping
+
+
+def test_the_password_is_not_kept_in_the_key():
+    connect_to_dwh(**PARAMS)
+    assert all(PARAMS["dwh_password"] not in str(key) for key in utils._ENGINES)
+
+
+def test_dispose_engines_empties_the_registry():
+    engine = connect_to_dwh(**PARAMS)
+    dispose_engines()
+    assert utils._ENGINES == {}
+    assert connect_to_dwh(**PARAMS) is not engine
@@ -0,0 +1,48 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import handoff as handoff_module  # noqa: E402
+from utils.handoff import FrameHandoff  # noqa: E402
+
+pytestmark = pytest.mark.skipif(handoff_module.pa is None, reason="pyarrow no disponible")
+
+
+@pytest.fixture
+def df_stg():
+    return pd.DataFrame(
+        {
+            "Moneda": pd.Categorical(["BTC", "ETH", "BTC"]),
+            "Base": pd.Categorical(["USD", "USD", "EUR"]),
+            "Precio": [42000.5, 2200.25, 39000.0],
+            "created_at": pd.to_datetime(["2023-12-01 05:59:58"] * 3),
+        }
+    )
+
+
+def test_write_read_round_trip(tmp_path, df_stg):
+    handoff = FrameHandoff(tmp_path)
+    path = handoff.write(df_stg, "crypto_stg_2023-12-01T06:00:00+00:00")
+    #  The name is sanitized so the path is safe to pass through XCom
+    assert os.path.dirname(path) == str(tmp_path)
+    assert os.path.basename(path) == "crypto_stg_2023-12-01T0600000000.arrow"
+    pd.testing.assert_frame_equal(handoff.read(path), df_stg)
+
+
+def test_read_of_a_missing_file_returns_none(tmp_path):
+    handoff = FrameHandoff(tmp_path)
+    assert handoff.read(None) is None
+    assert handoff.read(os.path.join(tmp_path, "missing.arrow")) is None
+
+
+def test_write_evicts_the_expired_files(tmp_path, df_stg):
+    handoff = FrameHandoff(tmp_path, max_age_hours=1)
+    old = handoff.write(df_stg, "crypto_stg_old")
+    mtime = os.path.getmtime(old) - 2 * 60 * 60
+    os.utime(old, (mtime, mtime))
+    new = handoff.write(df_stg, "crypto_stg_new")
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
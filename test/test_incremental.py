@@ -0,0 +1,87 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.backends import DuckDBBackend  # noqa: E402
+from utils.utils import (  # noqa: E402
+    fingerprint_frame,
+    filter_changed_rows,
+    filter_new_rows,
+)
+
+TABLE = "crypto"
+SCHEMA = "public"
+NO_FINGERPRINTS = pd.DataFrame(columns=["Moneda", "Base", "fingerprint"])
+
+
+def _snapshot(prices, created_at):
+    return pd.DataFrame(
+        {
+            "Moneda": pd.Categorical(["BTC", "ETH", "SOL"]),
+            "Base": pd.Categorical(["USD"] * 3),
+            "Precio": prices,
+            "created_at": pd.to_datetime(created_at),
+        }
+    )
+
+
+@pytest.fixture
+def snapshot():
+    return _snapshot(
+        [42000.0, 2200.0, 60.0],
+        ["2023-12-01 05:59:58.1234567", "2023-12-01 05:59:58.5", "2023-12-01 05:59:59.0"],
+    )
+
+
+def test_filter_new_rows_uses_the_watermark_per_coin(snapshot):
+    df_watermark = pd.DataFrame(
+        {
+            "Moneda": ["BTC", "ETH"],
+            "Base": ["USD", "USD"],
+            #  BTC was loaded with microsecond precision, ETH is older than the snapshot
+            "watermark": pd.to_datetime(["2023-12-01 05:59:58.123456", "2023-12-01 05:00:00.0"]),
+        }
+    )
+    df = filter_new_rows(snapshot, df_watermark)
+    #  SOL has no watermark and is kept
+    assert df["Moneda"].astype(str).tolist() == ["ETH", "SOL"]
+
+
+def test_fingerprint_ignores_the_sub_microsecond_resolution(snapshot):
+    floored = snapshot.assign(created_at=snapshot["created_at"].dt.floor("us"))
+    assert (fingerprint_frame(snapshot) == fingerprint_frame(floored)).all()
+    assert (fingerprint_frame(snapshot) != fingerprint_frame(snapshot.assign(Precio=1.0))).all()
+
+
+def test_filter_changed_rows_keeps_new_and_changed_coins(snapshot):
+    df, df_fingerprint = filter_changed_rows(snapshot, NO_FINGERPRINTS)
+    assert len(df) == len(snapshot)
+    #  SOL was never loaded
+    df_fingerprint = df_fingerprint[df_fingerprint["Moneda"] != "SOL"]
+
+    changed = snapshot.assign(Precio=[42000.0, 2300.0, 60.0])
+    df, df_new_fingerprint = filter_changed_rows(changed, df_fingerprint)
+    assert df["Moneda"].astype(str).tolist() == ["ETH", "SOL"]
+    assert df_new_fingerprint["Moneda"].astype(str).tolist() == ["ETH", "SOL"]
+    assert (df_new_fingerprint["fingerprint"].to_numpy() == fingerprint_frame(df)).all()
+
+
+@pytest.mark.parametrize("mode", [{"incremental": True}, {"change_detection": True}])
+def test_a_replayed_snapshot_is_not_merged_again(snapshot, mode):
+    pytest.importorskip("duckdb")
+    backend = DuckDBBackend(":memory:")
+    params = dict(table_name=TABLE, schema=SCHEMA, executed_at="'2023-12-01'", **mode)
+    backend.load(df=snapshot, updated_at="'2023-12-01T06:00:00+00:00'", **params)
+    #  The replay is filtered out, a MERGE would overwrite updated_at
+    backend.load(df=snapshot, updated_at="'2023-12-01T07:00:00+00:00'", **params)
+    later = _snapshot([42000.0, 2300.0, 61.0], ["2023-12-01 06:59:58.0"] * 3)
+    backend.load(df=later, updated_at="'2023-12-01T07:00:00+00:00'", **params)
+    rows = backend.query(
+        f"SELECT moneda, precio, updated_at FROM {SCHEMA}.{TABLE} ORDER BY moneda, created_at"
+    )
+    backend.close()
+    assert rows["precio"].tolist() == [42000.0, 42000.0, 2200.0, 2300.0, 60.0, 61.0]
+    assert rows["updated_at"].dt.hour.tolist() == [6, 7] * 3
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.utils import build_dataframe  # noqa: E402
+
+COLUMNS = ["Moneda", "Base", "Precio", "created_at"]
+
+
+def _payload(base, size, seed):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2023-12-01T05:59:00")
+    return {
+        "asset_id_base": base,
+        "rates": [
+            {
+                "time": (start + pd.Timedelta(microseconds=int(offset))).strftime(
+                    "%Y-%m-%dT%H:%M:%S.%f0Z"
+                ),
+                "asset_id_quote": f"C{quote}",
+                "rate": rate,
+            }
+            for offset, quote, rate in zip(
+                rng.integers(0, 10**8, size),
+                rng.integers(0, size // 2, size),
+                rng.uniform(1e-6, 10, size),
+            )
+        ],
+    }
+
+
+@pytest.fixture
+def payload():
+    return _payload("USD", 500, 3)
+
+
+def _normalized(df):
+    return df[COLUMNS].astype({"Moneda": str, "Base": str})
+
+
+@pytest.mark.parametrize("raw", [True, False])
+def test_columnar_parser_matches_normalize(payload, raw):
+    json_data = json.dumps(payload).encode() if raw else payload
+    result = build_dataframe(json_data)
+    reference = build_dataframe(payload, parser="normalize")
+    assert result.dtypes["Moneda"] == "category"
+    pd.testing.assert_frame_equal(_normalized(result), _normalized(reference))
+
+
+def test_columnar_parser_with_empty_rates():
+    raw = json.dumps({"asset_id_base": "USD", "rates": []}).encode()
+    df = build_dataframe(raw)
+    assert df.empty
+    assert list(df.columns) == COLUMNS
@@ -0,0 +1,111 @@
+import os
+import sys
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.ratelimit import TokenBucket, backoff_delay, parse_retry_after  # noqa: E402
+from utils.settings import COINAPI_BACKOFF_MAX  # noqa: E402
+from utils.utils import get_coin_api_information  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, content=b'{"rates": []}'):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def bucket(clock):
+    return TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+
+
+def test_bucket_allows_a_burst_then_the_rate(bucket, clock):
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.sleeps == [0.5, 0.5]
+    assert clock.now == 1.0
+
+
+def test_pause_blocks_and_empties_the_bucket(bucket, clock):
+    bucket.pause(10)
+    bucket.acquire()
+    #  After the pause the bucket starts empty, no burst is sent
+    assert clock.now == pytest.approx(10.5)
+
+
+def test_bucket_without_rate_never_waits(clock):
+    bucket = TokenBucket(rate=0, capacity=1, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 50 < parse_retry_after(retry_at) <= 60
+
+
+def test_retry_after_has_priority_over_the_backoff():
+    assert backoff_delay(5, base=1, cap=30, retry_after=7) == 7
+    assert 0 <= backoff_delay(10, base=1, cap=30) <= 30
+
+
+def test_429_pauses_the_bucket_for_retry_after(bucket, clock):
+    session = FakeSession(
+        [FakeResponse(429, {"Retry-After": "4"}), FakeResponse(200, content=b"{}")]
+    )
+    content = get_coin_api_information(
+        "USD", "https://rest.coinapi.io/v1/exchangerate", "key", session=session, raw=True, rate_limiter=bucket
+    )
+    assert content == b"{}"
+    assert session.calls == 2
+    assert clock.now >= 4
+
+
+def test_exhausted_quota_is_not_retried(bucket, clock):
+    session = FakeSession([FakeResponse(429, {"Retry-After": str(COINAPI_BACKOFF_MAX + 60)})])
+    content = get_coin_api_information(
+        "USD", "https://rest.coinapi.io/v1/exchangerate", "key", session=session, rate_limiter=bucket
+    )
+    assert content is None
+    assert session.calls == 1
+    assert clock.sleeps == []
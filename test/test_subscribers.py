@@ -0,0 +1,82 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.utils import (  # noqa: E402
+    STG_DTYPES,
+    build_subscribers,
+    calculate_summary_crypto,
+    calculate_summary_subscribers,
+    filter_price_band,
+    select_top_k,
+)
+
+SUBSCRIBERS = [
+    {"email": "a@example.com"},
+    {"email": "b@example.com", "max_price": 100, "top_k": 3},
+    {"email": "c@example.com", "min_price": 50, "top_k": 8},
+    {"email": "d@example.com", "min_price": 500, "max_price": 600},
+]
+
+
+def _prices(rng, size, base="USD"):
+    return pd.DataFrame(
+        {
+            "moneda": [f"C{i}" for i in range(size)],
+            "base": base,
+            #  Rounded prices so some coins tie
+            "precio": rng.uniform(1, 200, size).round(0),
+        }
+    ).astype(STG_DTYPES)
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(9)
+    #  One coin in another base currency and one without history
+    df_stg = _prices(rng, 60, base=["USD", "EUR"] + ["USD"] * 58)
+    df_hist = _prices(rng, 60).iloc[1:]
+    return df_stg, df_hist
+
+
+def test_build_subscribers_fills_the_defaults():
+    df = build_subscribers(SUBSCRIBERS, "alerts@example.com", 10, 150, top_k=5)
+    assert df["min_price"].tolist() == [10, 10, 50, 500]
+    assert df["max_price"].tolist() == [150, 100, 150, 600]
+    assert df["top_k"].tolist() == [5, 3, 8, 5]
+    assert build_subscribers("[]", "alerts@example.com", 10, 150)["email"].tolist() == [
+        "alerts@example.com"
+    ]
+
+
+def test_select_top_k_keeps_the_first_row_on_ties():
+    values = np.array([3.0, 5.0, 5.0, np.nan, 1.0])
+    masks = np.array([[True] * 5, [True, False, True, True, True]])
+    subscriber, rows = select_top_k(values, masks, np.array([2, 5]))
+    assert subscriber.tolist() == [0, 0, 1, 1, 1]
+    assert rows.tolist() == [1, 2, 2, 0, 4]
+
+
+def test_subscribers_match_one_summary_per_subscriber(frames):
+    df_stg, df_hist = frames
+    df_subscribers = build_subscribers(SUBSCRIBERS, "alerts@example.com", 10, 150)
+    results = calculate_summary_subscribers(df_stg, df_hist, df_subscribers)
+    assert len(results) == len(df_subscribers)
+
+    for subscriber, result in zip(df_subscribers.itertuples(), results):
+        expected = calculate_summary_crypto(
+            filter_price_band(df_stg, subscriber.min_price, subscriber.max_price),
+            filter_price_band(df_hist, subscriber.min_price, subscriber.max_price),
+            top_k=subscriber.top_k,
+        )
+        for frame, reference in zip(result, expected):
+            pd.testing.assert_frame_equal(
+                frame[reference.columns].reset_index(drop=True),
+                reference,
+                check_dtype=False,
+                check_categorical=False,
+            )
@@ -0,0 +1,84 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+pytest.importorskip("duckdb")
+
+from utils.backends import DuckDBBackend  # noqa: E402
+from utils.utils import calculate_summary_crypto  # noqa: E402
+
+TABLE = "crypto"
+SCHEMA = "public"
+MONEDAS = [f"C{i}" for i in range(30)]
+TOP_K = 5
+
+
+@pytest.fixture(scope="module")
+def backend():
+    rng = np.random.default_rng(5)
+    frames = []
+    for day in pd.date_range("2023-12-01", periods=6):
+        for base in ("USD", "EUR"):
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "Moneda": MONEDAS,
+                        "Base": base,
+                        "Precio": rng.uniform(1, 200, len(MONEDAS)),
+                        "created_at": day + pd.Timedelta(hours=5),
+                        "updated_at": day + pd.Timedelta(days=1, hours=6),
+                        "executed_at": (day + pd.Timedelta(days=1)).date(),
+                    }
+                )
+            )
+    snapshot = pd.DataFrame(
+        {
+            "Moneda": MONEDAS * 2,
+            "Base": ["USD"] * len(MONEDAS) + ["EUR"] * len(MONEDAS),
+            "Precio": rng.uniform(1, 200, 2 * len(MONEDAS)),
+            "created_at": pd.Timestamp("2023-12-07T05:00"),
+        }
+    )
+    backend = DuckDBBackend(":memory:")
+    backend.backfill(df=pd.concat(frames, ignore_index=True), table_name=TABLE, schema=SCHEMA, rollup=True)
+    backend.load(
+        df=snapshot,
+        table_name=TABLE,
+        schema=SCHEMA,
+        executed_at="'2023-12-07'",
+        updated_at="'2023-12-07T06:00:00+00:00'",
+        rollup=True,
+    )
+    yield backend
+    backend.close()
+
+
+def _normalized(df, columns):
+    codes = [column for column in columns if column == "moneda" or column.startswith("base")]
+    return df[columns].astype({column: str for column in codes})
+
+
+@pytest.mark.parametrize("base_currency", ["USD", None])
+@pytest.mark.parametrize("source", [{}, {"use_rollup": True}, {"use_tiers": True}])
+def test_pushdown_matches_pandas_summary(backend, base_currency, source):
+    params = dict(
+        table_name=TABLE,
+        schema=SCHEMA,
+        updated_at="'2023-12-07'",
+        min_price=20,
+        max_price=150,
+        base_currency=base_currency,
+        **source,
+    )
+    pushdown = backend.summary_pushdown(top_k=TOP_K, **params)
+    reference = calculate_summary_crypto(*backend.summary_frames(**params), top_k=TOP_K)
+    for result, expected in zip(pushdown, reference):
+        assert len(result) == TOP_K
+        columns = result.columns.tolist()
+        pd.testing.assert_frame_equal(
+            _normalized(result, columns), _normalized(expected, columns), check_dtype=False
+        )
@@ -0,0 +1,121 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+pytest.importorskip("duckdb")
+
+from utils.backends import DuckDBBackend  # noqa: E402
+from utils.utils import build_tiers_history_sql  # noqa: E402
+
+TABLE = "crypto"
+SCHEMA = "public"
+DAYS = 20
+COMPACT_UNTIL = "2023-12-15"
+RETENTION_DAYS = 5
+
+
+@pytest.fixture
+def snapshots():
+    rng = np.random.default_rng(11)
+    frames = []
+    for day in pd.date_range("2023-12-01", periods=DAYS):
+        for hour in (5, 11, 17):
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "Moneda": ["BTC", "ETH", "SOL"],
+                        "Base": "USD",
+                        "Precio": rng.uniform(10, 100, 3),
+                        "created_at": day + pd.Timedelta(hours=hour),
+                        "updated_at": day + pd.Timedelta(days=1, hours=6),
+                        "executed_at": (day + pd.Timedelta(days=1)).date(),
+                    }
+                )
+            )
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.fixture
+def backend(snapshots):
+    backend = DuckDBBackend(":memory:")
+    backend.backfill(df=snapshots, table_name=TABLE, schema=SCHEMA, rollup=True)
+    backend.compact_tiers(
+        table_name=TABLE,
+        schema=SCHEMA,
+        compact_until=COMPACT_UNTIL,
+        retention_days=RETENTION_DAYS,
+    )
+    yield backend
+    backend.close()
+
+
+def _state(backend):
+    daily = backend.query(
+        f"SELECT moneda, fecha, suma_precio, conteo FROM {SCHEMA}.{TABLE}_daily ORDER BY moneda, fecha"
+    )
+    history = backend.query(
+        f"SELECT moneda, SUM(suma_precio) AS suma_precio, SUM(conteo) AS conteo "
+        f"FROM ({build_tiers_history_sql(TABLE, SCHEMA)}) niveles GROUP BY moneda ORDER BY moneda"
+    )
+    hist_avg = backend.query(f"SELECT * FROM {SCHEMA}.{TABLE}_hist_avg ORDER BY moneda")
+    return daily, history, hist_avg
+
+
+def _assert_same_state(backend, expected):
+    for result, reference in zip(_state(backend), expected):
+        pd.testing.assert_frame_equal(result, reference, check_dtype=False)
+
+
+def test_compaction_keeps_every_row(backend, snapshots):
+    _, history, hist_avg = _state(backend)
+    assert history["conteo"].sum() == len(snapshots)
+    assert hist_avg["conteo"].sum() == len(snapshots)
+    #  Rows before the horizon only live in the tiers
+    assert backend.query(f"SELECT MIN(created_at) AS m FROM {SCHEMA}.{TABLE}")["m"][0] >= pd.Timestamp("2023-12-10")
+
+
+def test_backfill_replay_of_a_compacted_range_is_idempotent(backend, snapshots):
+    expected = _state(backend)
+    backend.backfill(df=snapshots, table_name=TABLE, schema=SCHEMA, rollup=True)
+    backend.compact_tiers(
+        table_name=TABLE,
+        schema=SCHEMA,
+        compact_until=COMPACT_UNTIL,
+        retention_days=RETENTION_DAYS,
+    )
+    _assert_same_state(backend, expected)
+
+
+def test_load_replay_of_a_compacted_day_is_idempotent(backend, snapshots):
+    expected = _state(backend)
+    old_day = snapshots[snapshots["created_at"] < "2023-12-03"]
+    backend.load(
+        df=old_day[["Moneda", "Base", "Precio", "created_at"]],
+        table_name=TABLE,
+        schema=SCHEMA,
+        executed_at="'2023-12-03'",
+        updated_at="'2023-12-03T06:00:00+00:00'",
+        rollup=True,
+    )
+    backend.compact_tiers(
+        table_name=TABLE,
+        schema=SCHEMA,
+        compact_until=COMPACT_UNTIL,
+        retention_days=RETENTION_DAYS,
+    )
+    _assert_same_state(backend, expected)
+
+
+def test_rows_after_the_compacted_range_are_merged(backend, snapshots):
+    late = snapshots[snapshots["created_at"] >= "2023-12-14"].assign(
+        created_at=lambda df: df["created_at"] + pd.Timedelta(minutes=30)
+    )
+    backend.backfill(df=late, table_name=TABLE, schema=SCHEMA, rollup=True)
+    _, _, hist_avg = _state(backend)
+    #  Only the rows of the open days are added
+    open_rows = (late["created_at"] >= COMPACT_UNTIL).sum()
+    assert hist_avg["conteo"].sum() == len(snapshots) + open_rows
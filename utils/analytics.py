@@ -0,0 +1,215 @@
+"""
+Author: Victor Velasco
+Name: analytics
+
+Description: This file contains the rolling analytics of the crypto prices (moving averages,
+volatility, max drawdown and momentum). The daily prices of every coin are placed in a dense
+coins x days matrix so every metric is computed for all the coins at once with NumPy, and only
+a trailing buffer of prices is kept as state so every run only adds the new days
+"""
+
+# Library imports
+import os
+import logging  # For create logs
+import numpy as np
+import pandas as pd
+
+#  Windows in calendar days
+MA_WINDOWS = (7, 30, 90)
+VOLATILITY_WINDOW = 30
+DRAWDOWN_WINDOW = 90
+MOMENTUM_WINDOW = 30
+#  Days of prices needed to compute the metrics of one new day
+BUFFER_DAYS = max(MA_WINDOWS + (VOLATILITY_WINDOW + 1, DRAWDOWN_WINDOW, MOMENTUM_WINDOW + 1))
+
+KEYS = ["moneda", "base"]
+PRICE_COLUMNS = KEYS + ["fecha", "precio"]
+METRIC_COLUMNS = [f"ma_{window}" for window in MA_WINDOWS] + [
+    f"volatilidad_{VOLATILITY_WINDOW}",
+    f"max_drawdown_{DRAWDOWN_WINDOW}",
+    f"momentum_{MOMENTUM_WINDOW}",
+]
+
+
+def daily_prices(df):
+    """
+    Esta función obtiene el precio diario de cada moneda, el último precio por created_at de cada día
+    ->df: DataFrame de la tabla crypto con las columnas moneda, base, precio, created_at y executed_at
+    ->return: DataFrame con las columnas moneda, base, fecha y precio
+    """
+    df = df.sort_values("created_at", kind="stable").drop_duplicates(
+        subset=["moneda", "base", "executed_at"], keep="last"
+    )
+    return pd.DataFrame(
+        {
+            "moneda": df["moneda"].astype(str).to_numpy(),
+            "base": df["base"].astype(str).to_numpy(),
+            "fecha": pd.to_datetime(df["executed_at"]).dt.normalize().to_numpy(),
+            "precio": df["precio"].to_numpy(dtype="float64"),
+        }
+    )
+
+
+def _window_sum(cumulative, days, window):
+    """
+    Suma de las últimas window columnas usando la suma acumulada (con una columna de ceros al inicio)
+    """
+    return cumulative[:, days + 1] - cumulative[:, np.maximum(days + 1 - window, 0)]
+
+
+def _cumulative(values):
+    return np.concatenate(
+        [np.zeros((values.shape[0], 1)), np.nancumsum(values, axis=1)], axis=1
+    )
+
+
+def compute_rolling_metrics(prices, dates=None):
+    """
+    Esta función calcula las métricas móviles de todas las monedas para las fechas dadas
+    ->prices: DataFrame con las columnas moneda, base, fecha y precio (ver daily_prices), debe
+              incluir los BUFFER_DAYS días anteriores a las fechas a calcular
+    ->dates: Fechas a calcular (opcional), por defecto todas las fechas de prices
+    *Las ventanas son de días calendario y usan los días disponibles, los días sin precio se ignoran
+    *ma_N: promedio del precio de los últimos N días
+    *volatilidad_30: desviación estándar de los retornos logarítmicos diarios de los últimos 30 días
+    *max_drawdown_90: mayor caída (negativa) desde un máximo dentro de los últimos 90 días
+    *momentum_30: cambio relativo contra el precio de hace 30 días (NaN si ese día no tiene precio)
+    ->return: DataFrame con una fila por moneda y fecha con precio, con las columnas de PRICE_COLUMNS
+              y METRIC_COLUMNS
+    """
+    if prices.empty:
+        return pd.DataFrame(columns=PRICE_COLUMNS + METRIC_COLUMNS)
+
+    #  Dense matrix coins x days, NaN where a coin has no price
+    moneda_code, monedas = pd.factorize(prices["moneda"])
+    base_code, bases = pd.factorize(prices["base"])
+    coin, pairs = pd.factorize(moneda_code.astype(np.int64) * len(bases) + base_code)
+    fecha = pd.to_datetime(prices["fecha"]).to_numpy(dtype="datetime64[D]")
+    first_day = fecha.min()
+    day = (fecha - first_day).astype(np.int64)
+    matrix = np.full((len(pairs), day.max() + 1), np.nan)
+    matrix[coin, day] = prices["precio"].to_numpy(dtype="float64")
+
+    if dates is None:
+        days = np.unique(day)
+    else:
+        days = (
+            pd.to_datetime(pd.Index(dates)).to_numpy(dtype="datetime64[D]") - first_day
+        ).astype(np.int64)
+        days = np.unique(days[(days >= 0) & (days < matrix.shape[1])])
+
+    observed = ~np.isnan(matrix)
+    price_sum = _cumulative(matrix)
+    price_count = _cumulative(observed.astype(float))
+
+    metrics = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for window in MA_WINDOWS:
+            metrics[f"ma_{window}"] = _window_sum(price_sum, days, window) / _window_sum(
+                price_count, days, window
+            )
+
+        #  Daily log returns, only between consecutive days with price
+        returns = np.full(matrix.shape, np.nan)
+        returns[:, 1:] = np.log(matrix[:, 1:] / matrix[:, :-1])
+        return_sum = _cumulative(returns)
+        return_square = _cumulative(returns**2)
+        return_count = _cumulative((~np.isnan(returns)).astype(float))
+        n = _window_sum(return_count, days, VOLATILITY_WINDOW)
+        mean = _window_sum(return_sum, days, VOLATILITY_WINDOW) / n
+        variance = (
+            _window_sum(return_square, days, VOLATILITY_WINDOW) - n * mean**2
+        ) / (n - 1)
+        metrics[f"volatilidad_{VOLATILITY_WINDOW}"] = np.where(
+            n > 1, np.sqrt(np.maximum(variance, 0)), np.nan
+        )
+
+        #  Running peak inside the window of every requested day, fmax ignores the missing days
+        drawdown = np.full((len(pairs), len(days)), np.nan)
+        for position, current in enumerate(days):
+            window = matrix[:, max(0, current + 1 - DRAWDOWN_WINDOW) : current + 1]
+            peak = np.fmax.accumulate(window, axis=1)
+            drawdown[:, position] = np.nanmin(
+                np.where(np.isnan(window), np.inf, window / peak - 1), axis=1
+            )
+        metrics[f"max_drawdown_{DRAWDOWN_WINDOW}"] = np.where(
+            np.isinf(drawdown), np.nan, drawdown
+        )
+
+        past = days - MOMENTUM_WINDOW
+        momentum = np.full((len(pairs), len(days)), np.nan)
+        valid = past >= 0
+        momentum[:, valid] = matrix[:, days[valid]] / matrix[:, past[valid]] - 1
+        metrics[f"momentum_{MOMENTUM_WINDOW}"] = momentum
+
+    #  Back to long format, one row per coin and day with price
+    rows, columns = np.nonzero(observed[:, days])
+    result = pd.DataFrame(
+        {
+            "moneda": np.asarray(monedas)[pairs[rows] // len(bases)],
+            "base": np.asarray(bases)[pairs[rows] % len(bases)],
+            "fecha": first_day + days[columns],
+            "precio": matrix[rows, days[columns]],
+        }
+    )
+    for name in METRIC_COLUMNS:
+        result[name] = metrics[name][rows, columns]
+    result["fecha"] = pd.to_datetime(result["fecha"])
+    return result.astype({"moneda": "category", "base": "category"})
+
+
+class AnalyticsState:
+    """
+    Buffer con los precios diarios de los últimos BUFFER_DAYS días guardado en Parquet, permite
+    calcular las métricas de los días nuevos sin leer todo el histórico
+    ->state_dir: Directorio donde se guarda el buffer
+    ->name: Nombre del archivo (ej: crypto)
+    """
+
+    def __init__(self, state_dir, name):
+        self.path = os.path.join(state_dir, f"{name}_analytics_state.parquet")
+        self.reset()
+        if os.path.exists(self.path):
+            self.prices = pd.read_parquet(self.path)
+            logging.info(f"Estado de analítica leído desde {self.path}, filas: {len(self.prices)}")
+
+    @property
+    def last_date(self):
+        """
+        ->return: Última fecha del buffer o None si está vacío
+        """
+        return None if self.prices.empty else pd.Timestamp(self.prices["fecha"].max())
+
+    def reset(self):
+        """
+        Descarta los precios del buffer
+        """
+        self.prices = pd.DataFrame(columns=PRICE_COLUMNS)
+
+    def update(self, new_prices):
+        """
+        Agrega los precios de los días nuevos, calcula sus métricas y recorta el buffer
+        ->new_prices: DataFrame con las columnas moneda, base, fecha y precio (ver daily_prices)
+        *Si un día ya existe en el buffer se reemplaza por el precio nuevo
+        ->return: DataFrame con las métricas de las fechas de new_prices
+        """
+        if new_prices.empty:
+            return compute_rolling_metrics(new_prices)
+        new_prices = new_prices[PRICE_COLUMNS].astype({"fecha": "datetime64[ns]"})
+        frames = [self.prices.astype({"fecha": "datetime64[ns]"}), new_prices]
+        prices = pd.concat([df for df in frames if not df.empty], ignore_index=True)
+        prices = prices.drop_duplicates(subset=KEYS + ["fecha"], keep="last")
+        result = compute_rolling_metrics(prices, dates=new_prices["fecha"].unique())
+        horizon = prices["fecha"].max() - pd.Timedelta(days=BUFFER_DAYS - 1)
+        self.prices = prices[prices["fecha"] >= horizon].reset_index(drop=True)
+        return result
+
+    def save(self):
+        """
+        Guarda el buffer de forma atómica
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self.prices.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+        logging.info(f"Estado de analítica guardado en {self.path}, filas: {len(self.prices)}")
@@ -0,0 +1,165 @@
+"""
+Author: Victor Velasco
+Name: anomaly
+
+Description: This file contains the anomaly detector of the crypto prices. For every coin and base
+currency it keeps streaming statistics of the log return between snapshots (Welford mean and
+variance and an EWMA mean and variance) in a small Parquet state, every snapshot updates all the
+coins in one vectorized step and the returns with a high z-score are flagged for the alert email
+"""
+
+# Library imports
+import os
+import logging  # For create logs
+import numpy as np
+import pandas as pd
+
+KEYS = ["moneda", "base"]
+STATE_DTYPES = {
+    "last_price": "float64",
+    "last_created_at": "datetime64[ns]",
+    "count": "int64",
+    "mean": "float64",
+    "m2": "float64",
+    "ewma_mean": "float64",
+    "ewma_var": "float64",
+}
+ANOMALY_COLUMNS = KEYS + ["precio", "retorno", "z", "z_ewma"]
+
+
+class AnomalyDetector:
+    """
+    Estadísticas por moneda de los retornos logarítmicos entre snapshots, guardadas en Parquet
+    ->state_dir: Directorio donde se guarda el estado
+    ->name: Nombre del archivo (ej: crypto)
+    ->z_threshold: Valor absoluto del z-score a partir del cual un retorno es anormal
+    ->alpha: Peso del último retorno en la EWMA
+    ->min_count: Número mínimo de retornos observados antes de marcar anomalías de una moneda
+    ->min_std: Desviación estándar mínima del retorno logarítmico, evita z-scores infinitos en monedas
+               con cotización plana (ej: stablecoins o tasas sin actualizar)
+    *El z-score usa las estadísticas anteriores al snapshot, un retorno se marca si supera el umbral
+    contra la historia completa (Welford) o contra la historia reciente (EWMA)
+    """
+
+    def __init__(
+        self, state_dir, name, z_threshold=4.0, alpha=0.1, min_count=10, min_std=1e-3
+    ):
+        self.path = os.path.join(state_dir, f"{name}_anomaly_state.parquet")
+        self.z_threshold = z_threshold
+        self.alpha = alpha
+        self.min_count = min_count
+        self.min_std = min_std
+        self.state = pd.DataFrame(
+            {column: pd.Series(dtype=dtype) for column, dtype in STATE_DTYPES.items()},
+            index=pd.MultiIndex.from_arrays([[], []], names=KEYS),
+        )
+        if os.path.exists(self.path):
+            self.state = pd.read_parquet(self.path).set_index(KEYS)
+            logging.info(f"Estado de anomalías leído desde {self.path}, monedas: {len(self.state)}")
+
+    def update(self, df):
+        """
+        Actualiza las estadísticas con un snapshot y devuelve los retornos anormales
+        ->df: DataFrame construido con build_dataframe (Moneda, Base, Precio, created_at)
+        *Solo cuentan las monedas con created_at más reciente que el último observado, así al repetir
+        un snapshot (reintentos o replay de la cache) no se cuenta dos veces
+        ->return: DataFrame con las columnas de ANOMALY_COLUMNS ordenado por el z-score absoluto
+        """
+        snapshot = (
+            df.sort_values("created_at", kind="stable")
+            .drop_duplicates(subset=["Moneda", "Base"], keep="last")
+            .rename(columns={"Moneda": "moneda", "Base": "base", "Precio": "precio"})
+        )
+        index = pd.MultiIndex.from_arrays(
+            [snapshot["moneda"].astype(str), snapshot["base"].astype(str)], names=KEYS
+        )
+        prior = self.state.reindex(index)
+        price = snapshot["precio"].to_numpy(dtype="float64")
+        created_at = snapshot["created_at"].to_numpy(dtype="datetime64[ns]")
+        last_created_at = prior["last_created_at"].to_numpy(dtype="datetime64[ns]")
+        is_new = np.isnat(last_created_at) | (created_at > last_created_at)
+        is_new &= price > 0
+        if not is_new.any():
+            logging.info(f"El snapshot no tiene observaciones nuevas")
+            return pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+        count = prior["count"].fillna(0).to_numpy(dtype="int64")
+        mean = prior["mean"].fillna(0).to_numpy(dtype="float64")
+        m2 = prior["m2"].fillna(0).to_numpy(dtype="float64")
+        ewma_mean = prior["ewma_mean"].to_numpy(dtype="float64")
+        ewma_var = prior["ewma_var"].to_numpy(dtype="float64")
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = np.log(price / prior["last_price"].to_numpy(dtype="float64"))
+            has_return = is_new & np.isfinite(returns)
+
+            #  z-scores with the statistics before this snapshot, the std is floored with min_std
+            ready = has_return & (count >= self.min_count)
+            std = np.fmax(np.sqrt(m2 / (count - 1)), self.min_std)
+            ewma_std = np.fmax(np.sqrt(ewma_var), self.min_std)
+            z = np.where(ready, (returns - mean) / std, np.nan)
+            z_ewma = np.where(ready, (returns - ewma_mean) / ewma_std, np.nan)
+            #  Never flag or report a non finite score
+            z[~np.isfinite(z)] = np.nan
+            z_ewma[~np.isfinite(z_ewma)] = np.nan
+
+            #  Welford update
+            new_count = count + has_return
+            delta = np.where(has_return, returns - mean, 0.0)
+            new_mean = mean + np.where(has_return, delta / np.maximum(new_count, 1), 0.0)
+            new_m2 = m2 + np.where(has_return, delta * (returns - new_mean), 0.0)
+
+            #  EWMA update, the first return initializes the mean
+            first = has_return & np.isnan(ewma_mean)
+            diff = np.where(has_return & ~first, returns - ewma_mean, 0.0)
+            increment = self.alpha * diff
+            new_ewma_mean = np.where(first, returns, ewma_mean + increment)
+            new_ewma_var = np.where(
+                first,
+                0.0,
+                np.where(has_return, (1 - self.alpha) * (ewma_var + diff * increment), ewma_var),
+            )
+
+        updated = pd.DataFrame(
+            {
+                "last_price": price,
+                "last_created_at": created_at,
+                "count": new_count,
+                "mean": new_mean,
+                "m2": new_m2,
+                "ewma_mean": new_ewma_mean,
+                "ewma_var": new_ewma_var,
+            },
+            index=index,
+        )[is_new]
+        self.state = pd.concat(
+            [self.state[~self.state.index.isin(updated.index)], updated]
+        ).astype(STATE_DTYPES)
+
+        score = np.fmax(np.abs(z), np.abs(z_ewma))
+        flagged = np.nan_to_num(score, nan=0.0) >= self.z_threshold
+        anomalies = pd.DataFrame(
+            {
+                "moneda": snapshot["moneda"].to_numpy()[flagged],
+                "base": snapshot["base"].to_numpy()[flagged],
+                "precio": price[flagged],
+                "retorno": np.expm1(returns[flagged]) * 100,
+                "z": z[flagged],
+                "z_ewma": z_ewma[flagged],
+            }
+        )
+        anomalies = anomalies.iloc[np.argsort(-score[flagged], kind="stable")]
+        logging.info(
+            f"Monedas actualizadas: {int(is_new.sum())}, movimientos anormales: {len(anomalies)}"
+        )
+        return anomalies.reset_index(drop=True)
+
+    def save(self):
+        """
+        Guarda el estado de forma atómica
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self.state.reset_index().to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+        logging.info(f"Estado de anomalías guardado en {self.path}, monedas: {len(self.state)}")
@@ -0,0 +1,647 @@
+"""
+Author: Victor Velasco
+Name: backends
+
+Description: This file contains the warehouse backends used by the tasks for the staging load, the
+MERGE and the summary queries. RedshiftBackend uses the functions of utils.utils and DuckDBBackend
+runs the same pipeline on an embedded DuckDB file, so the whole pipeline can run locally or in CI
+and the summaries can be served without the cluster
+"""
+
+# Library imports
+import os
+import logging  # For create logs
+from contextlib import contextmanager
+
+try:
+    import duckdb  # For the embedded columnar warehouse
+except ImportError:  # pragma: no cover - only the Redshift backend is available
+    duckdb = None
+
+from utils.metrics import measure_stage
+from utils.utils import (
+    STG_DTYPES,
+    WATERMARK_DTYPES,
+    FINGERPRINT_DTYPES,
+    SUMMARY_DTYPES,
+    connect_to_dwh,
+    create_tbl_from_df,
+    create_tbl_from_backfill,
+    append_batch_to_stg,
+    merge_stg_batches,
+    compact_tiers,
+    rebuild_hist_avg_rollup,
+    read_price_history,
+    write_analytics,
+    build_batch_frame,
+    build_consolidate_batches_sql,
+    build_compact_tiers_sql,
+    build_rebuild_rollup_sql,
+    build_price_history_sql,
+    build_compacted_until_sql,
+    compaction_limits,
+    build_df_summary,
+    build_summary_pushdown,
+    build_hist_avg_sql,
+    build_summary_sql,
+    build_watermark_sql,
+    build_rollup_sql,
+    build_fingerprint_sql,
+    filter_new_rows,
+    filter_changed_rows,
+    filter_compacted_rows,
+    filter_price_band,
+    summarize_stg_frame,
+    split_summary,
+)
+
+DWH_BACKENDS = ("redshift", "duckdb")
+
+
+class RedshiftBackend:
+    """
+    Backend del DataWarehouse en Redshift (o PostgreSQL) con SQLAlchemy
+    ->dwh_host: Host del DataWarehouse
+    ->dwh_user: Usuario del DataWarehouse
+    ->dwh_name: Database name del DataWarehouse
+    ->dwh_password: Password del DataWarehouse
+    ->dwh_port: Puerto del DataWarehouse
+    """
+
+    name = "redshift"
+
+    def __init__(self, dwh_host, dwh_user, dwh_name, dwh_password, dwh_port):
+        self.engine = connect_to_dwh(
+            dwh_host=dwh_host,
+            dwh_name=dwh_name,
+            dwh_user=dwh_user,
+            dwh_port=dwh_port,
+            dwh_password=dwh_password,
+        )
+
+    def load(self, df, table_name, schema, executed_at, updated_at, **kwargs):
+        """
+        Carga el DataFrame en staging y aplica el MERGE, ver create_tbl_from_df
+        ->return: DataFrame cargado en staging
+        """
+        return create_tbl_from_df(
+            df=df,
+            table_name=table_name,
+            schema=schema,
+            engine=self.engine,
+            executed_at=executed_at,
+            updated_at=updated_at,
+            **kwargs,
+        )
+
+    def summary_frames(self, **kwargs):
+        """
+        ->return: DataFrame de staging e histórico del resumen, ver build_df_summary
+        """
+        return build_df_summary(engine=self.engine, **kwargs)
+
+    def summary_pushdown(self, **kwargs):
+        """
+        ->return: Los tres DataFrame del resumen calculados en el DWH, ver build_summary_pushdown
+        """
+        return build_summary_pushdown(engine=self.engine, **kwargs)
+
+    def backfill(self, **kwargs):
+        """
+        Carga los intervalos del backfill y aplica un solo MERGE, ver create_tbl_from_backfill
+        """
+        return create_tbl_from_backfill(engine=self.engine, **kwargs)
+
+    def append_batch(self, **kwargs):
+        """
+        ->return: Número de filas agregadas a la tabla de micro-batches, ver append_batch_to_stg
+        """
+        return append_batch_to_stg(engine=self.engine, **kwargs)
+
+    def merge_batches(self, **kwargs):
+        """
+        ->return: Número de micro-batches aplicados sobre la tabla histórica, ver merge_stg_batches
+        """
+        return merge_stg_batches(engine=self.engine, **kwargs)
+
+    def compact_tiers(self, **kwargs):
+        """
+        Compacta la tabla histórica en los niveles diario y mensual, ver compact_tiers
+        """
+        return compact_tiers(engine=self.engine, **kwargs)
+
+    def rebuild_rollup(self, **kwargs):
+        """
+        Reconstruye la tabla de promedios históricos, ver rebuild_hist_avg_rollup
+        """
+        return rebuild_hist_avg_rollup(engine=self.engine, **kwargs)
+
+    def read_price_history(self, **kwargs):
+        """
+        ->return: DataFrame con los precios ejecutados en el rango, ver read_price_history
+        """
+        return read_price_history(engine=self.engine, **kwargs)
+
+    def write_analytics(self, **kwargs):
+        """
+        Guarda las métricas móviles, ver write_analytics
+        """
+        return write_analytics(engine=self.engine, **kwargs)
+
+    def close(self):
+        #  The pooled engines are closed with dispose_engines at task end
+        pass
+
+
+class DuckDBBackend:
+    """
+    Backend del DataWarehouse en un archivo DuckDB, las tablas se crean al conectarse
+    ->path: Ruta del archivo de la base de datos, :memory: para una base en memoria
+    *La carga lee el DataFrame directamente (sin serializar a CSV) y el MERGE se hace con DELETE e
+    INSERT en una transacción, con el mismo resultado que el MERGE (SCD I) de Redshift
+    """
+
+    name = "duckdb"
+
+    def __init__(self, path):
+        if duckdb is None:
+            raise ImportError("El backend duckdb necesita el paquete duckdb")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = duckdb.connect(path)
+        logging.info(f"Conectado a DuckDB en {path}")
+
+    def create_tables(self, table_name, schema):
+        """
+        Crea el esquema y las tablas del pipeline si no existen (equivalente a los archivos sql de los dags)
+        """
+        self.conn.execute(
+            f"""
+            CREATE SCHEMA IF NOT EXISTS {schema};
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_stg
+                (Moneda VARCHAR, Base VARCHAR, Precio DOUBLE, created_at TIMESTAMP);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_stg_merge
+                (Moneda VARCHAR, Base VARCHAR, Precio DOUBLE, created_at TIMESTAMP);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}
+                (Moneda VARCHAR, Base VARCHAR, Precio DOUBLE, created_at TIMESTAMP,
+                 updated_at TIMESTAMP, executed_at DATE);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_watermark
+                (Moneda VARCHAR, Base VARCHAR, created_at TIMESTAMP);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_hist_avg
+                (Moneda VARCHAR, Base VARCHAR, suma_precio DOUBLE, conteo BIGINT);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_fingerprint
+                (Moneda VARCHAR, Base VARCHAR, fingerprint BIGINT);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_daily
+                (Moneda VARCHAR, Base VARCHAR, fecha DATE, apertura DOUBLE, maximo DOUBLE,
+                 minimo DOUBLE, cierre DOUBLE, suma_precio DOUBLE, conteo BIGINT,
+                 apertura_at TIMESTAMP, cierre_at TIMESTAMP);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_monthly
+                (Moneda VARCHAR, Base VARCHAR, mes DATE, apertura DOUBLE, maximo DOUBLE,
+                 minimo DOUBLE, cierre DOUBLE, suma_precio DOUBLE, conteo BIGINT);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_retention
+                (horizonte DATE, compactado_hasta DATE);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_stg_batch
+                (Moneda VARCHAR, Base VARCHAR, Precio DOUBLE, created_at TIMESTAMP,
+                 updated_at TIMESTAMP, executed_at DATE, batch_id VARCHAR);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_batch_merge
+                (Moneda VARCHAR, Base VARCHAR, Precio DOUBLE, created_at TIMESTAMP,
+                 updated_at TIMESTAMP, executed_at DATE);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_backfill
+                (Moneda VARCHAR, Base VARCHAR, Precio DOUBLE, created_at TIMESTAMP,
+                 updated_at TIMESTAMP, executed_at DATE);
+            CREATE TABLE IF NOT EXISTS {schema}.{table_name}_analytics
+                (moneda VARCHAR, base VARCHAR, fecha DATE, precio DOUBLE, ma_7 DOUBLE, ma_30 DOUBLE,
+                 ma_90 DOUBLE, volatilidad_30 DOUBLE, max_drawdown_90 DOUBLE, momentum_30 DOUBLE);
+            """
+        )
+
+    @contextmanager
+    def transaction(self):
+        """
+        Abre una transacción que se confirma al salir del bloque y se revierte si hay un error
+        """
+        self.conn.execute("BEGIN TRANSACTION")
+        try:
+            yield self.conn
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def compacted_until(self, table_name, schema):
+        """
+        ->return: Primer día sin compactar de la tabla histórica, igual que read_compacted_until
+        """
+        return self.conn.execute(
+            f"SELECT {build_compacted_until_sql(table_name, schema)}"
+        ).fetchone()[0]
+
+    def merge_sql(self, table_name, schema, stg_table, updated_at, executed_at, time_range=None):
+        """
+        ->updated_at: Expresión SQL de updated_at, un literal o una columna de stg_table
+        ->executed_at: Expresión SQL de executed_at, un literal o una columna de stg_table
+        ->return: Sentencias DELETE e INSERT con el mismo resultado que el MERGE (SCD I) de build_merge_sql
+        """
+        time_filter = ""
+        if time_range is not None:
+            time_filter = f"AND {table_name}.created_at BETWEEN '{time_range[0]}' AND '{time_range[1]}'"
+        return f"""
+                    DELETE FROM {schema}.{table_name}
+                    USING {schema}.{stg_table}
+                    WHERE {table_name}.Moneda = {stg_table}.Moneda AND {table_name}.Base = {stg_table}.Base
+                    AND {table_name}.created_at = {stg_table}.created_at {time_filter};
+                    INSERT INTO {schema}.{table_name} (Moneda, Base, Precio, created_at, updated_at, executed_at)
+                    SELECT Moneda, Base, Precio, created_at, {updated_at}, {executed_at}
+                    FROM {schema}.{stg_table};
+                    """
+
+    def insert_frame(self, df, table, columns=None):
+        """
+        Inserta las columnas de un DataFrame en una tabla sin serializarlo
+        ->columns: Columnas a insertar, por defecto todas las del DataFrame
+        """
+        columns = ", ".join(columns or df.columns)
+        self.conn.register("df_insert", df)
+        try:
+            self.conn.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM df_insert"
+            )
+        finally:
+            self.conn.unregister("df_insert")
+
+    def query(self, sql, dtype=None):
+        """
+        ->return: DataFrame con el resultado de la consulta con los tipos de dtype (opcional)
+        *Los nombres de las columnas se devuelven en minúsculas como en Redshift
+        """
+        df = self.conn.execute(sql).df()
+        df.columns = df.columns.str.lower()
+        return df.astype(dtype) if dtype else df
+
+    def load(
+        self,
+        df,
+        table_name,
+        schema,
+        executed_at,
+        updated_at,
+        incremental=False,
+        rollup=False,
+        metrics=None,
+        change_detection=False,
+        **kwargs,
+    ):
+        """
+        Carga el DataFrame en staging y aplica el MERGE con la misma semántica que create_tbl_from_df
+        ->kwargs: Parámetros de carga de Redshift (load_method, chunk_size, shards) que no aplican
+        ->return: DataFrame cargado en staging (el snapshot completo)
+        """
+        stg_table = f"{table_name}_stg"
+        stg_columns = ["Moneda", "Base", "Precio", "created_at"]
+        self.create_tables(table_name, schema)
+        try:
+            with self.transaction():
+                time_range = None
+                df_merge = filter_compacted_rows(df, self.compacted_until(table_name, schema))
+                if incremental:
+                    df_watermark = self.query(
+                        f"SELECT moneda, base, created_at FROM {schema}.{table_name}_watermark",
+                        dtype=WATERMARK_DTYPES,
+                    ).rename(columns={"moneda": "Moneda", "base": "Base", "created_at": "watermark"})
+                    df_merge = filter_new_rows(df_merge, df_watermark)
+                    logging.info(f"Filas nuevas a aplicar: {len(df_merge)}")
+                if change_detection:
+                    with measure_stage(metrics, "change_detection", rows=len(df_merge)) as span:
+                        df_fingerprint = self.query(
+                            f"SELECT moneda, base, fingerprint FROM {schema}.{table_name}_fingerprint",
+                            dtype=FINGERPRINT_DTYPES,
+                        ).rename(columns={"moneda": "Moneda", "base": "Base"})
+                        df_merge, df_fingerprint = filter_changed_rows(df_merge, df_fingerprint)
+                        span["changed"] = len(df_merge)
+                    logging.info(f"Filas nuevas o modificadas a aplicar: {len(df_merge)}")
+                if incremental and not df_merge.empty:
+                    time_range = (
+                        df_merge["created_at"].min().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                        df_merge["created_at"].max().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                    )
+
+                with measure_stage(metrics, "load_stg", rows=len(df)):
+                    self.conn.execute(f"DELETE FROM {schema}.{stg_table}")
+                    self.insert_frame(df[stg_columns], f"{schema}.{stg_table}")
+                logging.info(f"Tabla: {stg_table} actualizada exitosamente")
+
+                if df_merge.empty:
+                    logging.info(f"No hay filas nuevas para {table_name}, se omite el MERGE")
+                    return df
+
+                merge_stg = stg_table
+                if len(df_merge) < len(df):
+                    #  Staging conserva el snapshot completo, solo las filas filtradas entran al MERGE
+                    merge_stg = f"{table_name}_stg_merge"
+                    self.conn.execute(f"DELETE FROM {schema}.{merge_stg}")
+                    self.insert_frame(df_merge[stg_columns], f"{schema}.{merge_stg}")
+
+                merge_sql = self.merge_sql(
+                    table_name,
+                    schema,
+                    merge_stg,
+                    updated_at=f"CAST(CAST({updated_at} AS TIMESTAMPTZ) AT TIME ZONE 'UTC' AS TIMESTAMP)",
+                    executed_at=f"CAST({executed_at} AS DATE)",
+                    time_range=time_range,
+                )
+                rollup_sql = (
+                    build_rollup_sql(table_name, schema, merge_stg, time_range) if rollup else ""
+                )
+                watermark_sql = (
+                    build_watermark_sql(table_name, schema, merge_stg) if incremental else ""
+                )
+                with measure_stage(metrics, "merge", rows=len(df_merge)):
+                    if change_detection:
+                        self.conn.execute(build_fingerprint_sql(table_name, schema, merge_stg))
+                        self.insert_frame(df_fingerprint, f"{schema}.{table_name}_fingerprint")
+                    self.conn.execute(rollup_sql + merge_sql + watermark_sql)
+            logging.info(f"Tabla: {table_name} actualizada exitosamente")
+            return df
+
+        except Exception as e:
+            logging.error(
+                f"Error al intentar cargar el Data Frame en la tabla: {table_name} de DuckDB",
+                e,
+            )
+            raise Exception from e
+
+    def backfill(
+        self,
+        df,
+        table_name,
+        schema,
+        update_watermark=False,
+        rollup=False,
+        metrics=None,
+        **kwargs,
+    ):
+        """
+        Carga los intervalos del backfill y aplica un solo MERGE con la misma semántica que
+        create_tbl_from_backfill, las filas de días ya compactados se omiten
+        ->kwargs: Parámetros de carga de Redshift (load_method, chunk_size) que no aplican
+        """
+        backfill_table = f"{table_name}_backfill"
+        self.create_tables(table_name, schema)
+        try:
+            with self.transaction():
+                df = filter_compacted_rows(df, self.compacted_until(table_name, schema))
+                if df.empty:
+                    logging.info(f"No hay filas para el backfill de {table_name}")
+                    return
+                time_range = (
+                    df["created_at"].min().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                    df["created_at"].max().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                )
+                with measure_stage(metrics, "load_stg", rows=len(df)):
+                    self.conn.execute(f"DELETE FROM {schema}.{backfill_table}")
+                    self.insert_frame(
+                        df,
+                        f"{schema}.{backfill_table}",
+                        ["Moneda", "Base", "Precio", "created_at", "updated_at", "executed_at"],
+                    )
+                merge_sql = self.merge_sql(
+                    table_name,
+                    schema,
+                    backfill_table,
+                    updated_at=f"{backfill_table}.updated_at",
+                    executed_at=f"{backfill_table}.executed_at",
+                    time_range=time_range,
+                )
+                rollup_sql = (
+                    build_rollup_sql(table_name, schema, backfill_table, time_range)
+                    if rollup
+                    else ""
+                )
+                watermark_sql = (
+                    build_watermark_sql(table_name, schema, backfill_table)
+                    if update_watermark
+                    else ""
+                )
+                with measure_stage(metrics, "merge", rows=len(df)):
+                    self.conn.execute(rollup_sql + merge_sql + watermark_sql)
+                    self.conn.execute(f"DELETE FROM {schema}.{backfill_table}")
+            logging.info(f"Tabla: {table_name} actualizada exitosamente")
+        except Exception as e:
+            logging.error(
+                f"Error al intentar cargar el backfill en la tabla: {table_name} de DuckDB",
+                e,
+            )
+            raise Exception from e
+
+    def append_batch(
+        self, df, table_name, schema, batch_id, data_interval_end, metrics=None, **kwargs
+    ):
+        """
+        Agrega un micro-batch a {table_name}_stg_batch, igual que append_batch_to_stg
+        ->return: Número de filas agregadas
+        """
+        if df is None or df.empty:
+            logging.info(f"No hay filas para el batch {batch_id}")
+            return 0
+        self.create_tables(table_name, schema)
+        batch_table = f"{table_name}_stg_batch"
+        df = build_batch_frame(df, batch_id, data_interval_end)
+        with self.transaction():
+            with measure_stage(metrics, "load_batch", rows=len(df)):
+                self.conn.execute(
+                    f"DELETE FROM {schema}.{batch_table} WHERE batch_id = '{batch_id}'"
+                )
+                self.insert_frame(df, f"{schema}.{batch_table}")
+        logging.info(f"Batch {batch_id} agregado a {batch_table}, filas: {len(df)}")
+        return len(df)
+
+    def merge_batches(
+        self,
+        table_name,
+        schema,
+        min_batches=1,
+        update_watermark=False,
+        rollup=False,
+        metrics=None,
+    ):
+        """
+        Aplica en un solo MERGE los micro-batches acumulados, igual que merge_stg_batches
+        ->return: Número de batches aplicados
+        """
+        self.create_tables(table_name, schema)
+        batch_table = f"{table_name}_stg_batch"
+        merge_table = f"{table_name}_batch_merge"
+        with self.transaction():
+            batch_ids = [
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT DISTINCT batch_id FROM {schema}.{batch_table} ORDER BY batch_id"
+                ).fetchall()
+            ]
+            if len(batch_ids) < max(1, min_batches):
+                logging.info(
+                    f"Batches acumulados en {batch_table}: {len(batch_ids)}, mínimo para aplicar: {min_batches}"
+                )
+                return 0
+
+            with measure_stage(metrics, "consolidate", batches=len(batch_ids)) as span:
+                self.conn.execute(build_consolidate_batches_sql(table_name, schema, batch_ids))
+                rows, min_created_at, max_created_at = self.conn.execute(
+                    f"SELECT COUNT(*), MIN(created_at), MAX(created_at) FROM {schema}.{merge_table}"
+                ).fetchone()
+                span["rows"] = rows
+
+            with measure_stage(metrics, "merge", rows=rows):
+                if rows:
+                    time_range = (
+                        min_created_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                        max_created_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                    )
+                    merge_sql = self.merge_sql(
+                        table_name,
+                        schema,
+                        merge_table,
+                        updated_at=f"{merge_table}.updated_at",
+                        executed_at=f"{merge_table}.executed_at",
+                        time_range=time_range,
+                    )
+                    rollup_sql = (
+                        build_rollup_sql(table_name, schema, merge_table, time_range)
+                        if rollup
+                        else ""
+                    )
+                    watermark_sql = (
+                        build_watermark_sql(table_name, schema, merge_table)
+                        if update_watermark
+                        else ""
+                    )
+                    self.conn.execute(rollup_sql + merge_sql + watermark_sql)
+                batch_filter = ", ".join(f"'{batch_id}'" for batch_id in batch_ids)
+                self.conn.execute(
+                    f"DELETE FROM {schema}.{batch_table} WHERE batch_id IN ({batch_filter})"
+                )
+        logging.info(f"Tabla: {table_name} actualizada exitosamente con {len(batch_ids)} batches")
+        return len(batch_ids)
+
+    def compact_tiers(self, table_name, schema, compact_until, retention_days, metrics=None):
+        """
+        Compacta la tabla histórica en los niveles diario y mensual, igual que compact_tiers
+        """
+        self.create_tables(table_name, schema)
+        with self.transaction():
+            horizon_old, compacted_old = self.conn.execute(
+                f"SELECT MAX(horizonte), MAX(compactado_hasta) FROM {schema}.{table_name}_retention"
+            ).fetchone()
+            compacted, horizon = compaction_limits(
+                compact_until, retention_days, horizon_old, compacted_old
+            )
+            first_day = self.conn.execute(
+                f"SELECT CAST(MIN(created_at) AS DATE) FROM {schema}.{table_name} WHERE created_at < '{compacted}'"
+            ).fetchone()[0]
+            logging.warning(
+                f"Compactando {table_name} hasta {compacted} y podando las filas anteriores a {horizon}"
+            )
+            with measure_stage(metrics, "compact_tiers"):
+                self.conn.execute(
+                    build_compact_tiers_sql(
+                        table_name, schema, compacted, horizon, horizon_old, first_day
+                    )
+                )
+        logging.info(f"Tabla: {table_name} compactada exitosamente hasta {compacted}")
+
+    def rebuild_rollup(self, table_name, schema):
+        """
+        Reconstruye {table_name}_hist_avg desde la tabla histórica y sus niveles, igual que
+        rebuild_hist_avg_rollup
+        """
+        self.create_tables(table_name, schema)
+        with self.transaction():
+            self.conn.execute(build_rebuild_rollup_sql(table_name, schema))
+        logging.info(f"Tabla: {table_name}_hist_avg reconstruida exitosamente")
+
+    def read_price_history(self, table_name, schema, since, until):
+        """
+        ->return: DataFrame con los precios ejecutados en el rango, igual que read_price_history
+        """
+        self.create_tables(table_name, schema)
+        return self.query(
+            build_price_history_sql(table_name, schema, since, until), dtype=STG_DTYPES
+        )
+
+    def write_analytics(self, df, table_name, schema, **kwargs):
+        """
+        Guarda las métricas móviles reemplazando las fechas calculadas, igual que write_analytics
+        ->kwargs: Parámetros de carga de Redshift (load_method) que no aplican
+        """
+        self.create_tables(table_name, schema)
+        analytics_table = f"{table_name}_analytics"
+        dates = ", ".join(f"'{fecha}'" for fecha in df["fecha"].dt.date.unique())
+        with self.transaction():
+            self.conn.execute(f"DELETE FROM {schema}.{analytics_table} WHERE fecha IN ({dates})")
+            self.insert_frame(df.assign(fecha=df["fecha"].dt.date), f"{schema}.{analytics_table}")
+        logging.info(f"Tabla: {analytics_table} actualizada exitosamente, filas: {len(df)}")
+
+    def summary_frames(
+        self,
+        table_name,
+        schema,
+        updated_at,
+        min_price,
+        max_price,
+        base_currency=None,
+        use_rollup=False,
+        df_stg=None,
+        use_tiers=False,
+    ):
+        """
+        ->return: DataFrame de staging e histórico del resumen, igual que build_df_summary
+        """
+        self.create_tables(table_name, schema)
+        if df_stg is not None:
+            df_crypto_stg = summarize_stg_frame(df_stg, base_currency)
+        else:
+            base_filter = f"AND base = '{base_currency}'" if base_currency else ""
+            df_crypto_stg = self.query(
+                f"SELECT moneda, base, AVG(precio) AS precio FROM {schema}.{table_name}_stg WHERE 1=1 {base_filter} GROUP BY moneda,base",
+                dtype=STG_DTYPES,
+            )
+        df_crypto_hist = self.query(
+            build_hist_avg_sql(
+                table_name, schema, updated_at, base_currency, use_rollup, use_tiers
+            ),
+            dtype=STG_DTYPES,
+        )
+        return (
+            filter_price_band(df_crypto_stg, min_price, max_price),
+            filter_price_band(df_crypto_hist, min_price, max_price),
+        )
+
+    def summary_pushdown(self, table_name, schema, **kwargs):
+        """
+        ->return: Los tres DataFrame del resumen calculados con una consulta, ver build_summary_sql
+        """
+        self.create_tables(table_name, schema)
+        df_summary = self.query(
+            build_summary_sql(table_name=table_name, schema=schema, **kwargs),
+            dtype=SUMMARY_DTYPES,
+        )
+        return split_summary(df_summary)
+
+    def close(self):
+        self.conn.close()
+
+
+def get_backend(dwh_backend="redshift", duckdb_path=None, **dwh_params):
+    """
+    Esta función construye el backend del DataWarehouse
+    ->dwh_backend: redshift o duckdb
+    ->duckdb_path: Ruta del archivo DuckDB, solo con el backend duckdb
+    ->dwh_params: dwh_host, dwh_user, dwh_name, dwh_password y dwh_port, solo con el backend redshift
+    ->return: RedshiftBackend o DuckDBBackend
+    """
+    if dwh_backend == "redshift":
+        return RedshiftBackend(**dwh_params)
+    if dwh_backend == "duckdb":
+        return DuckDBBackend(duckdb_path)
+    raise ValueError(f"Backend inválido: {dwh_backend}, opciones: {DWH_BACKENDS}")
@@ -0,0 +1,149 @@
+"""
+Author: Victor Velasco
+Name: cache
+
+Description: This file contains the on-disk cache used to store the raw responses of CoinAPI
+so catchup, retries and backfills can replay them without calling the API again
+"""
+
+# Library imports
+import os
+import gzip  # For compress the payloads
+import time
+import threading  # For serialize the eviction between the threads of a task
+import hashlib  # For build the content address of every entry
+import logging  # For create logs
+
+CACHE_MODES = ("off", "read_write", "replay")
+#  Seconds between two evictions of the same cache, the first put of a task always evicts
+EVICT_INTERVAL_SECONDS = 15 * 60
+
+
+class ResponseCache:
+    """
+    Cache en disco de las respuestas crudas de coinAPI, cada entrada se guarda comprimida con gzip
+    en una ruta derivada del hash de la moneda base y el intervalo de datos del DAG
+    ->cache_dir: Directorio donde se guardan las respuestas
+    ->mode: off (no usa cache), read_write (usa la cache y consulta la API si no existe la entrada)
+            o replay (solo lee de la cache, nunca consulta la API)
+    ->max_bytes: Tamaño máximo en bytes de la cache, al superarlo se eliminan las entradas más antiguas
+    ->max_age_days: Edad máxima en días de una entrada antes de ser eliminada
+    """
+
+    def __init__(
+        self, cache_dir, mode="read_write", max_bytes=512 * 1024 * 1024, max_age_days=120
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Modo de cache inválido: {mode}, opciones: {CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self._evict_lock = threading.Lock()
+        self._last_evict = None
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def replay(self):
+        return self.mode == "replay"
+
+    @staticmethod
+    def build_key(base_currency, data_interval_start, data_interval_end):
+        """
+        Construye la llave de la entrada a partir de la moneda base y el intervalo de datos
+        ->return: Hash sha256 en hexadecimal
+        """
+        identity = f"{base_currency}|{data_interval_start}|{data_interval_end}"
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def _is_expired(self, mtime, now):
+        return now - mtime > self.max_age_seconds
+
+    @staticmethod
+    def _remove(path):
+        """
+        Elimina una entrada, otro hilo o proceso (sensor o backfill) puede haberla eliminado antes
+        ->return: True si la entrada se eliminó en esta llamada
+        """
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get(self, key):
+        """
+        Obtiene la respuesta cruda guardada para la llave dada
+        ->return: bytes con el JSON de la respuesta o None si no existe o expiró
+        """
+        path = self._path(key)
+        try:
+            if self._is_expired(os.path.getmtime(path), time.time()):
+                logging.warning(f"Entrada de cache expirada: {key}")
+                self._remove(path)
+                return None
+            with gzip.open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, raw):
+        """
+        Guarda la respuesta cruda comprimida y aplica la política de eliminación como máximo una vez
+        cada EVICT_INTERVAL_SECONDS
+        ->raw: bytes con el JSON de la respuesta
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=6) as file:
+            file.write(raw)
+        os.replace(tmp_path, path)  #  Escritura atómica para no dejar entradas a medias
+        logging.info(f"Respuesta guardada en cache: {path}")
+        self.maybe_evict()
+
+    def maybe_evict(self):
+        """
+        Aplica evict si no se aplicó en los últimos EVICT_INTERVAL_SECONDS, los hilos que comparten la
+        cache no recorren el directorio al mismo tiempo
+        """
+        with self._evict_lock:
+            now = time.time()
+            if self._last_evict is not None and now - self._last_evict < EVICT_INTERVAL_SECONDS:
+                return
+            self._last_evict = now
+            self.evict()
+
+    def evict(self):
+        """
+        Elimina las entradas expiradas y después las más antiguas hasta cumplir con max_bytes
+        """
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json.gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if self._is_expired(stat.st_mtime, now):
+                    self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if self._remove(path):
+                logging.warning(f"Entrada de cache eliminada por tamaño: {path}")
+            total_bytes -= size
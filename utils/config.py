@@ -0,0 +1,31 @@
+"""
+Author: Victor Velasco
+Name: config
+
+Description: This file contains the lazy configuration used by the DAG files. The Airflow Variables
+are not read while the scheduler parses the files, they are given to the tasks as Jinja templates
+that Airflow renders when the task runs (the metadata DB is only queried at task runtime)
+"""
+
+
+def var(name, default=None):
+    """
+    Construye el template de una Variable de Airflow para usarlo en un campo templated del operador
+    ->name: Nombre de la Variable ej: DB_HOST
+    ->default: Valor si la Variable no existe (opcional), si no se da la tarea falla cuando no existe
+    *Las Variables con password, secret o api_key en el nombre se ocultan en los logs y en la UI
+    ->return: String con el template ej: {{ var.value.DB_HOST }}
+    """
+    if default is None:
+        return "{{ var.value.%s }}" % name
+    return "{{ var.value.get('%s', '%s') }}" % (name, default)
+
+
+def search_path_sql(sql_file):
+    """
+    Construye el sql de un PostgresOperator que fija el esquema con la Variable DB_SCHEMA antes de
+    ejecutar el archivo, reemplaza a hook_params que no se renderiza como template
+    ->sql_file: Nombre del archivo dentro de template_searchpath ej: CREATE_TBL_CRYPTO.sql
+    ->return: Lista de sentencias para el parámetro sql
+    """
+    return [f"SET search_path TO {var('DB_SCHEMA')}", sql_file]
@@ -0,0 +1,87 @@
+"""
+Author: Victor Velasco
+Name: handoff
+
+Description: This file contains the handoff used to pass the staged DataFrame from the load task
+to the summary task as an Arrow IPC (Feather) file, only the path travels through XCom
+"""
+
+# Library imports
+import os
+import re
+import time
+import logging  # For create logs
+
+try:
+    import pyarrow as pa  # For write and memory map the Arrow files
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - without pyarrow the summary queries the warehouse
+    pa = None
+
+
+class FrameHandoff:
+    """
+    Directorio compartido entre tareas donde se guardan los DataFrame en formato Arrow IPC sin compresión,
+    así la tarea que los lee los abre con memory map sin copiar los buffers
+    ->handoff_dir: Directorio compartido por las tareas (ej: un volumen montado en los workers)
+    ->max_age_hours: Edad máxima en horas de un archivo antes de ser eliminado
+    """
+
+    def __init__(self, handoff_dir, max_age_hours=48):
+        self.handoff_dir = handoff_dir
+        self.max_age_seconds = max_age_hours * 60 * 60
+
+    @property
+    def enabled(self):
+        return pa is not None
+
+    def _path(self, name):
+        return os.path.join(self.handoff_dir, f"{re.sub(r'[^0-9A-Za-z_-]', '', name)}.arrow")
+
+    def write(self, df, name):
+        """
+        Guarda el DataFrame y elimina los archivos expirados
+        ->df: DataFrame a entregar
+        ->name: Nombre del archivo, se eliminan los caracteres no válidos (ej: crypto_stg y la fecha)
+        ->return: Ruta del archivo o None si pyarrow no está disponible
+        """
+        if not self.enabled:
+            return None
+        path = self._path(name)
+        os.makedirs(self.handoff_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        feather.write_feather(
+            pa.Table.from_pandas(df, preserve_index=False),
+            tmp_path,
+            compression="uncompressed",
+        )
+        os.replace(tmp_path, path)  #  Escritura atómica para no dejar archivos a medias
+        logging.info(f"DataFrame entregado en {path}")
+        self.evict()
+        return path
+
+    def read(self, path):
+        """
+        Lee un DataFrame entregado por otra tarea usando memory map
+        ->path: Ruta devuelta por write
+        ->return: DataFrame o None si no existe el archivo
+        """
+        if not self.enabled or not path or not os.path.exists(path):
+            logging.warning(f"No existe el archivo de entrega {path}")
+            return None
+        table = feather.read_table(path, memory_map=True)
+        logging.info(f"DataFrame leído desde {path}, filas: {table.num_rows}")
+        return table.to_pandas(split_blocks=True)
+
+    def evict(self):
+        """
+        Elimina los archivos más antiguos que max_age_hours
+        """
+        now = time.time()
+        for name in os.listdir(self.handoff_dir):
+            path = os.path.join(self.handoff_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age_seconds:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
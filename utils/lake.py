@@ -0,0 +1,178 @@
+"""
+Author: Victor Velasco
+Name: lake
+
+Description: This file contains the local landing zone where every CoinAPI snapshot is saved as
+Parquet partitioned by date and base currency, so re-runs, backfills and ad-hoc analysis can scan
+it instead of calling the API or querying Redshift
+"""
+
+# Library imports
+import os
+import logging  # For create logs
+import pandas as pd
+
+try:
+    import pyarrow as pa  # For write and scan the Parquet files
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow is only needed when the lake is enabled
+    pa = None
+
+LAKE_MODES = ("off", "write", "read_write")
+
+#  Partition columns of the lake, both are part of the path and not of the files
+PARTITIONING = (
+    pa_ds.partitioning(
+        pa.schema([("fecha", pa.date32()), ("base", pa.string())]), flavor="hive"
+    )
+    if pa is not None
+    else None
+)
+FILE_SCHEMA = (
+    pa.schema(
+        [
+            ("Moneda", pa.string()),
+            ("Precio", pa.float64()),
+            ("created_at", pa.timestamp("ns")),
+            ("updated_at", pa.timestamp("us")),
+        ]
+    )
+    if pa is not None
+    else None
+)
+
+
+class SnapshotLake:
+    """
+    Zona de aterrizaje local de las respuestas de coinAPI en formato Parquet, cada respuesta se guarda en
+    {lake_dir}/fecha=YYYY-MM-DD/base=XXX/part-{inicio del intervalo}.parquet
+    ->lake_dir: Directorio raíz del lake
+    *fecha es la fecha (UTC) del inicio del intervalo de datos, igual que ds en Airflow
+    *Volver a escribir un intervalo reemplaza su archivo, las escrituras son idempotentes
+    """
+
+    def __init__(self, lake_dir):
+        if pa is None:
+            raise ImportError("pyarrow es necesario para usar el lake de snapshots")
+        self.lake_dir = lake_dir
+
+    @staticmethod
+    def _interval(data_interval_start, data_interval_end):
+        start = pd.Timestamp(data_interval_start).tz_convert("UTC")
+        end = pd.Timestamp(data_interval_end).tz_convert("UTC")
+        return start, end
+
+    def _path(self, base_currency, start):
+        return os.path.join(
+            self.lake_dir,
+            f"fecha={start.date().isoformat()}",
+            f"base={base_currency}",
+            f"part-{start.strftime('%Y%m%dT%H%M%S')}.parquet",
+        )
+
+    def write(self, df, data_interval_start, data_interval_end):
+        """
+        Guarda un snapshot, un archivo por moneda base
+        ->df: DataFrame construido con build_dataframe
+        ->data_interval_start: Inicio del intervalo de datos del DAG
+        ->data_interval_end: Fin del intervalo de datos del DAG, se guarda como updated_at
+        ->return: Lista de rutas escritas
+        """
+        start, end = self._interval(data_interval_start, data_interval_end)
+        paths = []
+        for base_currency, group in df.groupby("Base", observed=True, sort=False):
+            moneda = pa.array(group["Moneda"])
+            if pa.types.is_dictionary(moneda.type):
+                moneda = moneda.dictionary_decode()
+            table = pa.Table.from_arrays(
+                [
+                    moneda,
+                    pa.array(group["Precio"], type=pa.float64()),
+                    pa.array(group["created_at"], type=pa.timestamp("ns")),
+                    pa.array(
+                        pd.Series(end.tz_localize(None), index=group.index),
+                        type=pa.timestamp("us"),
+                    ),
+                ],
+                schema=FILE_SCHEMA,
+            )
+            path = self._path(base_currency, start)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            #  Los archivos que inician con punto no se incluyen al leer el lake
+            tmp_path = os.path.join(
+                os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.tmp"
+            )
+            pq.write_table(table, tmp_path, compression="zstd")
+            os.replace(tmp_path, path)  #  Escritura atómica para no dejar archivos a medias
+            paths.append(path)
+        logging.info(f"Snapshot guardado en el lake: {paths}")
+        return paths
+
+    def read(
+        self,
+        start_date=None,
+        end_date=None,
+        base_currencies=None,
+        columns=None,
+        filter=None,
+    ):
+        """
+        Lee los snapshots del lake, las particiones y columnas que no se piden no se leen
+        ->start_date: Primera fecha a leer (opcional)
+        ->end_date: Última fecha a leer, incluida (opcional)
+        ->base_currencies: Lista de monedas base a leer (opcional)
+        ->columns: Columnas a leer ej: ["Moneda", "Precio"] (opcional), Base y fecha se pueden pedir
+        ->filter: Expresión de pyarrow.dataset sobre las columnas de los archivos (opcional)
+                  ej: pyarrow.dataset.field("Precio") > 100
+        ->return: DataFrame con Moneda y Base como category
+        """
+        expression = pa_ds.scalar(True)
+        if start_date is not None:
+            expression &= pa_ds.field("fecha") >= pd.Timestamp(start_date).date()
+        if end_date is not None:
+            expression &= pa_ds.field("fecha") <= pd.Timestamp(end_date).date()
+        if base_currencies:
+            expression &= pa_ds.field("base").isin(list(base_currencies))
+        if filter is not None:
+            expression &= filter
+
+        schema = FILE_SCHEMA.append(pa.field("fecha", pa.date32())).append(
+            pa.field("base", pa.string())
+        )
+        if columns is not None:
+            columns = ["base" if column == "Base" else column for column in columns]
+        if os.path.isdir(self.lake_dir):
+            dataset = pa_ds.dataset(
+                self.lake_dir, format="parquet", partitioning=PARTITIONING, schema=schema
+            )
+            table = dataset.to_table(columns=columns, filter=expression)
+        else:
+            table = schema.empty_table()
+            table = table.select(columns) if columns is not None else table
+        logging.info(f"Filas leídas del lake {self.lake_dir}: {table.num_rows}")
+        df = table.to_pandas(strings_to_categorical=True)
+        return df.rename(columns={"base": "Base"})
+
+    def read_interval(self, data_interval_start, data_interval_end, base_currencies):
+        """
+        Lee el snapshot de un intervalo de datos con el mismo formato que build_dataframe
+        ->base_currencies: Lista de monedas base que deben existir en el lake
+        ->return: DataFrame con Moneda, Base, Precio y created_at o None si falta alguna moneda base
+        """
+        start, end = self._interval(data_interval_start, data_interval_end)
+        paths = [self._path(base_currency, start) for base_currency in base_currencies]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        df = self.read(
+            start_date=start.date(),
+            end_date=start.date(),
+            base_currencies=base_currencies,
+            columns=["Moneda", "Base", "Precio", "created_at"],
+            filter=pa_ds.field("updated_at")
+            == pa.scalar(end.tz_localize(None), pa.timestamp("us")),
+        )
+        logging.info(
+            f"Snapshot obtenido desde el lake para {base_currencies} ({data_interval_start} - {data_interval_end})"
+        )
+        return df
@@ -9,21 +9,27 @@ associated.
 """
 
 #  Library imports
-import pandas as pd
-import sqlalchemy as sa  #  For interact with DB
+import json  # For decode the subscribers Variable
 import logging  # For create logs
 
-#  Import funtions
-from utils.utils import (
-    get_coin_api_information,
-    build_dataframe,
-    connect_to_dwh,
-    create_tbl_from_df,
-    build_df_summary,
-    calculate_summary_crypto,
-    build_string_summary,
-    send_email_alert,
+#  Import funtions, only the light modules are imported here because the DAG files import this
+#  module at parse time, pandas, sqlalchemy, requests and pyarrow are imported when a task runs
+from utils.settings import (
+    CACHE_DIR,
+    CACHE_MAX_BYTES,
+    CACHE_MAX_AGE_DAYS,
+    METRICS_DIR,
+    LAKE_DIR,
+    HANDOFF_DIR,
+    HANDOFF_MAX_AGE_HOURS,
+    ANALYTICS_STATE_DIR,
+    ANOMALY_STATE_DIR,
+    ANOMALY_Z_THRESHOLD,
+    DUCKDB_PATH,
+    RAW_RETENTION_DAYS,
 )
+from utils.cache import ResponseCache
+from utils.metrics import StageMetrics
 
 # Config Logging
 logging.basicConfig(
@@ -33,6 +39,120 @@ logging.basicConfig(
 )
 
 
+class TaskRun:
+    """
+    Contexto de ejecución de las tareas del DAG, al salir registra el error de la tarea, cierra el
+    backend y las conexiones del pool y emite las métricas de las etapas aunque la tarea falle
+    ->metrics: StageMetrics de la tarea, None si la tarea no emite métricas
+    ->error_message: Mensaje del log cuando la tarea falla
+    *Al salir del contexto data tiene el diccionario de métricas que la tarea devuelve como XCom
+    """
+
+    def __init__(self, metrics, error_message):
+        self.metrics = metrics
+        self.error_message = error_message
+        self.backend = None
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        #  Heavy imports are deferred until the task runs
+        from utils.utils import dispose_engines
+
+        if exc is not None:
+            logging.error(f"{self.error_message}: {exc}")
+        #  Close the pooled connections at task end
+        if self.backend is not None:
+            self.backend.close()
+        dispose_engines()
+        #  Emit the stage metrics even when the task fails
+        if self.metrics is not None:
+            self.data = self.metrics.emit(METRICS_DIR)
+        return False
+
+    def open_backend(self, dwh_backend, duckdb_path=None, **dwh_params):
+        """
+        Obtiene el backend del DataWarehouse, Redshift o un archivo DuckDB embebido, que se cierra al salir
+        ->dwh_backend: Backend del DataWarehouse, redshift o duckdb
+        ->duckdb_path: Ruta del archivo DuckDB, por defecto CRYPTO_DUCKDB_PATH
+        ->dwh_params: Host, nombre, usuario, puerto y password del DataWarehouse
+        ->return: Backend del DataWarehouse
+        """
+        #  Heavy imports are deferred until the task runs
+        from utils.backends import get_backend
+
+        self.backend = get_backend(
+            dwh_backend=dwh_backend, duckdb_path=duckdb_path or DUCKDB_PATH, **dwh_params
+        )
+        return self.backend
+
+
+def is_redshift_backend(dwh_backend):
+    """
+    Condición del ShortCircuitOperator que antecede a las tareas de DDL de Redshift, con el backend
+    duckdb las tareas se omiten y las tablas las crea DuckDBBackend.create_tables
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb
+    ->return: True si las tablas se crean en Redshift
+    """
+    logging.info(f"Backend del DataWarehouse: {dwh_backend}")
+    return dwh_backend == "redshift"
+
+
+def probe_crypto_api(
+    base_url,
+    api_key,
+    base_currencies,
+    data_interval_start,
+    data_interval_end,
+    max_workers=4,
+    cache_dir=None,
+    cache_mode="read_write",
+):
+    """
+    Sensor de disponibilidad de coinAPI que hace la consulta real del intervalo y guarda las respuestas
+    en la cache, la tarea de carga las lee desde ahí sin volver a consultar la API
+    ->base_url: Url dado para la API de coinAPI
+    ->api_key: API Key para consultar coinAPI
+    ->base_currencies: Lista de monedas base a consultar
+    ->data_interval_start: Inicio del intervalo de datos del DAG, usado como llave de la cache
+    ->data_interval_end: Fin del intervalo de datos del DAG, usado como llave de la cache
+    ->max_workers: Número máximo de peticiones simultáneas a coinAPI
+    ->cache_dir: Directorio de la cache de respuestas de coinAPI
+    ->cache_mode: Modo de la cache del DAG, en replay no se consulta la API y el sensor termina
+    ->return: True si se obtuvo la respuesta de todas las monedas base
+    """
+    #  Heavy imports are deferred until the task runs
+    from utils.utils import (
+        get_coin_api_information_multi,
+    )
+
+    if cache_mode == "replay":
+        logging.info(f"Modo replay, no se consulta coinAPI")
+        return True
+
+    cache = ResponseCache(
+        cache_dir=cache_dir or CACHE_DIR,
+        mode="read_write",
+        max_bytes=CACHE_MAX_BYTES,
+        max_age_days=CACHE_MAX_AGE_DAYS,
+    )
+    apiResponses = get_coin_api_information_multi(
+        base_currencies=base_currencies,
+        base_url=base_url,
+        api_key=api_key,
+        max_workers=max_workers,
+        cache=cache,
+        data_interval_start=data_interval_start,
+        data_interval_end=data_interval_end,
+        raw=True,
+    )
+    available = all(apiResponse is not None for apiResponse in apiResponses)
+    logging.info(f"CoinAPI disponible: {available}")
+    return available
+
+
 def extract_transform_load_crypto(
     table_name,
     base_currency,
@@ -46,6 +166,23 @@ def extract_transform_load_crypto(
     dwh_schema,
     executed_at,
     updated_at,
+    base_currencies=None,
+    max_workers=4,
+    cache_dir=None,
+    cache_mode="off",
+    data_interval_start=None,
+    data_interval_end=None,
+    load_method="multi",
+    incremental=False,
+    rollup=False,
+    lake_dir=None,
+    lake_mode="off",
+    handoff=False,
+    load_shards=1,
+    detect_anomalies=False,
+    dwh_backend="redshift",
+    duckdb_path=None,
+    change_detection=False,
 ):
     """
     Proceso ETL para extracción de datos de cryptodivisas desde coinAPI para cargarlas en la tabla staging
@@ -61,19 +198,128 @@ def extract_transform_load_crypto(
     ->dwh_schema: Esquema donde se guardarán los datos dentro del DataWarehouse
     ->executed_at: Fecha de ejecución del proceso ETL
     ->updated_at: Fecha de actualización de los datos de la tabla historica crypto
-    ->return: void
+    ->base_currencies: Lista de monedas base a consultar de forma concurrente (opcional), reemplaza a base_currency
+    ->max_workers: Número máximo de peticiones simultáneas a coinAPI cuando se usa base_currencies
+    ->cache_dir: Directorio de la cache de respuestas de coinAPI
+    ->cache_mode: Modo de la cache off, read_write o replay (replay nunca consulta coinAPI)
+    ->data_interval_start: Inicio del intervalo de datos del DAG, usado como llave de la cache
+    ->data_interval_end: Fin del intervalo de datos del DAG, usado como llave de la cache
+    ->load_method: Método de carga de la tabla staging: multi, copy, s3 o auto
+    ->incremental: Si es True solo se cargan las filas más recientes que la marca de agua por moneda
+    ->rollup: Si es True se actualiza la tabla de promedios históricos en la misma transacción del MERGE
+    ->lake_dir: Directorio del lake de snapshots en Parquet
+    ->lake_mode: off, write (guarda cada snapshot en el lake) o read_write (si el lake ya tiene el
+                 snapshot del intervalo para todas las monedas base no se consulta coinAPI)
+    ->handoff: Si es True el DataFrame cargado en staging se guarda como archivo Arrow para la tarea de resumen
+    ->load_shards: Número de shards cargados en paralelo en la tabla staging, 1 usa una sola conexión
+                   (solo aplica con el método copy de PostgreSQL)
+    ->detect_anomalies: Si es True el snapshot actualiza las estadísticas por moneda y los movimientos
+                        anormales se devuelven en anomalies para la alerta
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    ->change_detection: Si es True solo se cargan las filas cuya huella de precio y created_at cambió
+                        desde la última carga
+    ->return: Diccionario con las métricas de cada etapa, handoff_path y anomalies (se guarda como XCom)
     """
-    try:
-        #  Get the JSON from API
-        apiResponse = get_coin_api_information(
-            base_currency=base_currency, base_url=base_url, api_key=api_key
+    #  Heavy imports are deferred until the task runs
+    from utils.anomaly import AnomalyDetector
+    from utils.handoff import FrameHandoff
+    from utils.lake import SnapshotLake
+    from utils.utils import (
+        get_coin_api_information,
+        get_coin_api_information_cached,
+        get_coin_api_information_multi,
+        build_dataframe,
+        build_snapshot_frame,
+    )
+
+    metrics = StageMetrics("load_crypto_data", tags={"updated_at": updated_at})
+    handoff_path = None
+    anomalies = None
+    with TaskRun(metrics, f"Error al obtener datos de {base_url}") as task:
+        #  Cache of raw responses keyed by base currency and data interval
+        cache = ResponseCache(
+            cache_dir=cache_dir or CACHE_DIR,
+            mode=cache_mode,
+            max_bytes=CACHE_MAX_BYTES,
+            max_age_days=CACHE_MAX_AGE_DAYS,
         )
+        lake = SnapshotLake(lake_dir or LAKE_DIR) if lake_mode != "off" else None
+
+        df = None
+        if lake_mode == "read_write":
+            #  Re-runs read the landed snapshot instead of calling the API
+            with metrics.stage("lake_read") as span:
+                df = lake.read_interval(
+                    data_interval_start=data_interval_start,
+                    data_interval_end=data_interval_end,
+                    base_currencies=base_currencies or [base_currency],
+                )
+                span["rows"] = 0 if df is None else len(df)
+        from_lake = df is not None
+
+        if from_lake:
+            logging.info(f"Snapshot del intervalo obtenido desde el lake")
+        elif base_currencies:
+            #  Get the JSONs from API for every base currency concurrently
+            with metrics.stage("api_call", requests=len(base_currencies)) as span:
+                apiResponses = get_coin_api_information_multi(
+                    base_currencies=base_currencies,
+                    base_url=base_url,
+                    api_key=api_key,
+                    max_workers=max_workers,
+                    cache=cache,
+                    data_interval_start=data_interval_start,
+                    data_interval_end=data_interval_end,
+                    raw=True,
+                )
+                span["bytes"] = sum(len(raw or b"") for raw in apiResponses)
+
+            #  Create one DataFrame from all the raw JSONs, a failed currency fails the task
+            with metrics.stage("build_dataframe") as span:
+                df = build_snapshot_frame(apiResponses, base_currencies)
+                span["rows"] = len(df)
+        else:
+            #  Get the JSON from API
+            with metrics.stage("api_call", requests=1) as span:
+                if cache.enabled:
+                    apiResponse = get_coin_api_information_cached(
+                        base_currency=base_currency,
+                        base_url=base_url,
+                        api_key=api_key,
+                        cache=cache,
+                        data_interval_start=data_interval_start,
+                        data_interval_end=data_interval_end,
+                        raw=True,
+                    )
+                else:
+                    apiResponse = get_coin_api_information(
+                        base_currency=base_currency,
+                        base_url=base_url,
+                        api_key=api_key,
+                        raw=True,
+                    )
+                span["bytes"] = len(apiResponse or b"")
 
-        #  Create a DataFrame from JSON and give format
-        df = build_dataframe(apiResponse)
+            #  Create a DataFrame from the raw JSON bytes and give format
+            with metrics.stage("build_dataframe") as span:
+                df = build_dataframe(apiResponse)
+                span["rows"] = 0 if df is None else len(df)
 
-        #  Get engine connection to DataWareHouse
-        engine = connect_to_dwh(
+        if df is None or df.empty:
+            raise ValueError(
+                f"No se obtuvieron datos de coinAPI para {base_currencies or [base_currency]} en el intervalo {data_interval_start} - {data_interval_end}"
+            )
+
+        if lake is not None and not from_lake:
+            #  Land the snapshot as Parquet partitioned by date and base currency
+            with metrics.stage("lake_write", rows=len(df)):
+                lake.write(df, data_interval_start, data_interval_end)
+
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
             dwh_host=dwh_host,
             dwh_name=dwh_name,
             dwh_user=dwh_user,
@@ -82,18 +328,493 @@ def extract_transform_load_crypto(
         )
 
         #  Insert DataFrame into Table stg
-        create_tbl_from_df(
+        df_stg = backend.load(
             df=df,
             table_name=table_name,
-            engine=engine,
             schema=dwh_schema,
             executed_at=executed_at,
             updated_at=updated_at,
+            load_method=load_method,
+            incremental=incremental,
+            rollup=rollup,
+            metrics=metrics,
+            shards=load_shards,
+            change_detection=change_detection,
+        )
+
+        if handoff:
+            #  Hand the staged frame to the summary task, only the path goes to XCom
+            with metrics.stage("handoff_write", rows=len(df_stg)):
+                handoff_path = FrameHandoff(HANDOFF_DIR, HANDOFF_MAX_AGE_HOURS).write(
+                    df_stg, f"{table_name}_stg_{updated_at}"
+                )
+
+        if detect_anomalies:
+            #  One vectorized update of the per coin statistics, no history is read
+            with metrics.stage("detect_anomalies") as span:
+                detector = AnomalyDetector(
+                    ANOMALY_STATE_DIR, table_name, z_threshold=ANOMALY_Z_THRESHOLD
+                )
+                anomalies = detector.update(df).to_dict("records")
+                detector.save()
+                span["rows"] = len(anomalies)
+
+    data = task.data
+    data["handoff_path"] = handoff_path
+    data["anomalies"] = anomalies
+    return data
+
+
+def backfill_crypto(
+    table_name,
+    base_currencies,
+    base_url,
+    api_key,
+    dwh_host,
+    dwh_user,
+    dwh_name,
+    dwh_password,
+    dwh_port,
+    dwh_schema,
+    start_date,
+    end_date,
+    max_workers=4,
+    cache_dir=None,
+    load_method="multi",
+    update_watermark=False,
+    rollup=False,
+    source="lake",
+    lake_dir=None,
+    dwh_backend="redshift",
+    duckdb_path=None,
+):
+    """
+    Proceso de backfill que carga todos los intervalos diarios de un rango de fechas en una sola pasada,
+    con una sola carga masiva y un solo MERGE en lugar de una ejecución del DAG por día
+    ->table_name: Nombre de la tabla donde se almacena las cryptodivisas
+    ->base_currencies: Lista de monedas base a cargar
+    ->base_url: Url dado para la API de coinAPI
+    ->api_key: API Key para consultar coinAPI
+    ->dwh_host: Host del DataWarehouse
+    ->dwh_user: Usuario del DataWarehouse
+    ->dwh_name: Database name del DataWarehouse
+    ->dwh_password: Password del DataWarehouse
+    ->dwh_port: Puerto del DataWarehouse
+    ->dwh_schema: Esquema donde se guardarán los datos dentro del DataWarehouse
+    ->start_date: Primera fecha lógica del backfill (ej: 2023-12-01)
+    ->end_date: Última fecha lógica del backfill, incluida
+    ->max_workers: Número máximo de lecturas o peticiones simultáneas
+    ->cache_dir: Directorio de la cache de respuestas de coinAPI
+    ->load_method: Método de carga masiva: multi, copy, s3 o auto
+    ->update_watermark: Si es True se avanza la marca de agua por moneda
+    ->rollup: Si es True se actualiza la tabla de promedios históricos en la misma transacción del MERGE
+    ->source: lake (snapshots en Parquet, solo lee las particiones del rango) o cache (respuestas crudas
+              de coinAPI, se retienen CACHE_MAX_AGE_DAYS días)
+    ->lake_dir: Directorio del lake de snapshots en Parquet
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    *Nunca se consulta coinAPI, el endpoint solo devuelve los precios actuales y no los de intervalos pasados.
+    Si algún intervalo del rango no tiene snapshot se levanta un error antes de cargar
+    ->return: Diccionario con las métricas de cada etapa (se guarda como XCom)
+    """
+    #  Heavy imports are deferred until the task runs
+    import pandas as pd
+    from utils.lake import SnapshotLake
+    from utils.utils import (
+        build_backfill_intervals,
+        collect_backfill_snapshots,
+        dedupe_snapshots,
+    )
+
+    metrics = StageMetrics(
+        "backfill_crypto", tags={"start_date": start_date, "end_date": end_date}
+    )
+    with TaskRun(metrics, f"Error en el backfill de {table_name} ({start_date} - {end_date})") as task:
+        #  Replay only, the live endpoint would store today's prices under past dates
+        cache = ResponseCache(
+            cache_dir=cache_dir or CACHE_DIR,
+            mode="replay",
+            max_bytes=CACHE_MAX_BYTES,
+            max_age_days=CACHE_MAX_AGE_DAYS,
         )
 
-    except Exception as e:
-        logging.error(f"Error al obtener datos de {base_url}: {e}")
-        raise e
+        #  Get every snapshot of the range as one DataFrame tagged with its interval
+        intervals = build_backfill_intervals(start_date, end_date)
+        with metrics.stage("collect_snapshots", intervals=len(intervals)) as span:
+            if source == "lake":
+                df = SnapshotLake(lake_dir or LAKE_DIR).read(
+                    start_date=start_date,
+                    end_date=end_date,
+                    base_currencies=base_currencies,
+                    columns=["Moneda", "Base", "Precio", "created_at", "updated_at"],
+                )
+                df = dedupe_snapshots(df.assign(executed_at=df["updated_at"].dt.date))
+            else:
+                df = collect_backfill_snapshots(
+                    base_currencies=base_currencies,
+                    base_url=base_url,
+                    api_key=api_key,
+                    cache=cache,
+                    intervals=intervals,
+                    max_workers=max_workers,
+                )
+            span["rows"] = len(df)
+
+        #  Fail before loading anything instead of skipping the intervals without snapshots
+        loaded = set(pd.to_datetime(df["updated_at"]))
+        missing = [
+            start
+            for start, end in intervals
+            if pd.Timestamp(end).tz_convert("UTC").tz_localize(None) not in loaded
+        ]
+        if missing:
+            raise ValueError(
+                f"No hay snapshots en {source} para {len(missing)} de {len(intervals)} intervalos: {missing}"
+            )
+
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
+            dwh_host=dwh_host,
+            dwh_name=dwh_name,
+            dwh_user=dwh_user,
+            dwh_port=dwh_port,
+            dwh_password=dwh_password,
+        )
+
+        #  One bulk load and one MERGE for the whole range
+        backend.backfill(
+            df=df,
+            table_name=table_name,
+            schema=dwh_schema,
+            load_method=load_method,
+            update_watermark=update_watermark,
+            rollup=rollup,
+            metrics=metrics,
+        )
+
+    return task.data
+
+
+def ingest_crypto_batch(
+    table_name,
+    base_currencies,
+    base_url,
+    api_key,
+    dwh_host,
+    dwh_user,
+    dwh_name,
+    dwh_password,
+    dwh_port,
+    dwh_schema,
+    batch_id,
+    data_interval_start,
+    data_interval_end,
+    max_workers=4,
+    load_method="multi",
+    lake_dir=None,
+    lake_mode="off",
+    dwh_backend="redshift",
+    duckdb_path=None,
+):
+    """
+    Proceso de ingesta intradía, agrega el snapshot actual de coinAPI como un micro-batch a la tabla
+    staging append-only, el MERGE hacia la tabla histórica se hace de forma periódica con merge_crypto_batches
+    ->table_name: Nombre de la tabla donde se almacena las cryptodivisas
+    ->base_currencies: Lista de monedas base a consultar de forma concurrente
+    ->base_url: Url dado para la API de coinAPI
+    ->api_key: API Key para consultar coinAPI
+    ->dwh_host: Host del DataWarehouse
+    ->dwh_user: Usuario del DataWarehouse
+    ->dwh_name: Database name del DataWarehouse
+    ->dwh_password: Password del DataWarehouse
+    ->dwh_port: Puerto del DataWarehouse
+    ->dwh_schema: Esquema donde se guardarán los datos dentro del DataWarehouse
+    ->batch_id: Identificador ordenable del batch (ej: data_interval_end | ts_nodash)
+    ->data_interval_start: Inicio del intervalo de datos del DAG
+    ->data_interval_end: Fin del intervalo de datos del DAG, de aquí salen updated_at y executed_at
+    ->max_workers: Número máximo de peticiones simultáneas a coinAPI
+    ->load_method: Método de carga masiva: multi, copy, s3 o auto
+    ->lake_dir: Directorio del lake de snapshots en Parquet
+    ->lake_mode: off o write (guarda cada snapshot en el lake)
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    ->return: Diccionario con las métricas de cada etapa (se guarda como XCom)
+    """
+    #  Heavy imports are deferred until the task runs
+    from utils.lake import SnapshotLake
+    from utils.utils import (
+        get_coin_api_information_multi,
+        build_snapshot_frame,
+    )
+
+    metrics = StageMetrics("ingest_crypto_batch", tags={"batch_id": batch_id})
+    with TaskRun(metrics, f"Error en la ingesta del batch {batch_id} de {table_name}") as task:
+        #  Get the JSONs from API for every base currency concurrently, no cache
+        with metrics.stage("api_call", requests=len(base_currencies)) as span:
+            apiResponses = get_coin_api_information_multi(
+                base_currencies=base_currencies,
+                base_url=base_url,
+                api_key=api_key,
+                max_workers=max_workers,
+                raw=True,
+            )
+            span["bytes"] = sum(len(raw or b"") for raw in apiResponses)
+
+        with metrics.stage("build_dataframe") as span:
+            df = build_snapshot_frame(apiResponses, base_currencies)
+            span["rows"] = len(df)
+
+        if lake_mode != "off":
+            #  Land the snapshot as Parquet partitioned by date and base currency
+            with metrics.stage("lake_write", rows=len(df)):
+                SnapshotLake(lake_dir or LAKE_DIR).write(
+                    df, data_interval_start, data_interval_end
+                )
+
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
+            dwh_host=dwh_host,
+            dwh_name=dwh_name,
+            dwh_user=dwh_user,
+            dwh_port=dwh_port,
+            dwh_password=dwh_password,
+        )
+
+        #  Append the batch, no DDL and no MERGE per run
+        backend.append_batch(
+            df=df,
+            table_name=table_name,
+            schema=dwh_schema,
+            batch_id=batch_id,
+            data_interval_end=data_interval_end,
+            load_method=load_method,
+            metrics=metrics,
+        )
+
+    return task.data
+
+
+def merge_crypto_batches(
+    table_name,
+    dwh_host,
+    dwh_user,
+    dwh_name,
+    dwh_password,
+    dwh_port,
+    dwh_schema,
+    min_batches=1,
+    update_watermark=False,
+    rollup=False,
+    dwh_backend="redshift",
+    duckdb_path=None,
+):
+    """
+    Proceso que aplica los micro-batches acumulados en staging sobre la tabla histórica con un solo MERGE
+    ->table_name: Nombre de la tabla donde se almacena las cryptodivisas
+    ->dwh_host: Host del DataWarehouse
+    ->dwh_user: Usuario del DataWarehouse
+    ->dwh_name: Database name del DataWarehouse
+    ->dwh_password: Password del DataWarehouse
+    ->dwh_port: Puerto del DataWarehouse
+    ->dwh_schema: Esquema donde se guardan los datos dentro del DataWarehouse
+    ->min_batches: Número mínimo de batches acumulados para aplicar el MERGE
+    ->update_watermark: Si es True se avanza la marca de agua por moneda
+    ->rollup: Si es True se actualiza la tabla de promedios históricos en la misma transacción del MERGE
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    ->return: Diccionario con las métricas de cada etapa (se guarda como XCom)
+    """
+    metrics = StageMetrics("merge_crypto_batches")
+    with TaskRun(metrics, f"Error al aplicar los batches de {table_name}") as task:
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
+            dwh_host=dwh_host,
+            dwh_name=dwh_name,
+            dwh_user=dwh_user,
+            dwh_port=dwh_port,
+            dwh_password=dwh_password,
+        )
+
+        #  One set based MERGE for every accumulated batch
+        backend.merge_batches(
+            table_name=table_name,
+            schema=dwh_schema,
+            min_batches=min_batches,
+            update_watermark=update_watermark,
+            rollup=rollup,
+            metrics=metrics,
+        )
+
+    return task.data
+
+
+def update_crypto_analytics(
+    table_name,
+    dwh_host,
+    dwh_user,
+    dwh_name,
+    dwh_password,
+    dwh_port,
+    dwh_schema,
+    executed_at,
+    state_dir=None,
+    rebuild=False,
+    load_method="multi",
+    dwh_backend="redshift",
+    duckdb_path=None,
+):
+    """
+    Proceso que actualiza las métricas móviles (promedios, volatilidad, drawdown y momentum) de cada
+    cryptomoneda con los días nuevos de la tabla histórica
+    ->table_name: Nombre de la tabla donde se almacena las cryptodivisas
+    ->dwh_host: Host del DataWarehouse
+    ->dwh_user: Usuario del DataWarehouse
+    ->dwh_name: Database name del DataWarehouse
+    ->dwh_password: Password del DataWarehouse
+    ->dwh_port: Puerto del DataWarehouse
+    ->dwh_schema: Esquema donde se guardan los datos dentro del DataWarehouse
+    ->executed_at: Fecha de ejecución hasta la que se calculan las métricas (ej: 2023-12-01)
+    ->state_dir: Directorio del buffer de precios diarios
+    ->rebuild: Si es True se descarta el buffer y se lee de nuevo la ventana completa
+    ->load_method: Método de carga masiva: multi, copy, s3 o auto
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    *Solo se leen los días desde el último día del buffer, que se recalcula porque las cargas intradía
+    pueden agregarle filas después, si el buffer no existe o es más antiguo que la ventana más larga
+    se lee la ventana completa y solo se calcula executed_at
+    ->return: Diccionario con las métricas de cada etapa (se guarda como XCom)
+    """
+    #  Heavy imports are deferred until the task runs
+    import pandas as pd
+    from utils.analytics import AnalyticsState, BUFFER_DAYS, daily_prices
+
+    metrics = StageMetrics("update_crypto_analytics", tags={"executed_at": executed_at})
+    with TaskRun(metrics, f"Error al actualizar las métricas de {table_name}") as task:
+        state = AnalyticsState(state_dir or ANALYTICS_STATE_DIR, table_name)
+        until = pd.Timestamp(executed_at)
+        horizon = until - pd.Timedelta(days=BUFFER_DAYS)
+        last_date = state.last_date
+        if rebuild or last_date is None or last_date < horizon:
+            #  Cold start, the output starts at executed_at so every window is complete
+            state.reset()
+            since, first_output = horizon, until
+        else:
+            #  The last buffered day is read again, intraday merges may have added rows to it
+            since, first_output = last_date - pd.Timedelta(days=1), last_date
+
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
+            dwh_host=dwh_host,
+            dwh_name=dwh_name,
+            dwh_user=dwh_user,
+            dwh_port=dwh_port,
+            dwh_password=dwh_password,
+        )
+
+        if until < first_output:
+            logging.info(f"Las métricas de {executed_at} ya fueron calculadas")
+        else:
+            with metrics.stage("read_history") as span:
+                new_prices = daily_prices(
+                    backend.read_price_history(
+                        table_name=table_name,
+                        schema=dwh_schema,
+                        since=since.date(),
+                        until=until.date(),
+                    )
+                )
+                span["rows"] = len(new_prices)
+
+            with metrics.stage("rolling_metrics") as span:
+                df_analytics = state.update(new_prices)
+                df_analytics = df_analytics[df_analytics["fecha"] >= first_output]
+                span["rows"] = len(df_analytics)
+
+            if not df_analytics.empty:
+                with metrics.stage("write_analytics", rows=len(df_analytics)):
+                    backend.write_analytics(
+                        df=df_analytics,
+                        table_name=table_name,
+                        schema=dwh_schema,
+                        load_method=load_method,
+                    )
+            #  The buffer is saved only after the metrics are stored
+            state.save()
+
+    return task.data
+
+
+def compact_crypto_tiers(
+    table_name,
+    dwh_host,
+    dwh_user,
+    dwh_name,
+    dwh_password,
+    dwh_port,
+    dwh_schema,
+    compact_until,
+    retention_days=None,
+    dwh_backend="redshift",
+    duckdb_path=None,
+):
+    """
+    Proceso de retención que compacta la tabla histórica en los niveles diario y mensual y poda las
+    filas de la tabla histórica más antiguas que la retención
+    ->table_name: Nombre de la tabla donde se almacena las cryptodivisas
+    ->dwh_host: Host del DataWarehouse
+    ->dwh_user: Usuario del DataWarehouse
+    ->dwh_name: Database name del DataWarehouse
+    ->dwh_password: Password del DataWarehouse
+    ->dwh_port: Puerto del DataWarehouse
+    ->dwh_schema: Esquema donde se guardan los datos dentro del DataWarehouse
+    ->compact_until: Primer día que no se compacta (ej: 2023-12-02), los días anteriores deben estar completos
+    ->retention_days: Días de la tabla histórica que se conservan, por defecto CRYPTO_RAW_RETENTION_DAYS
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    *La retención nunca es menor a la ventana de las métricas móviles, que se leen de la tabla histórica
+    ->return: Diccionario con las métricas de cada etapa (se guarda como XCom)
+    """
+    #  Heavy imports are deferred until the task runs
+    from utils.analytics import BUFFER_DAYS
+
+    metrics = StageMetrics("compact_crypto_tiers", tags={"compact_until": compact_until})
+    with TaskRun(metrics, f"Error al compactar los niveles de {table_name}") as task:
+        retention_days = retention_days or RAW_RETENTION_DAYS
+        if retention_days < BUFFER_DAYS + 1:
+            logging.warning(
+                f"Retención de {retention_days} días menor a la ventana de las métricas, se usan {BUFFER_DAYS + 1}"
+            )
+            retention_days = BUFFER_DAYS + 1
+
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
+            dwh_host=dwh_host,
+            dwh_name=dwh_name,
+            dwh_user=dwh_user,
+            dwh_port=dwh_port,
+            dwh_password=dwh_password,
+        )
+
+        #  Roll the complete days up into the tiers and prune the raw rows past the horizon
+        backend.compact_tiers(
+            table_name=table_name,
+            schema=dwh_schema,
+            compact_until=compact_until,
+            retention_days=retention_days,
+            metrics=metrics,
+        )
+
+    return task.data
 
 
 def send_alert_summary(
@@ -112,6 +833,17 @@ def send_alert_summary(
     email_smtp_secret,
     dag_name,
     ds,
+    base_currency=None,
+    pushdown=False,
+    top_k=5,
+    use_rollup=False,
+    handoff_path=None,
+    subscribers=None,
+    smtp_pool_size=2,
+    anomalies=None,
+    dwh_backend="redshift",
+    duckdb_path=None,
+    use_tiers=False,
 ):
     """
     Proceso de extracción de datos desde Redshift para calcular datos con cryptodivisas y obtener una alerta y enviarlo por correo al usuario
@@ -130,10 +862,47 @@ def send_alert_summary(
     ->email_smtp_secret: Clave de acceso al servicio SMTP
     ->dag_name: Nombre del dag
     ->ds: Fecha de ejecución dada por el context del dag
+    ->base_currency: Moneda base usada en el resumen (opcional)
+    ->pushdown: Si es True el resumen se calcula con una sola consulta dentro del DWH, tiene prioridad
+                sobre handoff_path y no aplica con subscribers
+    ->top_k: Número de cryptomonedas en cada lista del resumen
+    ->use_rollup: Si es True el promedio histórico se lee de la tabla de promedios históricos
+    ->handoff_path: Ruta del DataFrame de staging entregado por la tarea de carga (opcional), si no se
+                    usa pushdown y existe solo se consulta el histórico en el DWH, si no la tabla staging
+    ->subscribers: Lista o string JSON de suscriptores con email, min_price, max_price y top_k (opcional),
+                   si se da se calcula un resumen por suscriptor en una sola pasada y se envían
+                   con un pool de conexiones SMTP, si no se envía un solo correo a email_receiver
+    ->smtp_pool_size: Número de conexiones SMTP usadas para enviar los correos de los suscriptores
+    ->anomalies: Lista o string JSON con los movimientos anormales de la tarea de carga (opcional),
+                 se agregan al mensaje de todos los destinatarios
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    ->use_tiers: Si es True y use_rollup es False el promedio histórico se lee de los niveles diario y
+                 mensual, si es False se lee de la tabla histórica que compact_crypto_tiers poda
+    ->return: Diccionario con las métricas de cada etapa (se guarda como XCom)
     """
-    try:
-        #  Get engine connection to DataWareHouse
-        engine = connect_to_dwh(
+    #  Heavy imports are deferred until the task runs
+    import pandas as pd
+    from utils.handoff import FrameHandoff
+    from utils.utils import (
+        calculate_summary_crypto,
+        build_subscribers,
+        calculate_summary_subscribers,
+        build_string_summary,
+        send_email_alert,
+        send_email_alerts,
+    )
+
+    metrics = StageMetrics("send_alert_summary", tags={"ds": ds})
+    if not use_rollup and not use_tiers:
+        logging.warning(
+            f"El promedio histórico solo incluye las filas de {table_name} que no se han podado"
+        )
+    with TaskRun(metrics, "Error al construir mensaje") as task:
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
             dwh_host=dwh_host,
             dwh_name=dwh_name,
             dwh_user=dwh_user,
@@ -141,42 +910,188 @@ def send_alert_summary(
             dwh_password=dwh_password,
         )
 
-        # Build and save DataFrames staging and history
-        df_crypto_stg, df_crypto_hist = build_df_summary(
-            table_name=table_name,
-            schema=dwh_schema,
-            updated_at=updated_at,
-            engine=engine,
-            min_price=min_price,
-            max_price=max_price,
-        )
+        if isinstance(anomalies, str):
+            #  The DAG passes the anomalies of the load task as a JSON string
+            anomalies = json.loads(anomalies or "null")
+        df_anomalies = pd.DataFrame(anomalies) if anomalies else None
 
-        # Calculate summary data information
-        (
-            df_crypto_max_increment,
-            df_crypto_min_increment,
-            df_crypto_max_value,
-        ) = calculate_summary_crypto(
-            df_crypto_stg=df_crypto_stg, df_crypto_hist=df_crypto_hist
-        )
+        df_subscribers = None
+        if isinstance(subscribers, str):
+            #  The DAG passes the subscribers Variable as a JSON string
+            subscribers = json.loads(subscribers or "[]")
+        if subscribers:
+            df_subscribers = build_subscribers(
+                subscribers, email_receiver, min_price, max_price, top_k
+            )
+            #  Query once with the widest band of all the subscribers
+            min_price = df_subscribers["min_price"].min()
+            max_price = df_subscribers["max_price"].max()
 
-        # Build String summary
-        resume_message = build_string_summary(
-            df_crypto_max_increment=df_crypto_max_increment,
-            df_crypto_min_increment=df_crypto_min_increment,
-            df_crypto_max_value=df_crypto_max_value,
-        )
+        #  The pushdown wins over the handoff, it only returns the top k of a single band
+        use_pushdown = pushdown and df_subscribers is None
 
-        # Send alert message using SMTP
-        send_email_alert(
-            resume_message=resume_message,
-            email_sender=email_sender,
-            email_receiver=email_receiver,
-            email_smtp_secret=email_smtp_secret,
-            dag_name=dag_name,
-            ds=ds,
+        df_stg = None
+        if handoff_path and not use_pushdown:
+            #  Read the staged frame written by the load task with a memory map
+            with metrics.stage("handoff_read") as span:
+                df_stg = FrameHandoff(HANDOFF_DIR, HANDOFF_MAX_AGE_HOURS).read(
+                    handoff_path
+                )
+                span["rows"] = 0 if df_stg is None else len(df_stg)
+
+        if use_pushdown:
+            logging.info("Calculando el resumen con pushdown dentro del DWH")
+            # Calculate summary data information inside the DataWareHouse
+            with metrics.stage("summary_query", pushdown=1) as span:
+                (
+                    df_crypto_max_increment,
+                    df_crypto_min_increment,
+                    df_crypto_max_value,
+                ) = backend.summary_pushdown(
+                    table_name=table_name,
+                    schema=dwh_schema,
+                    updated_at=updated_at,
+                    min_price=min_price,
+                    max_price=max_price,
+                    base_currency=base_currency,
+                    top_k=top_k,
+                    use_rollup=use_rollup,
+                    use_tiers=use_tiers,
+                )
+                span["rows"] = (
+                    len(df_crypto_max_increment)
+                    + len(df_crypto_min_increment)
+                    + len(df_crypto_max_value)
+                )
+        else:
+            logging.info(
+                "Calculando el resumen con "
+                + ("el DataFrame entregado por la carga" if df_stg is not None else "la tabla staging")
+            )
+            # Build and save DataFrames staging and history
+            with metrics.stage("summary_query", pushdown=0) as span:
+                df_crypto_stg, df_crypto_hist = backend.summary_frames(
+                    table_name=table_name,
+                    schema=dwh_schema,
+                    updated_at=updated_at,
+                    min_price=min_price,
+                    max_price=max_price,
+                    base_currency=base_currency,
+                    use_rollup=use_rollup,
+                    use_tiers=use_tiers,
+                    df_stg=df_stg,
+                )
+                span["rows"] = len(df_crypto_stg) + len(df_crypto_hist)
+
+            # Calculate summary data information
+            with metrics.stage("calculate_summary") as span:
+                if df_subscribers is not None:
+                    span["subscribers"] = len(df_subscribers)
+                    summaries = calculate_summary_subscribers(
+                        df_crypto_stg=df_crypto_stg,
+                        df_crypto_hist=df_crypto_hist,
+                        df_subscribers=df_subscribers,
+                    )
+                else:
+                    (
+                        df_crypto_max_increment,
+                        df_crypto_min_increment,
+                        df_crypto_max_value,
+                    ) = calculate_summary_crypto(
+                        df_crypto_stg=df_crypto_stg,
+                        df_crypto_hist=df_crypto_hist,
+                        top_k=top_k,
+                    )
+
+        if df_subscribers is not None:
+            # Build one String summary per subscriber and send them over pooled SMTP connections
+            with metrics.stage("build_message") as span:
+                messages = [
+                    (
+                        email,
+                        build_string_summary(
+                            df_crypto_max_increment=max_increment,
+                            df_crypto_min_increment=min_increment,
+                            df_crypto_max_value=max_value,
+                            df_anomalies=df_anomalies,
+                        ),
+                    )
+                    for email, (max_increment, min_increment, max_value) in zip(
+                        df_subscribers["email"], summaries
+                    )
+                ]
+                span["bytes"] = sum(len(m.encode("utf-8")) for _, m in messages)
+
+            with metrics.stage("smtp_send", messages=len(messages)):
+                send_email_alerts(
+                    messages=messages,
+                    email_sender=email_sender,
+                    email_smtp_secret=email_smtp_secret,
+                    dag_name=dag_name,
+                    ds=ds,
+                    pool_size=smtp_pool_size,
+                )
+        else:
+            # Build String summary
+            with metrics.stage("build_message") as span:
+                resume_message = build_string_summary(
+                    df_crypto_max_increment=df_crypto_max_increment,
+                    df_crypto_min_increment=df_crypto_min_increment,
+                    df_crypto_max_value=df_crypto_max_value,
+                    df_anomalies=df_anomalies,
+                )
+                span["bytes"] = len(resume_message.encode("utf-8"))
+
+            # Send alert message using SMTP
+            with metrics.stage("smtp_send"):
+                send_email_alert(
+                    resume_message=resume_message,
+                    email_sender=email_sender,
+                    email_receiver=email_receiver,
+                    email_smtp_secret=email_smtp_secret,
+                    dag_name=dag_name,
+                    ds=ds,
+                )
+
+    return task.data
+
+
+def rebuild_rollup_crypto(
+    table_name,
+    dwh_host,
+    dwh_user,
+    dwh_name,
+    dwh_password,
+    dwh_port,
+    dwh_schema,
+    dwh_backend="redshift",
+    duckdb_path=None,
+):
+    """
+    Proceso de mantenimiento que reconstruye la tabla de promedios históricos desde la tabla crypto
+    y sus niveles diario y mensual
+    ->table_name: Nombre de la tabla donde se almacena las cryptodivisas
+    ->dwh_host: Host del DataWarehouse
+    ->dwh_user: Usuario del DataWarehouse
+    ->dwh_name: Database name del DataWarehouse
+    ->dwh_password: Password del DataWarehouse
+    ->dwh_port: Puerto del DataWarehouse
+    ->dwh_schema: Esquema donde se guardan los datos dentro del DataWarehouse
+    ->dwh_backend: Backend del DataWarehouse, redshift o duckdb (archivo local, ver utils.backends)
+    ->duckdb_path: Ruta del archivo DuckDB cuando dwh_backend es duckdb
+    ->return: void
+    """
+    with TaskRun(None, f"Error al reconstruir promedios históricos de {table_name}") as task:
+        #  Get the DataWareHouse backend, Redshift or an embedded DuckDB file
+        backend = task.open_backend(
+            dwh_backend=dwh_backend,
+            duckdb_path=duckdb_path,
+            dwh_host=dwh_host,
+            dwh_name=dwh_name,
+            dwh_user=dwh_user,
+            dwh_port=dwh_port,
+            dwh_password=dwh_password,
         )
 
-    except Exception as e:
-        logging.error(f"Error al construir mensaje:", {e})
-        raise e
+        #  Rebuild the rollup from the raw history and the compacted tiers
+        backend.rebuild_rollup(table_name=table_name, schema=dwh_schema)
@@ -0,0 +1,143 @@
+"""
+Author: Victor Velasco
+Name: metrics
+
+Description: This file contains the instrumentation used to measure every stage of the ETL
+and alert tasks (duration, rows, payload bytes and, when enabled, peak allocated memory) and to
+emit the measures as StatsD lines and JSON so they can be compared between runs
+"""
+
+# Library imports
+import os
+import json
+import time
+import logging  # For create logs
+import tracemalloc  # For measure the peak memory allocated by every stage
+from contextlib import contextmanager
+from utils.settings import METRICS_TRACE_MEMORY
+
+
+class StageMetrics:
+    """
+    Acumula las mediciones de las etapas de una tarea
+    ->task_name: Nombre de la tarea (ej: load_crypto_data)
+    ->prefix: Prefijo de las métricas StatsD
+    ->tags: Diccionario con datos que identifican la ejecución (ej: ds)
+    ->trace_memory: Si es True se mide el pico de memoria de cada etapa con tracemalloc, por defecto
+                    METRICS_TRACE_MEMORY
+    """
+
+    def __init__(self, task_name, prefix="crypto_etl", tags=None, trace_memory=None):
+        self.task_name = task_name
+        self.prefix = prefix
+        self.tags = tags or {}
+        self.stages = []
+        self.trace_memory = METRICS_TRACE_MEMORY if trace_memory is None else trace_memory
+        #  Peaks of the open stages, a nested stage reports its peak to the stage that contains it
+        self._open_peaks = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """
+        Mide una etapa, el diccionario entregado se puede completar con rows, bytes u otros valores
+        ->name: Nombre de la etapa
+        ->fields: Valores iniciales de la etapa
+        *Con trace_memory, peak_alloc_mb es el pico de memoria asignada (Python, NumPy y pandas) durante
+        la etapa por encima de la memoria asignada al iniciarla, medido con tracemalloc. El trazado se
+        detiene al cerrar la etapa más externa si lo inició esta instancia
+        """
+        if not self.trace_memory:
+            yield from self._stage(name, fields)
+            return
+        if not self._open_peaks and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self._open_peaks:
+            #  The peak reached so far belongs to the stage that contains this one
+            self._open_peaks[-1] = max(self._open_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        self._open_peaks.append(start_memory)
+        try:
+            yield from self._stage(name, fields, start_memory)
+        finally:
+            if not self._open_peaks and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def _stage(self, name, fields, start_memory=None):
+        span = {"stage": name, **fields}
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield span
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            span["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            if start_memory is not None:
+                peak = max(self._open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                span["peak_alloc_mb"] = round((peak - start_memory) / (1024 * 1024), 3)
+                if self._open_peaks:
+                    self._open_peaks[-1] = max(self._open_peaks[-1], peak)
+                tracemalloc.reset_peak()
+            span["status"] = status
+            self.stages.append(span)
+            logging.info(f"Métricas de la etapa {name}: {span}")
+
+    def to_dict(self):
+        """
+        ->return: Diccionario serializable con todas las etapas (apto para XCom)
+        """
+        return {"task": self.task_name, **self.tags, "stages": self.stages}
+
+    def to_statsd_lines(self):
+        """
+        ->return: Lista de líneas StatsD, tiempos como |ms y el resto de valores numéricos como |g
+        """
+        lines = []
+        for span in self.stages:
+            key = f"{self.prefix}.{self.task_name}.{span['stage']}"
+            for field, value in span.items():
+                if field in ("stage", "status") or not isinstance(value, (int, float)):
+                    continue
+                kind = "ms" if field == "duration_ms" else "g"
+                lines.append(f"{key}.{field}:{value}|{kind}")
+        return lines
+
+    def emit(self, metrics_dir):
+        """
+        Agrega las mediciones a los archivos metrics.statsd y metrics.jsonl del directorio dado
+        ->metrics_dir: Directorio donde se guardan las métricas, si es None no se escribe nada
+        ->return: Diccionario con todas las etapas
+        """
+        data = self.to_dict()
+        if not metrics_dir:
+            return data
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            with open(os.path.join(metrics_dir, "metrics.statsd"), "a") as file:
+                file.writelines(f"{line}\n" for line in self.to_statsd_lines())
+            with open(os.path.join(metrics_dir, "metrics.jsonl"), "a") as file:
+                file.write(json.dumps(data, default=str) + "\n")
+            logging.info(f"Métricas de {self.task_name} guardadas en {metrics_dir}")
+        except OSError as e:
+            #  Metrics must never break the task
+            logging.error(f"Error al guardar las métricas en {metrics_dir}: {e}")
+        return data
+
+
+@contextmanager
+def measure_stage(metrics, name, **fields):
+    """
+    Mide una etapa cuando se da un StageMetrics, si metrics es None no mide nada
+    ->metrics: StageMetrics o None
+    ->name: Nombre de la etapa
+    """
+    if metrics is None:
+        yield dict(fields)
+        return
+    with metrics.stage(name, **fields) as span:
+        yield span
@@ -0,0 +1,102 @@
+"""
+Author: Victor Velasco
+Name: ratelimit
+
+Description: This file contains the token bucket shared by all the requests to CoinAPI and the
+helpers used to compute the backoff between retries (jittered exponential or Retry-After)
+"""
+
+# Library imports
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime  # For parse Retry-After given as HTTP date
+from datetime import datetime, timezone
+
+#  Status codes of CoinAPI worth retrying, the rest of errors are returned at once
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Limitador de peticiones compartido entre hilos, cada petición consume un token y los tokens se
+    recargan a una tasa constante hasta la capacidad del bucket
+    ->rate: Tokens recargados por segundo, si es 0 o menor no se limita
+    ->capacity: Número máximo de peticiones seguidas (ráfaga)
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Espera hasta que haya tokens disponibles y no haya una pausa activa, después los consume
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                elapsed = max(0.0, now - self._updated)
+                self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+                self._updated = max(now, self._updated)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    wait = (tokens - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Detiene todas las peticiones durante los segundos dados (ej: después de un 429), al terminar
+        la pausa el bucket inicia vacío para no enviar una ráfaga
+        """
+        with self._lock:
+            until = self._clock() + seconds
+            if until > self._blocked_until:
+                self._blocked_until = until
+                self._tokens = 0.0
+                self._updated = until
+
+
+def parse_retry_after(value):
+    """
+    Convierte el header Retry-After en segundos
+    ->value: Segundos o fecha HTTP, puede ser None
+    ->return: Segundos a esperar o None si no se da o no es válido
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """
+    Calcula la espera antes del siguiente intento
+    ->attempt: Número de intento que falló, inicia en 0
+    ->base: Espera base en segundos
+    ->cap: Espera máxima en segundos del backoff exponencial
+    ->retry_after: Segundos indicados por el servidor (opcional), tienen prioridad sobre el backoff
+    *Sin Retry-After se usa full jitter: un valor aleatorio entre 0 y min(cap, base * 2^attempt)
+    ->return: Segundos a esperar
+    """
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(cap, base * 2**attempt))
@@ -17,3 +17,56 @@ LOCAL_TZ = timezone(LOCAL_TZ_NAME)
 
 # Environment Settings
 IS_LOCAL = os.getenv("AIRFLOW_ENVIRONMENT") == "local"
+
+
+# CoinAPI response cache settings
+CACHE_DIR = os.getenv("CRYPTO_CACHE_DIR", "/opt/airflow/cache/coinapi")
+CACHE_MAX_BYTES = int(os.getenv("CRYPTO_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+CACHE_MAX_AGE_DAYS = int(os.getenv("CRYPTO_CACHE_MAX_AGE_DAYS", 120))
+
+# Bulk load settings, the s3 load method is only used when both are defined
+S3_STAGING_BUCKET = os.getenv("CRYPTO_S3_STAGING_BUCKET")
+S3_STAGING_PREFIX = os.getenv("CRYPTO_S3_STAGING_PREFIX", "crypto_etl/staging")
+REDSHIFT_COPY_IAM_ROLE = os.getenv("CRYPTO_REDSHIFT_COPY_IAM_ROLE")
+
+# Warehouse connection pool settings
+DWH_POOL_SIZE = int(os.getenv("CRYPTO_DWH_POOL_SIZE", 5))
+DWH_MAX_OVERFLOW = int(os.getenv("CRYPTO_DWH_MAX_OVERFLOW", 5))
+DWH_POOL_RECYCLE = int(os.getenv("CRYPTO_DWH_POOL_RECYCLE", 1800))
+
+# Stage metrics settings, the StatsD and JSON lines of every task are appended here
+METRICS_DIR = os.getenv("CRYPTO_METRICS_DIR", "/opt/airflow/logs/metrics")
+# Peak memory of every stage with tracemalloc, off by default because tracing slows the task down
+METRICS_TRACE_MEMORY = os.getenv("CRYPTO_METRICS_TRACE_MEMORY", "false").lower() == "true"
+
+# Local Parquet landing zone of the CoinAPI snapshots
+LAKE_DIR = os.getenv("CRYPTO_LAKE_DIR", "/opt/airflow/lake")
+
+# CoinAPI client settings, requests share a token bucket and transient errors are retried
+COINAPI_RATE_PER_SECOND = float(os.getenv("CRYPTO_COINAPI_RATE_PER_SECOND", 2))
+COINAPI_BURST = int(os.getenv("CRYPTO_COINAPI_BURST", 4))
+COINAPI_MAX_RETRIES = int(os.getenv("CRYPTO_COINAPI_MAX_RETRIES", 4))
+COINAPI_BACKOFF_BASE = float(os.getenv("CRYPTO_COINAPI_BACKOFF_BASE", 1))
+COINAPI_BACKOFF_MAX = float(os.getenv("CRYPTO_COINAPI_BACKOFF_MAX", 30))
+COINAPI_TIMEOUT = float(os.getenv("CRYPTO_COINAPI_TIMEOUT", 30))
+
+# Handoff of the staged DataFrame between the load and summary tasks
+HANDOFF_DIR = os.getenv("CRYPTO_HANDOFF_DIR", "/opt/airflow/cache/handoff")
+HANDOFF_MAX_AGE_HOURS = int(os.getenv("CRYPTO_HANDOFF_MAX_AGE_HOURS", 48))
+
+# Trailing buffer of daily prices used to update the rolling analytics incrementally
+ANALYTICS_STATE_DIR = os.getenv("CRYPTO_ANALYTICS_STATE_DIR", "/opt/airflow/cache/analytics")
+
+# Streaming per coin statistics used to flag abnormal moves in the alert
+ANOMALY_STATE_DIR = os.getenv("CRYPTO_ANOMALY_STATE_DIR", "/opt/airflow/cache/anomaly")
+ANOMALY_Z_THRESHOLD = float(os.getenv("CRYPTO_ANOMALY_Z_THRESHOLD", 4))
+
+# Embedded DuckDB warehouse file used when the DWH_BACKEND Variable is duckdb
+DUCKDB_PATH = os.getenv("CRYPTO_DUCKDB_PATH", "/opt/airflow/cache/duckdb/crypto.duckdb")
+
+# Keep the historical averages in the crypto_hist_avg rollup, shared by every DAG that merges into
+# crypto so the rollup never misses rows. Seed it with a crypto_maintenance run before turning it on
+USE_ROLLUP = os.getenv("CRYPTO_USE_ROLLUP", "false").lower() == "true"
+
+# Days of raw rows kept in the crypto table, older rows only live in the daily and monthly tiers
+RAW_RETENTION_DAYS = int(os.getenv("CRYPTO_RAW_RETENTION_DAYS", 180))
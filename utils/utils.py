@@ -7,22 +7,97 @@ Description: This file contains all the functions used by the application
 
 # Library imports
 from sqlite3 import OperationalError
+import json  # For decode the raw responses
+import gzip  # For compress the files loaded through S3
+import io  # For read the CSV chunks without copying them
+import uuid
+import hashlib  # For build the key of the engines registry
+import queue  # For share the SMTP connections between threads
+import threading
+import time
+import functools  # For join the columns of the summary
+import datetime  # For the retention horizon of the tiers
 import requests  # For make an HTTP request
+from requests.adapters import HTTPAdapter  # For pool HTTP connections
+from concurrent.futures import ThreadPoolExecutor  # For concurrent requests
+import numpy as np  # For build typed columns
 import pandas as pd
 import logging  # For create logs
 import sqlalchemy as sa  #  For interact with DB
 import smtplib  # For send emails alerts
+from utils.settings import (
+    LOCAL_TZ_NAME,
+    DWH_POOL_SIZE,
+    DWH_MAX_OVERFLOW,
+    DWH_POOL_RECYCLE,
+    S3_STAGING_BUCKET,
+    S3_STAGING_PREFIX,
+    REDSHIFT_COPY_IAM_ROLE,
+    COINAPI_RATE_PER_SECOND,
+    COINAPI_BURST,
+    COINAPI_MAX_RETRIES,
+    COINAPI_BACKOFF_BASE,
+    COINAPI_BACKOFF_MAX,
+    COINAPI_TIMEOUT,
+)
+from utils.metrics import measure_stage
+from utils.ratelimit import (
+    RETRY_STATUS_CODES,
+    TokenBucket,
+    backoff_delay,
+    parse_retry_after,
+)
 
+try:
+    import pyarrow as pa  # For decode the raw JSON into columns
+    import pyarrow.compute as pc
+    import pyarrow.json as pa_json
+except ImportError:  # pragma: no cover - pyarrow is optional, numpy is used instead
+    pa = None
 
-def get_coin_api_information(base_currency, base_url, api_key):
+
+#  Token bucket shared by every request to CoinAPI inside the worker process
+API_RATE_LIMITER = TokenBucket(rate=COINAPI_RATE_PER_SECOND, capacity=COINAPI_BURST)
+
+
+def build_http_session(api_key, pool_size=4):
+    """
+    Esta función construye una sesión HTTP reutilizable para consultar CoinAPI
+    ->api_key: API Key para consultar coinAPI
+    ->pool_size: Número máximo de conexiones keep-alive abiertas hacia el host de la API
+    ->return: requests.Session con el pool de conexiones configurado
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"X-CoinAPI-Key": api_key})
+    return session
+
+
+def get_coin_api_information(
+    base_currency,
+    base_url,
+    api_key,
+    session=None,
+    raw=False,
+    rate_limiter=None,
+    max_retries=COINAPI_MAX_RETRIES,
+):
     """
     Esta funcion consulta el API de crypto usando:
     ->base_url:Url base de la api
     ->config_file: Archivo de configuración
     ->base_currency: Es la moneda en la cual queremos expresar la conversión del cripto ej: USD
+    ->session: Sesión HTTP compartida (opcional), si no se da se hace una petición sin pool
+    ->raw: Si es True devuelve los bytes de la respuesta sin decodificar el JSON
+    ->rate_limiter: TokenBucket de las peticiones (opcional), por defecto el del proceso
+    ->max_retries: Número de reintentos ante 429, errores 5xx, timeouts o errores de conexión
+    *Cada petición espera un token del rate limiter, ante un 429 se respeta Retry-After pausando
+    todas las peticiones del proceso, en otro caso se espera un backoff exponencial con jitter
+    *Si el servidor pide esperar más de COINAPI_BACKOFF_MAX segundos (cuota agotada) no se reintenta
     *Si la peticion no es 200 levanta un error de lo contrario devuelve un JSON con el response
     de la peticion.
-    *Se hará 3 reintentos en caso de error cada 5 segundos
     ->return: JSON con respuesta
     """
 
@@ -36,13 +111,51 @@ def get_coin_api_information(base_currency, base_url, api_key):
         headers = {
             "X-CoinAPI-Key": api_key,
         }
-        logging.warning(f"Consultando CoinAPI")
-        response = requests.get(endpoint_url, params=params, headers=headers)
-        response.raise_for_status()  #  Levanta un exception si status no es 200
-        logging.info(
-            f"Datos obtenidos correctamente, status_code:{response.status_code}"
-        )
-        return response.json()
+        http = session if session is not None else requests
+        limiter = rate_limiter if rate_limiter is not None else API_RATE_LIMITER
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            logging.warning(f"Consultando CoinAPI")
+            retry_after = None
+            try:
+                response = http.get(
+                    endpoint_url, params=params, headers=headers, timeout=COINAPI_TIMEOUT
+                )
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()  #  Levanta un exception si status no es 200
+                    logging.info(
+                        f"Datos obtenidos correctamente, status_code:{response.status_code}"
+                    )
+                    return response.content if raw else response.json()
+                error = f"status_code:{response.status_code}"
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                error = e
+
+            if attempt == max_retries:
+                break
+            delay = backoff_delay(
+                attempt, COINAPI_BACKOFF_BASE, COINAPI_BACKOFF_MAX, retry_after
+            )
+            if delay > COINAPI_BACKOFF_MAX:
+                logging.error(
+                    f"CoinAPI pide esperar {delay:.0f}s para {endpoint_url}, cuota agotada, no se reintenta"
+                )
+                break
+            logging.warning(
+                f"Reintento {attempt + 1} de {max_retries} para {endpoint_url} en {delay:.1f}s: {error}"
+            )
+            if retry_after is not None:
+                #  El límite es de la API key, todas las peticiones del proceso esperan
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+        logging.error(f"Error en la petición {endpoint_url}: {error}")
+        return None
     except requests.exceptions.RequestException as e:
         logging.error(f"Error en la petición {endpoint_url}: {e}")
         return None
@@ -51,14 +164,275 @@ def get_coin_api_information(base_currency, base_url, api_key):
         return None
 
 
-def build_dataframe(json_data):
+def get_coin_api_information_cached(
+    base_currency,
+    base_url,
+    api_key,
+    cache,
+    data_interval_start,
+    data_interval_end,
+    session=None,
+    raw=False,
+):
+    """
+    Esta función consulta el API de crypto pasando primero por la cache de respuestas en disco
+    ->base_currency: Moneda base ej: USD
+    ->base_url: Url base de la api
+    ->api_key: API Key para consultar coinAPI
+    ->cache: ResponseCache donde se guardan las respuestas crudas
+    ->data_interval_start: Inicio del intervalo de datos del DAG
+    ->data_interval_end: Fin del intervalo de datos del DAG
+    ->session: Sesión HTTP compartida (opcional)
+    ->raw: Si es True devuelve los bytes de la respuesta sin decodificar el JSON
+    *En modo replay nunca se consulta la API, si la respuesta no está en cache se levanta un error
+    ->return: JSON con respuesta
+    """
+    key = cache.build_key(base_currency, data_interval_start, data_interval_end)
+    content = cache.get(key)
+    if content is not None:
+        logging.info(
+            f"Respuesta obtenida desde cache para {base_currency} ({data_interval_start} - {data_interval_end})"
+        )
+        return content if raw else json.loads(content)
+
+    if cache.replay:
+        logging.error(
+            f"Respuesta no encontrada en cache para {base_currency} ({data_interval_start} - {data_interval_end})"
+        )
+        raise LookupError(
+            f"Modo replay: no existe respuesta en cache para {base_currency} ({data_interval_start} - {data_interval_end})"
+        )
+
+    content = get_coin_api_information(
+        base_currency=base_currency,
+        base_url=base_url,
+        api_key=api_key,
+        session=session,
+        raw=True,
+    )
+    if content is None:
+        return None
+    cache.put(key, content)
+    return content if raw else json.loads(content)
+
+
+def get_coin_api_information_multi(
+    base_currencies,
+    base_url,
+    api_key,
+    max_workers=4,
+    cache=None,
+    data_interval_start=None,
+    data_interval_end=None,
+    raw=False,
+):
+    """
+    Esta función consulta el API de crypto para varias monedas base de forma concurrente
+    ->base_currencies: Lista de monedas base ej: ["USD", "EUR", "GTQ", "MXN"]
+    ->base_url: Url base de la api
+    ->api_key: API Key para consultar coinAPI
+    ->max_workers: Número máximo de peticiones simultáneas, también es el tamaño del pool HTTP
+    ->cache: ResponseCache (opcional) usada junto con el intervalo de datos del DAG
+    ->data_interval_start: Inicio del intervalo de datos del DAG, usado como llave de la cache
+    ->data_interval_end: Fin del intervalo de datos del DAG, usado como llave de la cache
+    ->raw: Si es True devuelve los bytes de cada respuesta sin decodificar el JSON
+    *Todas las peticiones comparten la misma sesión para reutilizar las conexiones keep-alive
+    ->return: Lista de JSON en el mismo orden que base_currencies (None si la petición falló)
+    """
+
+    def fetch(currency, session):
+        if cache is not None and cache.enabled:
+            return get_coin_api_information_cached(
+                base_currency=currency,
+                base_url=base_url,
+                api_key=api_key,
+                cache=cache,
+                data_interval_start=data_interval_start,
+                data_interval_end=data_interval_end,
+                session=session,
+                raw=raw,
+            )
+        return get_coin_api_information(
+            base_currency=currency,
+            base_url=base_url,
+            api_key=api_key,
+            session=session,
+            raw=raw,
+        )
+
+    max_workers = max(1, min(max_workers, len(base_currencies)))
+    logging.warning(
+        f"Consultando CoinAPI para {len(base_currencies)} monedas base con {max_workers} peticiones simultáneas"
+    )
+    with build_http_session(api_key, pool_size=max_workers) as session:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = list(
+                executor.map(lambda currency: fetch(currency, session), base_currencies)
+            )
+    failed = [c for c, r in zip(base_currencies, responses) if r is None]
+    if failed:
+        logging.error(f"No se obtuvieron datos para las monedas base: {failed}")
+    logging.info(f"Datos obtenidos para {len(base_currencies) - len(failed)} monedas base")
+    return responses
+
+
+#  Explicit dtypes of the frames read from the DWH, currency codes repeat so they are stored as categories
+STG_DTYPES = {"moneda": "category", "base": "category", "precio": "float64"}
+WATERMARK_DTYPES = {"moneda": "category", "base": "category", "created_at": "datetime64[ns]"}
+FINGERPRINT_DTYPES = {"moneda": "category", "base": "category", "fingerprint": "int64"}
+SUMMARY_DTYPES = {
+    "posicion": "int64",
+    "precio_stg": "float64",
+    "precio_hist": "float64",
+    "porcentaje_cambio": "float64",
+    "precio": "float64",
+}
+
+
+def unify_categories(frames, columns):
+    """
+    Esta función deja las columnas categóricas de varios DataFrame con las mismas categorías
+    ->frames: Lista de DataFrame
+    ->columns: Columnas a unificar, las que no son categóricas en todos los DataFrame se omiten
+    *Con las mismas categorías pd.concat conserva el tipo category y las comparaciones y uniones usan los códigos
+    ->return: Lista de DataFrame en el mismo orden
+    """
+    for column in columns:
+        if not frames or not all(
+            isinstance(df[column].dtype, pd.CategoricalDtype) for df in frames
+        ):
+            continue
+        categories = pd.api.types.union_categoricals(
+            [df[column] for df in frames]
+        ).categories
+        frames = [
+            df.assign(**{column: df[column].cat.set_categories(categories)})
+            for df in frames
+        ]
+    return frames
+
+
+def concat_frames(frames):
+    """
+    Esta función une los DataFrame de varias respuestas conservando las monedas como categorías
+    ->frames: Lista de DataFrame construidos con build_dataframe, los None se omiten
+    ->return: Un DataFrame con todas las filas
+    """
+    frames = [df for df in frames if df is not None]
+    if not frames:
+        raise ValueError("No hay DataFrame para unir, todas las respuestas fallaron")
+    frames = unify_categories(frames, ["Moneda", "Base"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_snapshot_frame(apiResponses, base_currencies):
+    """
+    Esta función construye el snapshot de todas las monedas base a partir de sus respuestas
+    ->apiResponses: Lista de JSON en el mismo orden que base_currencies (ver get_coin_api_information_multi)
+    ->base_currencies: Lista de monedas base consultadas
+    *Si alguna moneda base no tiene datos se levanta un error, un snapshot parcial no se carga
+    ->return: Un DataFrame con las filas de todas las monedas base
+    """
+    frames = [
+        build_dataframe(apiResponse) if apiResponse is not None else None
+        for apiResponse in apiResponses
+    ]
+    failed = [
+        currency
+        for currency, df in zip(base_currencies, frames)
+        if df is None or df.empty
+    ]
+    if failed:
+        raise ValueError(
+            f"No se obtuvieron datos de coinAPI para {len(failed)} de {len(base_currencies)} monedas base: {failed}"
+        )
+    return concat_frames(frames)
+
+
+def build_dataframe_columnar(json_data):
+    """
+    Esta función construye un DataFrame decodificando el arreglo rates directamente en columnas tipadas
+    ->json_data: Son los datos obtenidos desde la API, puede ser el JSON decodificado o los bytes crudos de la respuesta
+    *Con bytes crudos y pyarrow disponible el JSON nunca se convierte en objetos de Python
+    ->return: Un DataFrame con las columnas Moneda y Base (category), Precio (float64) y created_at
+    """
+    if isinstance(json_data, (bytes, bytearray, memoryview)):
+        if pa is not None:
+            #  La respuesta es un único objeto JSON, el bloque debe contenerlo completo
+            table = pa_json.read_json(
+                pa.BufferReader(json_data),
+                read_options=pa_json.ReadOptions(
+                    block_size=max(len(json_data) + 1, 1 << 20)
+                ),
+                parse_options=pa_json.ParseOptions(newlines_in_values=True),
+            )
+            rates_type = table.schema.field("rates").type
+            #  Con rates vacío o nulo no hay campos que leer, se usa el camino de Python
+            if pa.types.is_list(rates_type) and pa.types.is_struct(rates_type.value_type):
+                rates = table.column("rates").combine_chunks().flatten()
+                base = table.column("asset_id_base")[0].as_py()
+                #  Los códigos de moneda se decodifican una sola vez como diccionario
+                moneda = pc.dictionary_encode(rates.field("asset_id_quote"))
+                moneda = pd.Categorical.from_codes(
+                    moneda.indices.to_numpy(zero_copy_only=False),
+                    moneda.dictionary.to_numpy(zero_copy_only=False),
+                    validate=False,
+                )
+                #  El buffer de Arrow es de solo lectura, reciprocal escribe una única copia
+                precio = np.reciprocal(
+                    pc.cast(rates.field("rate"), pa.float64()).to_numpy(
+                        zero_copy_only=False
+                    )
+                )
+                created_at = rates.field("time")
+                if pa.types.is_string(created_at.type):
+                    created_at = pc.cast(created_at, pa.timestamp("ns", tz="UTC"))
+                created_at = pc.cast(created_at, pa.timestamp("ns")).to_numpy(
+                    zero_copy_only=False
+                )
+                base = pd.Categorical.from_codes(np.zeros(len(moneda), dtype=np.int8), [base])
+                return pd.DataFrame(
+                    {"Moneda": moneda, "Base": base, "Precio": precio, "created_at": created_at},
+                    copy=False,
+                )
+        json_data = json.loads(json_data)
+
+    rates = json_data["rates"] or []
+    size = len(rates)
+    moneda = pd.Categorical(
+        np.fromiter((r["asset_id_quote"] for r in rates), dtype=object, count=size)
+    )
+    precio = np.fromiter((r["rate"] for r in rates), dtype=np.float64, count=size)
+    np.reciprocal(precio, out=precio)
+    created_at = pd.to_datetime(
+        np.fromiter((r["time"] for r in rates), dtype=object, count=size),
+        format="%Y-%m-%dT%H:%M:%S.%fZ",
+    ).to_numpy()
+    base = pd.Categorical.from_codes(
+        np.zeros(size, dtype=np.int8), [json_data["asset_id_base"]]
+    )
+    return pd.DataFrame(
+        {"Moneda": moneda, "Base": base, "Precio": precio, "created_at": created_at},
+        copy=False,
+    )
+
+
+def build_dataframe(json_data, parser="columnar"):
     """
     Esta función construye un DataFrame a partir de un JSON
-    ->json_data: Son los datos obtenidos desde la API
+    ->json_data: Son los datos obtenidos desde la API (JSON decodificado o bytes crudos)
+    ->parser: columnar (decodifica rates directo a columnas tipadas) o normalize (pd.json_normalize)
     ->return: Un DataFrame con los datos estructurados
     """
     try:
         logging.info(f"Construyendo Data Frame desde datos JSON")
+        if parser == "columnar":
+            dfCripto = build_dataframe_columnar(json_data)
+            logging.info(f"Data Frame creado:\n {dfCripto}")
+            return dfCripto
+
+        if isinstance(json_data, (bytes, bytearray, memoryview)):
+            json_data = json.loads(json_data)
         dfCripto = pd.json_normalize(json_data, "rates", ["asset_id_base"])
         logging.info(
             f"Reestructurando Data Frame para empatar la estructura de tablas en DWH"
@@ -75,6 +449,7 @@ def build_dataframe(json_data):
         dfCripto["created_at"] = pd.to_datetime(
             dfCripto["created_at"], format="%Y-%m-%dT%H:%M:%S.%fZ"
         )
+        dfCripto = dfCripto.astype({"Moneda": "category", "Base": "category"})
         logging.info(f"Data Frame creado:\n {dfCripto}")
         return dfCripto
     except Exception as e:
@@ -82,7 +457,115 @@ def build_dataframe(json_data):
         return None
 
 
-def connect_to_dwh(dwh_host, dwh_name, dwh_user, dwh_port, dwh_password):
+def build_backfill_intervals(start_date, end_date):
+    """
+    Esta función construye los intervalos diarios de datos que tendría el DAG entre dos fechas
+    ->start_date: Primera fecha lógica del rango (ej: 2023-12-01)
+    ->end_date: Última fecha lógica del rango, incluida
+    *Los intervalos inician a las 00:00 de la zona horaria de los dags y se expresan en UTC,
+    igual que data_interval_start | ts y data_interval_end | ts en Airflow
+    ->return: Lista de tuplas (data_interval_start, data_interval_end) en formato ISO
+    """
+    starts = pd.date_range(start_date, end_date, freq="D", tz=LOCAL_TZ_NAME)
+    return [
+        (
+            start.tz_convert("UTC").isoformat(),
+            (start + pd.DateOffset(days=1)).tz_convert("UTC").isoformat(),
+        )
+        for start in starts
+    ]
+
+
+def collect_backfill_snapshots(
+    base_currencies, base_url, api_key, cache, intervals, max_workers=4
+):
+    """
+    Esta función obtiene las respuestas de todas las monedas base para todos los intervalos y las une
+    en un solo DataFrame con las fechas updated_at y executed_at de cada intervalo
+    ->base_currencies: Lista de monedas base ej: ["USD", "EUR", "GTQ", "MXN"]
+    ->base_url: Url base de la api
+    ->api_key: API Key para consultar coinAPI
+    ->cache: ResponseCache de donde se leen (o guardan) las respuestas
+    ->intervals: Lista de tuplas (data_interval_start, data_interval_end), ver build_backfill_intervals
+    ->max_workers: Número máximo de lecturas o peticiones simultáneas
+    *Los intervalos sin respuesta en cache (modo replay) o con error en la API se omiten
+    *Si una fila aparece en varios intervalos se conserva la del intervalo más reciente,
+    igual que al ejecutar el DAG una vez por intervalo
+    ->return: DataFrame con las columnas Moneda, Base, Precio, created_at, updated_at y executed_at
+    """
+
+    def fetch(task, session):
+        (start, end), currency = task
+        try:
+            raw = get_coin_api_information_cached(
+                base_currency=currency,
+                base_url=base_url,
+                api_key=api_key,
+                cache=cache,
+                data_interval_start=start,
+                data_interval_end=end,
+                session=session,
+                raw=True,
+            )
+        except LookupError:
+            return None
+        df = build_dataframe(raw) if raw is not None else None
+        if df is None:
+            return None
+        end = pd.Timestamp(end).tz_convert("UTC")
+        return df.assign(updated_at=end.tz_localize(None), executed_at=end.date())
+
+    tasks = [(interval, currency) for interval in intervals for currency in base_currencies]
+    max_workers = max(1, min(max_workers, len(tasks)))
+    logging.warning(
+        f"Obteniendo {len(tasks)} respuestas para {len(intervals)} intervalos con {max_workers} peticiones simultáneas"
+    )
+    with build_http_session(api_key, pool_size=max_workers) as session:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(lambda task: fetch(task, session), tasks))
+    missing = [task for task, df in zip(tasks, frames) if df is None]
+    if missing:
+        logging.error(f"No se obtuvieron datos para {len(missing)} respuestas: {missing}")
+    frames = [df for df in frames if df is not None]
+    if not frames:
+        logging.info(f"No hay datos para los intervalos dados")
+        return pd.DataFrame(
+            columns=["Moneda", "Base", "Precio", "created_at", "updated_at", "executed_at"]
+        )
+
+    df = dedupe_snapshots(concat_frames(frames))
+    logging.info(f"Filas obtenidas para el backfill: {len(df)}")
+    return df
+
+
+def dedupe_snapshots(df):
+    """
+    Esta función conserva una fila por moneda, moneda base y created_at, la del intervalo más reciente
+    ->df: DataFrame con la columna updated_at del intervalo de cada fila
+    ->return: DataFrame sin filas repetidas
+    """
+    df = df.sort_values("updated_at", kind="stable").drop_duplicates(
+        subset=["Moneda", "Base", "created_at"], keep="last"
+    )
+    return df.reset_index(drop=True)
+
+
+#  Engines reused inside the worker process, keyed by connection and pool parameters
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def connect_to_dwh(
+    dwh_host,
+    dwh_name,
+    dwh_user,
+    dwh_port,
+    dwh_password,
+    pool_size=DWH_POOL_SIZE,
+    max_overflow=DWH_MAX_OVERFLOW,
+    pool_recycle=DWH_POOL_RECYCLE,
+    pool_pre_ping=True,
+):
     """
     Esta función se usa para construir el string de conexion
     para conectarse posteriormente a DWH de redshift
@@ -90,97 +573,1416 @@ def connect_to_dwh(dwh_host, dwh_name, dwh_user, dwh_port, dwh_password):
     ->dwh_name: Nombre de la base de datos en el DWH
     ->dwh_user: Username de la base de datos en el DWH
     ->dwh_password: Contraseña del DWH
+    ->pool_size: Número de conexiones que se mantienen abiertas en el pool
+    ->max_overflow: Número de conexiones adicionales permitidas sobre pool_size
+    ->pool_recycle: Segundos después de los cuales una conexión del pool se reemplaza
+    ->pool_pre_ping: Si es True se valida la conexión antes de entregarla desde el pool
+    *El motor se reutiliza dentro del mismo proceso para los mismos parámetros, usar
+    dispose_engines al terminar la tarea para cerrar las conexiones
     return: conn: conexion a redshift engine:Motor de DB
     """
 
-    #  Construye el string de conexión
-    connetion_string = f"postgresql://{dwh_user}:{dwh_password}@{dwh_host}:{dwh_port}/{dwh_name}?sslmode=require"
+    #  Construye el string de conexión
+    connetion_string = f"postgresql://{dwh_user}:{dwh_password}@{dwh_host}:{dwh_port}/{dwh_name}?sslmode=require"
+    key = (
+        hashlib.sha256(connetion_string.encode("utf-8")).hexdigest(),
+        pool_size,
+        max_overflow,
+        pool_recycle,
+        pool_pre_ping,
+    )
+
+    #  Se conecta a la DB
+    try:
+        with _ENGINES_LOCK:
+            engine = _ENGINES.get(key)
+            if engine is not None:
+                logging.info(
+                    f"Reutilizando motor de conexión en {dwh_host} username: {dwh_user}"
+                )
+                return engine
+            logging.warning(
+                f"Creando motor de conexión en {dwh_host} username: {dwh_user}"
+            )
+            engine = sa.create_engine(
+                connetion_string,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_recycle=pool_recycle,
+                pool_pre_ping=pool_pre_ping,
+            )
+            _ENGINES[key] = engine
+        logging.info(
+            f"Motor de conexión creado exitosamente en {dwh_host} username: {dwh_user}"
+        )
+        return engine
+    except sa.exc.OperationalError as e:
+        logging.error(f"Error durante conexión {dwh_host}: {e}")
+        raise OperationalError from e
+    except sa.exc.RuntimeError as e:
+        logging.error(
+            f"Error se agotó el tiempo de intento de conexión {dwh_host}: {e}"
+        )
+        raise RuntimeError from e
+    except Exception as e:
+        logging.error(f"Error inesperado al conectar {dwh_host}: {e}")
+        raise Exception from e
+
+
+def dispose_engines():
+    """
+    Esta función cierra las conexiones de todos los motores registrados en el proceso
+    return: Void
+    """
+    with _ENGINES_LOCK:
+        engines = list(_ENGINES.values())
+        _ENGINES.clear()
+    for engine in engines:
+        engine.dispose()
+    if engines:
+        logging.info(f"Motores de conexión cerrados: {len(engines)}")
+
+
+class CsvChunkStream:
+    """
+    Objeto tipo archivo que serializa un DataFrame a CSV por bloques de filas a medida que se lee,
+    así la memoria usada durante el COPY se limita a un solo bloque
+    ->df: DataFrame a serializar
+    ->chunk_size: Número de filas serializadas por bloque
+    """
+
+    def __init__(self, df, chunk_size=50000):
+        self._chunks = (
+            df.iloc[start : start + chunk_size].to_csv(
+                index=False, header=False, date_format="%Y-%m-%d %H:%M:%S.%f"
+            )
+            for start in range(0, len(df), chunk_size)
+        )
+        self._current = io.StringIO()
+
+    def read(self, size=-1):
+        #  Each read advances the offset of the current chunk instead of slicing the rest of it
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            data = self._current.read(remaining if size >= 0 else -1)
+            if data:
+                parts.append(data)
+                remaining -= len(data)
+                continue
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._current = io.StringIO(chunk)
+        return "".join(parts)
+
+
+def resolve_load_method(conn, load_method):
+    """
+    Esta función elige el método de carga masiva cuando load_method es auto
+    ->conn: Conexión abierta al DWH
+    ->load_method: auto, copy, s3 o multi
+    *auto usa s3 en Redshift si hay un bucket configurado, copy en PostgreSQL y multi en otro caso
+    ->return: Método de carga a utilizar
+    """
+    if load_method != "auto":
+        return load_method
+    if conn.dialect.name != "postgresql":
+        return "multi"
+    version = conn.execute("SELECT version()").scalar() or ""
+    if "redshift" in version.lower():
+        return "s3" if S3_STAGING_BUCKET and REDSHIFT_COPY_IAM_ROLE else "multi"
+    return "copy"
+
+
+def load_df_to_stg(df, table_name, schema, conn, load_method="multi", chunk_size=50000):
+    """
+    Esta función carga un DataFrame en una tabla staging existente usando un método de carga masiva
+    ->df: DataFrame a cargar
+    ->table_name: Nombre completo de la tabla staging (ej: crypto_stg)
+    ->schema: Esquema de la tabla staging
+    ->conn: Conexión abierta al DWH, la carga ocurre dentro de su transacción
+    ->load_method: copy (COPY FROM STDIN, PostgreSQL), s3 (COPY desde S3, Redshift),
+                   multi (df.to_sql con INSERT de múltiples filas) o auto
+    ->chunk_size: Número de filas por bloque en copy, por archivo en s3 y por INSERT en multi
+    return: Void
+    """
+    load_method = resolve_load_method(conn, load_method)
+    target = f"{schema}.{table_name}" if schema else table_name
+    columns = ", ".join(df.columns)
+    logging.warning(f"Cargando {len(df)} filas en {target} usando el método {load_method}")
+
+    if load_method == "copy":
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(
+            f"COPY {target} ({columns}) FROM STDIN WITH (FORMAT csv)",
+            CsvChunkStream(df, chunk_size=chunk_size),
+        )
+    elif load_method == "s3":
+        import boto3  # Only needed when loading through S3
+
+        s3 = boto3.client("s3")
+        prefix = f"{S3_STAGING_PREFIX}/{table_name}/{uuid.uuid4().hex}"
+        keys = []
+        try:
+            #  Un archivo comprimido por bloque, Redshift los carga en paralelo entre slices
+            for number, start in enumerate(range(0, len(df), chunk_size)):
+                body = gzip.compress(
+                    df.iloc[start : start + chunk_size]
+                    .to_csv(index=False, header=False, date_format="%Y-%m-%d %H:%M:%S.%f")
+                    .encode("utf-8")
+                )
+                key = f"{prefix}/part-{number:05d}.csv.gz"
+                s3.put_object(Bucket=S3_STAGING_BUCKET, Key=key, Body=body)
+                keys.append(key)
+            conn.execute(
+                f"""
+                COPY {target} ({columns})
+                FROM 's3://{S3_STAGING_BUCKET}/{prefix}/'
+                IAM_ROLE '{REDSHIFT_COPY_IAM_ROLE}'
+                FORMAT AS CSV GZIP TIMEFORMAT 'auto'
+                """
+            )
+        finally:
+            for key in keys:
+                s3.delete_object(Bucket=S3_STAGING_BUCKET, Key=key)
+    else:
+        df.to_sql(
+            table_name,
+            con=conn,
+            schema=schema,
+            if_exists="append",
+            method="multi",
+            index=False,
+            chunksize=chunk_size,
+        )
+    logging.info(f"Tabla: {target} cargada exitosamente")
+
+
+def read_watermarks(conn, table_name, schema):
+    """
+    Esta función obtiene la marca de agua (created_at más reciente cargado) por moneda
+    ->conn: Conexión abierta al DWH
+    ->table_name: Nombre de la tabla crypto, la marca de agua vive en {table_name}_watermark
+    ->schema: Esquema de la tabla
+    ->return: DataFrame con las columnas Moneda, Base y watermark
+    """
+    df_watermark = pd.read_sql_query(
+        f"SELECT moneda, base, created_at FROM {schema}.{table_name}_watermark",
+        conn,
+        dtype=WATERMARK_DTYPES,
+    )
+    return df_watermark.rename(
+        columns={"moneda": "Moneda", "base": "Base", "created_at": "watermark"}
+    )
+
+
+def filter_new_rows(df, df_watermark):
+    """
+    Esta función conserva solo las filas más recientes que la marca de agua de cada moneda
+    ->df: DataFrame construido con build_dataframe
+    ->df_watermark: DataFrame con la marca de agua por moneda (ver read_watermarks)
+    ->return: DataFrame con las filas nuevas, las monedas sin marca de agua se conservan completas
+    """
+    watermark = pd.to_datetime(
+        df[["Moneda", "Base"]].merge(df_watermark, on=["Moneda", "Base"], how="left")[
+            "watermark"
+        ]
+    ).to_numpy(dtype="datetime64[ns]")
+    #  En el DWH el timestamp se guarda en microsegundos
+    created_at = df["created_at"].dt.floor("us").to_numpy()
+    is_new = np.isnat(watermark) | (created_at > watermark)
+    return df[is_new]
+
+
+def fingerprint_frame(df):
+    """
+    Esta función calcula la huella de cada fila con el hash de Precio y created_at
+    ->df: DataFrame construido con build_dataframe
+    *created_at se lleva a microsegundos como se guarda en el DWH, así la huella no depende de la
+    resolución con la que se construyó el DataFrame (API o lake)
+    ->return: Array int64 (BIGINT en el DWH) con una huella por fila
+    """
+    return (
+        pd.util.hash_pandas_object(
+            pd.DataFrame(
+                {
+                    "Precio": df["Precio"].astype("float64"),
+                    "created_at": df["created_at"].astype("datetime64[ns]").dt.floor("us"),
+                }
+            ),
+            index=False,
+        )
+        .to_numpy()
+        .view(np.int64)
+    )
+
+
+def read_fingerprints(conn, table_name, schema):
+    """
+    Esta función obtiene la huella de la última carga por moneda
+    ->conn: Conexión abierta al DWH
+    ->table_name: Nombre de la tabla crypto, las huellas viven en {table_name}_fingerprint
+    ->schema: Esquema de la tabla
+    ->return: DataFrame con las columnas Moneda, Base y fingerprint
+    """
+    df_fingerprint = pd.read_sql_query(
+        f"SELECT moneda, base, fingerprint FROM {schema}.{table_name}_fingerprint",
+        conn,
+        dtype=FINGERPRINT_DTYPES,
+    )
+    return df_fingerprint.rename(columns={"moneda": "Moneda", "base": "Base"})
+
+
+def filter_changed_rows(df, df_fingerprint):
+    """
+    Esta función conserva solo las filas cuya huella es distinta a la de la última carga de su moneda
+    ->df: DataFrame construido con build_dataframe
+    ->df_fingerprint: DataFrame con la huella por moneda (ver read_fingerprints)
+    ->return: Tupla con el DataFrame de filas nuevas o modificadas y el DataFrame con las huellas a
+              guardar (Moneda, Base, fingerprint, la fila más reciente de cada moneda)
+    """
+    fingerprint = fingerprint_frame(df)
+    #  Int64 admite nulos sin pasar a float64, que no representa todos los valores de int64
+    previous = df[["Moneda", "Base"]].merge(
+        df_fingerprint.astype({"fingerprint": "Int64"}),
+        on=["Moneda", "Base"],
+        how="left",
+    )["fingerprint"]
+    is_changed = (
+        previous.isna().to_numpy()
+        | (previous.fillna(0).to_numpy(dtype=np.int64) != fingerprint)
+    )
+    df = df[is_changed]
+    df_new_fingerprint = (
+        df[["Moneda", "Base", "created_at"]]
+        .assign(fingerprint=fingerprint[is_changed])
+        .sort_values("created_at", kind="stable")
+        .drop_duplicates(subset=["Moneda", "Base"], keep="last")[
+            ["Moneda", "Base", "fingerprint"]
+        ]
+    )
+    return df, df_new_fingerprint
+
+
+def build_fingerprint_sql(table_name, schema, stg_table):
+    """
+    Esta función construye el DELETE de las huellas de las monedas cargadas en staging, después se
+    insertan las huellas nuevas en la misma transacción del MERGE
+    ->table_name: Nombre de la tabla histórica, las huellas viven en {table_name}_fingerprint
+    ->schema: Esquema de las tablas
+    ->stg_table: Nombre de la tabla staging con los datos recién cargados
+    ->return: String con la sentencia DELETE
+    """
+    return f"""
+                DELETE FROM {schema}.{table_name}_fingerprint
+                USING {schema}.{stg_table}
+                WHERE {table_name}_fingerprint.Moneda = {stg_table}.Moneda AND {table_name}_fingerprint.Base = {stg_table}.Base;
+                """
+
+
+def build_merge_sql(
+    table_name, schema, stg_table, updated_at, executed_at, time_range=None
+):
+    """
+    Esta función construye el MERGE (SCD I) de la tabla staging hacia la tabla histórica
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->stg_table: Nombre de la tabla staging de donde se toman los datos
+    ->updated_at: Fecha de actualización de los datos
+    ->executed_at: Fecha de ejecución del proceso
+    ->time_range: Tupla (min, max) de created_at (opcional) para limitar el MERGE al rango afectado
+    ->return: String con el MERGE
+    """
+    time_filter = ""
+    if time_range is not None:
+        time_filter = f"AND {table_name}.created_at BETWEEN '{time_range[0]}' AND '{time_range[1]}'"
+    return f"""
+                MERGE INTO {schema}.{table_name}
+                USING {schema}.{stg_table}
+                ON {table_name}.Moneda={stg_table}.Moneda AND {table_name}.Base={stg_table}.Base AND {table_name}.created_at={stg_table}.created_at {time_filter}
+                WHEN MATCHED THEN
+                    UPDATE SET 
+                    Precio = {stg_table}.Precio,
+                    created_at = {stg_table}.created_at,
+                    updated_at = {updated_at},
+                    executed_at = {executed_at}
+                WHEN NOT MATCHED THEN
+                    INSERT (Moneda, Base, Precio, created_at, updated_at, executed_at)
+                    VALUES ({stg_table}.Moneda, {stg_table}.Base, {stg_table}.Precio, {stg_table}.created_at, {updated_at}, {executed_at});
+                """
+
+
+def build_watermark_sql(table_name, schema, stg_table):
+    """
+    Esta función construye las sentencias que avanzan la marca de agua con los datos de staging
+    ->table_name: Nombre de la tabla histórica, la marca de agua vive en {table_name}_watermark
+    ->schema: Esquema de las tablas
+    ->stg_table: Nombre de la tabla staging con los datos recién cargados
+    *La marca de agua nunca retrocede, una carga de datos antiguos (backfill) no la modifica
+    ->return: String con las sentencias DELETE e INSERT
+    """
+    return f"""
+                DELETE FROM {schema}.{table_name}_watermark
+                USING {schema}.{stg_table}
+                WHERE {table_name}_watermark.Moneda = {stg_table}.Moneda AND {table_name}_watermark.Base = {stg_table}.Base
+                AND {table_name}_watermark.created_at < {stg_table}.created_at;
+                INSERT INTO {schema}.{table_name}_watermark (Moneda, Base, created_at)
+                SELECT Moneda, Base, MAX(created_at) FROM {schema}.{stg_table}
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {schema}.{table_name}_watermark
+                    WHERE {table_name}_watermark.Moneda = {stg_table}.Moneda AND {table_name}_watermark.Base = {stg_table}.Base
+                )
+                GROUP BY Moneda, Base;
+                """
+
+
+def build_rollup_sql(table_name, schema, stg_table, time_range=None):
+    """
+    Esta función construye las sentencias que actualizan la suma y el conteo de precios por moneda en
+    {table_name}_hist_avg con los datos de staging, se deben ejecutar antes del MERGE en la misma transacción
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->stg_table: Nombre de la tabla staging con los datos recién cargados
+    ->time_range: Tupla (min, max) de created_at (opcional) para limitar la búsqueda en la tabla histórica
+    *Las filas que ya existen en la tabla histórica solo cambian la suma por la diferencia de precio,
+    las filas nuevas suman su precio y cuentan una fila más
+    ->return: String con las sentencias
+    """
+    time_filter = ""
+    if time_range is not None:
+        time_filter = f"AND {table_name}.created_at BETWEEN '{time_range[0]}' AND '{time_range[1]}'"
+    return f"""
+                CREATE TEMP TABLE {table_name}_hist_avg_delta AS
+                SELECT {stg_table}.Moneda, {stg_table}.Base,
+                       SUM({stg_table}.Precio - COALESCE({table_name}.Precio, 0)) AS suma_precio,
+                       SUM(CASE WHEN {table_name}.Moneda IS NULL THEN 1 ELSE 0 END) AS conteo
+                FROM {schema}.{stg_table}
+                LEFT JOIN {schema}.{table_name}
+                ON {table_name}.Moneda={stg_table}.Moneda AND {table_name}.Base={stg_table}.Base AND {table_name}.created_at={stg_table}.created_at {time_filter}
+                GROUP BY {stg_table}.Moneda, {stg_table}.Base;
+                UPDATE {schema}.{table_name}_hist_avg
+                SET suma_precio = {table_name}_hist_avg.suma_precio + {table_name}_hist_avg_delta.suma_precio,
+                    conteo = {table_name}_hist_avg.conteo + {table_name}_hist_avg_delta.conteo
+                FROM {table_name}_hist_avg_delta
+                WHERE {table_name}_hist_avg.Moneda = {table_name}_hist_avg_delta.Moneda AND {table_name}_hist_avg.Base = {table_name}_hist_avg_delta.Base;
+                INSERT INTO {schema}.{table_name}_hist_avg (Moneda, Base, suma_precio, conteo)
+                SELECT Moneda, Base, suma_precio, conteo FROM {table_name}_hist_avg_delta
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {schema}.{table_name}_hist_avg
+                    WHERE {table_name}_hist_avg.Moneda = {table_name}_hist_avg_delta.Moneda AND {table_name}_hist_avg.Base = {table_name}_hist_avg_delta.Base
+                );
+                DROP TABLE {table_name}_hist_avg_delta;
+                """
+
+
+def build_rebuild_rollup_sql(table_name, schema):
+    """
+    Esta función construye las sentencias que reemplazan {table_name}_hist_avg con la suma y el conteo
+    de precios de todo el histórico, ver build_tiers_history_sql
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->return: String con las sentencias, se deben ejecutar en una transacción
+    """
+    return f"""
+                DELETE FROM {schema}.{table_name}_hist_avg;
+                INSERT INTO {schema}.{table_name}_hist_avg (Moneda, Base, suma_precio, conteo)
+                SELECT moneda, base, SUM(suma_precio), SUM(conteo)
+                FROM ({build_tiers_history_sql(table_name, schema)}) niveles
+                GROUP BY moneda, base;
+                """
+
+
+def rebuild_hist_avg_rollup(table_name, schema, engine):
+    """
+    Esta función reconstruye {table_name}_hist_avg a partir de todo el histórico de la tabla crypto
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->engine: motor de conexión a la DB de Redshift
+    *Las filas podadas de la tabla crypto se leen de los niveles diario y mensual (ver build_tiers_history_sql)
+    return: Void
+    """
+    try:
+        logging.warning(f"Conectandose a la base de datos")
+        with engine.connect() as conn, conn.begin():
+            logging.info(f"Conectado exitosamente")
+            logging.warning(f"Reconstruyendo {table_name}_hist_avg desde {table_name} y sus niveles")
+            conn.execute(
+                f"""
+                BEGIN;
+                {build_rebuild_rollup_sql(table_name, schema)}
+                COMMIT;
+                """
+            )
+            logging.info(f"Tabla: {table_name}_hist_avg reconstruida exitosamente")
+    except Exception as e:
+        logging.error(
+            f"Error al intentar reconstruir la tabla: {table_name}_hist_avg del esquema: {schema}",
+            e,
+        )
+        raise Exception from e
+
+
+def build_compacted_until_sql(table_name, schema):
+    """
+    ->return: Subconsulta con el primer día sin compactar de la tabla crypto, 1900-01-01 si nunca se compactó
+    """
+    return f"(SELECT COALESCE(MAX(compactado_hasta), CAST('1900-01-01' AS DATE)) FROM {schema}.{table_name}_retention)"
+
+
+def read_compacted_until(conn, table_name, schema):
+    """
+    ->conn: Conexión abierta al DWH
+    ->return: Primer día sin compactar de la tabla crypto, 1900-01-01 si nunca se compactó
+    """
+    return conn.execute(f"SELECT {build_compacted_until_sql(table_name, schema)}").scalar()
+
+
+def filter_compacted_rows(df, compacted_until):
+    """
+    Esta función descarta las filas de días ya compactados en los niveles diario y mensual
+    ->df: DataFrame con la columna created_at
+    ->compacted_until: Primer día sin compactar, ver read_compacted_until
+    *Las filas anteriores ya se sumaron a {table_name}_daily y pueden estar podadas de la tabla crypto,
+    si entraran al MERGE se insertarían de nuevo y la siguiente compactación las sumaría dos veces
+    ->return: DataFrame con las filas desde compacted_until
+    """
+    is_open = (df["created_at"] >= pd.Timestamp(compacted_until)).to_numpy()
+    if not is_open.all():
+        logging.warning(
+            f"Se omiten {int((~is_open).sum())} filas anteriores a {compacted_until:%Y-%m-%d}, ese rango ya está compactado"
+        )
+    return df[is_open]
+
+
+def build_tiers_history_sql(table_name, schema):
+    """
+    Esta función construye la consulta de la suma y el conteo de precios de todo el histórico leyendo
+    cada periodo del nivel más agregado que lo contiene
+    ->table_name: Nombre de la tabla histórica, los niveles viven en {table_name}_daily y {table_name}_monthly
+    ->schema: Esquema de las tablas
+    *Los meses completos anteriores a compactado_hasta se leen de {table_name}_monthly, los días de ese mes
+    de {table_name}_daily y desde compactado_hasta de la tabla crypto, sin compactación todo se lee de crypto
+    ->return: String con la consulta de las columnas moneda, base, suma_precio y conteo (una fila por moneda y periodo)
+    """
+    compacted_until = build_compacted_until_sql(table_name, schema)
+    return f"""
+        SELECT moneda, base, suma_precio, conteo FROM {schema}.{table_name}_monthly
+        WHERE mes < DATE_TRUNC('month', {compacted_until})
+        UNION ALL
+        SELECT moneda, base, suma_precio, conteo FROM {schema}.{table_name}_daily
+        WHERE fecha >= DATE_TRUNC('month', {compacted_until}) AND fecha < {compacted_until}
+        UNION ALL
+        SELECT moneda, base, precio, 1 FROM {schema}.{table_name}
+        WHERE created_at >= {compacted_until}
+    """
+
+
+def build_daily_tier_sql(table_name, schema, where):
+    """
+    Esta función construye la consulta OHLC diaria de la tabla crypto
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->where: Filtro de las filas de la tabla crypto a agregar
+    *El día es el de created_at, apertura y cierre son el primer y el último precio del día
+    ->return: String con la consulta de las columnas de {table_name}_daily
+    """
+    day = "CAST(created_at AS DATE)"
+    window = f"PARTITION BY moneda, base, {day} ORDER BY created_at ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING"
+    return f"""
+        SELECT moneda, base, fecha, MAX(apertura) AS apertura, MAX(precio) AS maximo, MIN(precio) AS minimo,
+               MAX(cierre) AS cierre, SUM(precio) AS suma_precio, COUNT(*) AS conteo,
+               MIN(created_at) AS apertura_at, MAX(created_at) AS cierre_at
+        FROM (
+            SELECT moneda, base, {day} AS fecha, precio, created_at,
+                   FIRST_VALUE(precio) OVER ({window}) AS apertura,
+                   LAST_VALUE(precio) OVER ({window}) AS cierre
+            FROM {schema}.{table_name}
+            WHERE {where}
+        ) precios
+        GROUP BY moneda, base, fecha
+    """
+
+
+def build_monthly_tier_sql(table_name, schema, since):
+    """
+    Esta función construye la consulta OHLC mensual a partir de {table_name}_daily
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->since: Primer día de los meses a agregar
+    ->return: String con la consulta de las columnas de {table_name}_monthly
+    """
+    month = "CAST(DATE_TRUNC('month', fecha) AS DATE)"
+    window = f"PARTITION BY moneda, base, {month} ORDER BY fecha ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING"
+    return f"""
+        SELECT moneda, base, mes, MAX(apertura) AS apertura, MAX(maximo) AS maximo, MIN(minimo) AS minimo,
+               MAX(cierre) AS cierre, SUM(suma_precio) AS suma_precio, SUM(conteo) AS conteo
+        FROM (
+            SELECT moneda, base, {month} AS mes, maximo, minimo, suma_precio, conteo,
+                   FIRST_VALUE(apertura) OVER ({window}) AS apertura,
+                   LAST_VALUE(cierre) OVER ({window}) AS cierre
+            FROM {schema}.{table_name}_daily
+            WHERE fecha >= '{since}'
+        ) dias
+        GROUP BY moneda, base, mes
+    """
+
+
+def compaction_limits(compact_until, retention_days, horizon_old, compacted_old):
+    """
+    Esta función calcula los límites de una compactación a partir de los guardados en {table_name}_retention
+    ->compact_until: Primer día que no se compacta (ej: 2023-12-02)
+    ->retention_days: Días de la tabla crypto que se conservan antes de compact_until
+    ->horizon_old: Horizonte de la última compactación, None si nunca se compactó
+    ->compacted_old: Día hasta donde se compactó la última vez, None si nunca se compactó
+    *Los límites nunca retroceden
+    ->return: Tupla (compactado_hasta, horizonte) con los nuevos límites
+    """
+    compacted = max(
+        pd.Timestamp(compact_until).date(), compacted_old or datetime.date.min
+    )
+    horizon = max(
+        compacted - datetime.timedelta(days=retention_days),
+        horizon_old or datetime.date.min,
+    )
+    return compacted, horizon
+
+
+def build_compact_tiers_sql(table_name, schema, compacted, horizon, horizon_old, first_day):
+    """
+    Esta función construye las sentencias de una compactación de la tabla crypto en los niveles diario
+    y mensual, ver compact_tiers
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->compacted: Nuevo día hasta donde se compacta, ver compaction_limits
+    ->horizon: Nuevo horizonte, las filas anteriores se podan de la tabla crypto
+    ->horizon_old: Horizonte de la última compactación, None si nunca se compactó
+    ->first_day: Día más antiguo de la tabla crypto anterior a compacted, None si no hay filas
+    ->return: String con las sentencias, se deben ejecutar en una transacción
+    """
+    daily_table = f"{table_name}_daily"
+    recompute_filter = f"created_at < '{compacted}'"
+    delete_filter = f"fecha < '{compacted}'"
+    late_sql = ""
+    if horizon_old is not None:
+        recompute_filter += f" AND created_at >= '{horizon_old}'"
+        delete_filter += f" AND fecha >= '{horizon_old}'"
+        late_sql = f"""
+                CREATE TEMP TABLE {daily_table}_late AS
+                {build_daily_tier_sql(table_name, schema, f"created_at < '{horizon_old}'")};
+                UPDATE {schema}.{daily_table}
+                SET apertura = CASE WHEN {daily_table}_late.apertura_at < {daily_table}.apertura_at THEN {daily_table}_late.apertura ELSE {daily_table}.apertura END,
+                    cierre = CASE WHEN {daily_table}_late.cierre_at > {daily_table}.cierre_at THEN {daily_table}_late.cierre ELSE {daily_table}.cierre END,
+                    maximo = GREATEST({daily_table}.maximo, {daily_table}_late.maximo),
+                    minimo = LEAST({daily_table}.minimo, {daily_table}_late.minimo),
+                    suma_precio = {daily_table}.suma_precio + {daily_table}_late.suma_precio,
+                    conteo = {daily_table}.conteo + {daily_table}_late.conteo,
+                    apertura_at = LEAST({daily_table}.apertura_at, {daily_table}_late.apertura_at),
+                    cierre_at = GREATEST({daily_table}.cierre_at, {daily_table}_late.cierre_at)
+                FROM {daily_table}_late
+                WHERE {daily_table}.Moneda = {daily_table}_late.Moneda AND {daily_table}.Base = {daily_table}_late.Base
+                AND {daily_table}.fecha = {daily_table}_late.fecha;
+                INSERT INTO {schema}.{daily_table}
+                SELECT * FROM {daily_table}_late
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {schema}.{daily_table}
+                    WHERE {daily_table}.Moneda = {daily_table}_late.Moneda AND {daily_table}.Base = {daily_table}_late.Base
+                    AND {daily_table}.fecha = {daily_table}_late.fecha
+                );
+                DROP TABLE {daily_table}_late;
+                """
+    #  Los meses afectados empiezan en el día más antiguo recalculado o sumado
+    month_since = min(day for day in (first_day, horizon_old, compacted) if day is not None).replace(day=1)
+    return f"""
+                    DELETE FROM {schema}.{daily_table} WHERE {delete_filter};
+                    INSERT INTO {schema}.{daily_table}
+                    {build_daily_tier_sql(table_name, schema, recompute_filter)};
+                    {late_sql}
+                    DELETE FROM {schema}.{table_name} WHERE created_at < '{horizon}';
+                    DELETE FROM {schema}.{table_name}_monthly WHERE mes >= '{month_since}';
+                    INSERT INTO {schema}.{table_name}_monthly
+                    {build_monthly_tier_sql(table_name, schema, month_since)};
+                    DELETE FROM {schema}.{table_name}_retention;
+                    INSERT INTO {schema}.{table_name}_retention (horizonte, compactado_hasta)
+                    VALUES ('{horizon}', '{compacted}');
+                    """
+
+
+def compact_tiers(table_name, schema, engine, compact_until, retention_days, metrics=None):
+    """
+    Esta función compacta la tabla crypto en los niveles diario y mensual y poda las filas antiguas
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->engine: motor de conexión a la DB de Redshift
+    ->compact_until: Primer día que no se compacta (ej: 2023-12-02), los días anteriores deben estar completos
+    ->retention_days: Días de la tabla crypto que se conservan antes de compact_until
+    ->metrics: StageMetrics donde se registra la etapa de compactación (opcional)
+    *Los días desde el último horizonte se recalculan desde crypto, que está completa en ese rango. Las
+    cargas omiten las filas anteriores a compactado_hasta (ver filter_compacted_rows), así repetir un rango
+    compactado no suma sus filas otra vez, y las filas más antiguas que el horizonte que lleguen por otra vía
+    se suman a su día en {table_name}_daily una sola vez antes de podarse. Después se recalculan los meses afectados, todo
+    en una transacción, y {table_name}_retention guarda el horizonte y el día hasta donde se compactó
+    *Redshift recupera el espacio de las filas podadas con el VACUUM DELETE automático
+    return: Void
+    """
+    try:
+        logging.warning(f"Conectandose a la base de datos")
+        with engine.connect() as conn, conn.begin():
+            logging.info(f"Conectado exitosamente")
+            horizon_old, compacted_old = conn.execute(
+                f"SELECT MAX(horizonte), MAX(compactado_hasta) FROM {schema}.{table_name}_retention"
+            ).fetchone()
+            compacted, horizon = compaction_limits(
+                compact_until, retention_days, horizon_old, compacted_old
+            )
+            first_day = conn.execute(
+                f"SELECT CAST(MIN(created_at) AS DATE) FROM {schema}.{table_name} WHERE created_at < '{compacted}'"
+            ).scalar()
+
+            logging.warning(
+                f"Compactando {table_name} hasta {compacted} y podando las filas anteriores a {horizon}"
+            )
+            with measure_stage(metrics, "compact_tiers"):
+                conn.execute(
+                    f"""
+                    BEGIN;
+                    {build_compact_tiers_sql(table_name, schema, compacted, horizon, horizon_old, first_day)}
+                    COMMIT;
+                    """
+                )
+            logging.info(f"Tabla: {table_name} compactada exitosamente hasta {compacted}")
+    except Exception as e:
+        logging.error(
+            f"Error al intentar compactar la tabla: {table_name} del esquema: {schema}",
+            e,
+        )
+        raise Exception from e
+
+
+def shard_frame(df, shards, column="Moneda"):
+    """
+    Esta función divide un DataFrame en shards con el hash de una columna
+    ->df: DataFrame a dividir
+    ->shards: Número de shards
+    ->column: Columna usada para el hash, todas las filas de una moneda caen en el mismo shard
+    ->return: Lista de DataFrame no vacíos
+    """
+    shard = pd.util.hash_pandas_object(df[column], index=False).to_numpy() % shards
+    frames = [df[shard == number] for number in range(shards)]
+    return [frame for frame in frames if not frame.empty]
+
+
+def load_df_to_stg_sharded(
+    df,
+    table_name,
+    schema,
+    engine,
+    shards=4,
+    max_workers=None,
+    load_method="multi",
+    chunk_size=50000,
+):
+    """
+    Esta función vacía una tabla de trabajo y la carga con varios shards en paralelo, cada shard usa
+    su propia conexión del pool y su propia transacción
+    ->df: DataFrame a cargar
+    ->table_name: Nombre completo de la tabla de trabajo (ej: crypto_stg_load)
+    ->schema: Esquema de la tabla de trabajo
+    ->engine: motor de conexión a la DB de Redshift, ver connect_to_dwh
+    ->shards: Número de shards, las filas se dividen con el hash de Moneda
+    ->max_workers: Número máximo de cargas simultáneas, por defecto el tamaño del pool menos la
+                   conexión que mantiene la tarea abierta
+    ->load_method: Método de carga de cada shard: multi, copy o s3 (ver load_df_to_stg)
+    ->chunk_size: Número de filas por bloque durante la carga masiva
+    *Cada shard confirma por separado, por eso la carga va a una tabla de trabajo y no a staging: si falla
+    uno se cancelan los pendientes, se vacía la tabla de trabajo y se levanta el error. create_tbl_from_df
+    copia la tabla de trabajo a staging en la transacción del MERGE, solo cuando cargaron todos los shards
+    return: Void
+    """
+    frames = shard_frame(df, shards)
+    max_workers = max(1, min(max_workers or DWH_POOL_SIZE - 1, len(frames)))
+    target = f"{schema}.{table_name}"
+
+    def load(frame):
+        with engine.connect() as conn, conn.begin():
+            load_df_to_stg(
+                df=frame,
+                table_name=table_name,
+                schema=schema,
+                conn=conn,
+                load_method=load_method,
+                chunk_size=chunk_size,
+            )
+
+    with engine.connect() as conn, conn.begin():
+        conn.execute(f"TRUNCATE TABLE {target}")
+    logging.warning(
+        f"Cargando {len(df)} filas en {target} con {len(frames)} shards y {max_workers} conexiones"
+    )
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [executor.submit(load, frame) for frame in frames]
+        for future in futures:
+            future.result()
+    except Exception:
+        executor.shutdown(wait=True, cancel_futures=True)
+        logging.error(f"Error al cargar un shard, vaciando {target}")
+        with engine.connect() as conn, conn.begin():
+            conn.execute(f"TRUNCATE TABLE {target}")
+        raise
+    executor.shutdown(wait=True)
+    logging.info(f"Tabla: {target} cargada exitosamente con {len(frames)} shards")
+
+
+def create_tbl_from_df(
+    df,
+    table_name,
+    schema,
+    engine,
+    executed_at,
+    updated_at,
+    load_method="multi",
+    chunk_size=50000,
+    incremental=False,
+    rollup=False,
+    metrics=None,
+    shards=1,
+    change_detection=False,
+):
+    """
+    Esta función se usa para crear una tabla usando un DataFrame
+    ->df: El DataFrame a convertir en tabla dentro de Redshift
+    ->table_name: Nombre de la tabla
+    ->schema: Nombre del esquema donde se va crear la tabla
+    ->engine: motor de conexión a la DB de Redshift
+    ->load_method: Método de carga de la tabla staging: multi, copy, s3 o auto (ver load_df_to_stg)
+    ->chunk_size: Número de filas por bloque durante la carga masiva
+    ->incremental: Si es True solo se aplica MERGE a las filas más recientes que la marca de agua
+                   por moneda guardada en {table_name}_watermark, y el MERGE se limita al rango de
+                   created_at de esas filas. {table_name}_stg siempre conserva el snapshot completo
+    ->rollup: Si es True se actualiza {table_name}_hist_avg en la misma transacción del MERGE
+    ->metrics: StageMetrics donde se registran las etapas de carga a staging y MERGE (opcional)
+    ->shards: Si es mayor a 1 y el método es copy (PostgreSQL) la tabla staging se carga en paralelo
+              con ese número de shards y conexiones del pool en {table_name}_stg_load (ver
+              load_df_to_stg_sharded), y se copia a staging en la transacción del MERGE solo si
+              cargaron todos los shards. En Redshift no se usa: s3 ya carga los archivos en paralelo y los
+              INSERT de multi en la misma tabla se serializan
+    ->change_detection: Si es True solo se aplica MERGE a las filas cuya huella (hash de Precio y
+                        created_at) cambió respecto a {table_name}_fingerprint, las huellas se
+                        actualizan en la misma transacción del MERGE. Como la huella incluye
+                        created_at es redundante con incremental, conviene activar solo uno
+    *Las filas de días ya compactados no entran al MERGE, ver filter_compacted_rows
+    *Si el filtro descarta filas, las que entran al MERGE se cargan en {table_name}_stg_merge, una tabla
+    de trabajo creada por el DAG. Las marcas de agua y huellas se leen en la transacción del MERGE
+    ->return: DataFrame cargado en {table_name}_stg (el snapshot completo)
+    """
+
+    try:
+        logging.warning(f"Conectandose a la base de datos")
+        with engine.connect() as conn:
+            logging.info(f"Conectado exitosamente")
+            load_method = resolve_load_method(conn, load_method)
+            sharded = shards > 1 and load_method == "copy"
+            if shards > 1 and not sharded:
+                logging.info(f"Carga en shards omitida con el método {load_method}")
+
+            logging.warning(
+                f"Actualizando tabla {table_name}_stg a partir del información del Data Frame"
+            )
+            if sharded:
+                #  Cada shard confirma su propia transacción en la tabla de trabajo, staging y la
+                #  tabla histórica no cambian si falla alguno
+                with measure_stage(metrics, "load_stg", rows=len(df), shards=shards):
+                    load_df_to_stg_sharded(
+                        df=df,
+                        table_name=f"{table_name}_stg_load",
+                        schema=schema,
+                        engine=engine,
+                        shards=shards,
+                        load_method=load_method,
+                        chunk_size=chunk_size,
+                    )
+                logging.info(f"Tabla: {table_name}_stg_load cargada exitosamente")
+
+            with conn.begin():
+                if sharded:
+                    conn.execute(
+                        f"""
+                        DELETE FROM {schema}.{table_name}_stg;
+                        INSERT INTO {schema}.{table_name}_stg (Moneda, Base, Precio, created_at)
+                        SELECT Moneda, Base, Precio, created_at FROM {schema}.{table_name}_stg_load;
+                        """
+                    )
+                    logging.info(f"Tabla: {table_name}_stg actualizada exitosamente")
+                else:
+                    with measure_stage(metrics, "load_stg", rows=len(df)):
+                        conn.execute(f"TRUNCATE TABLE {table_name}_stg")
+
+                        load_df_to_stg(
+                            df=df,
+                            table_name=f"{table_name}_stg",
+                            schema=schema,
+                            conn=conn,
+                            load_method=load_method,
+                            chunk_size=chunk_size,
+                        )
+                    logging.info(f"Tabla: {table_name}_stg actualizada exitosamente")
+
+                #  Marcas de agua y huellas se leen en la misma transacción del MERGE
+                time_range = None
+                df_merge = filter_compacted_rows(
+                    df, read_compacted_until(conn, table_name, schema)
+                )
+                if incremental:
+                    logging.warning(f"Filtrando filas con la marca de agua de {table_name}")
+                    df_merge = filter_new_rows(
+                        df_merge, read_watermarks(conn, table_name, schema)
+                    )
+                    logging.info(f"Filas nuevas a aplicar: {len(df_merge)}")
+                if change_detection:
+                    logging.warning(f"Filtrando filas sin cambios con las huellas de {table_name}")
+                    with measure_stage(metrics, "change_detection", rows=len(df_merge)) as span:
+                        df_merge, df_fingerprint = filter_changed_rows(
+                            df_merge, read_fingerprints(conn, table_name, schema)
+                        )
+                        span["changed"] = len(df_merge)
+                    logging.info(f"Filas nuevas o modificadas a aplicar: {len(df_merge)}")
+                if df_merge.empty:
+                    logging.info(f"No hay filas nuevas para {table_name}, se omite el MERGE")
+                    return df
+                if incremental:
+                    time_range = (
+                        df_merge["created_at"].min().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                        df_merge["created_at"].max().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                    )
 
-    #  Se conecta a la DB
-    try:
-        logging.warning(f"Creando motor de conexión en {dwh_host} username: {dwh_user}")
-        engine = sa.create_engine(connetion_string)
-        logging.info(
-            f"Motor de conexión creado exitosamente en {dwh_host} username: {dwh_user}"
-        )
-        return engine
-    except sa.exc.OperationalError as e:
-        logging.error(f"Error durante conexión {dwh_host}: {e}")
-        raise OperationalError from e
-    except sa.exc.RuntimeError as e:
+                merge_stg = f"{table_name}_stg"
+                if len(df_merge) < len(df):
+                    #  Staging conserva el snapshot completo, solo las filas filtradas entran al MERGE
+                    merge_stg = f"{table_name}_stg_merge"
+                    conn.execute(f"DELETE FROM {schema}.{merge_stg}")
+                    load_df_to_stg(
+                        df=df_merge,
+                        table_name=merge_stg,
+                        schema=schema,
+                        conn=conn,
+                        load_method=load_method,
+                        chunk_size=chunk_size,
+                    )
+
+                logging.warning(
+                    f"Actualizando tabla {table_name} a partir de {merge_stg}"
+                )
+                logging.info(
+                    f"Aplicando SCD I (Slowly Changing Dimension) sobre {table_name}"
+                )
+                merge_sql = build_merge_sql(
+                    table_name=table_name,
+                    schema=schema,
+                    stg_table=merge_stg,
+                    updated_at=updated_at,
+                    executed_at=executed_at,
+                    time_range=time_range,
+                )
+                watermark_sql = (
+                    build_watermark_sql(table_name, schema, merge_stg)
+                    if incremental
+                    else ""
+                )
+                rollup_sql = (
+                    build_rollup_sql(table_name, schema, merge_stg, time_range)
+                    if rollup
+                    else ""
+                )
+                with measure_stage(metrics, "merge", rows=len(df_merge)):
+                    if change_detection:
+                        #  Las huellas nuevas se confirman con el COMMIT del MERGE
+                        conn.execute(build_fingerprint_sql(table_name, schema, merge_stg))
+                        load_df_to_stg(
+                            df=df_fingerprint,
+                            table_name=f"{table_name}_fingerprint",
+                            schema=schema,
+                            conn=conn,
+                            #  One row per coin, small enough to skip the S3 round trip
+                            load_method="copy" if load_method == "copy" else "multi",
+                            chunk_size=chunk_size,
+                        )
+                    conn.execute(
+                        f"""
+                        BEGIN;
+                        {rollup_sql}
+                        {merge_sql}
+                        {watermark_sql}
+                        COMMIT;
+                        """
+                    )
+                logging.info(f"Tabla: {table_name} actualizada exitosamente")
+
+                return df
+
+    except Exception as e:
         logging.error(
-            f"Error se agotó el tiempo de intento de conexión {dwh_host}: {e}"
+            f"Error al intentar cargar el Data Frame en la tabla: {table_name} del esquema: {schema}",
+            e,
         )
-        raise RuntimeError from e
-    except Exception as e:
-        logging.error(f"Error inesperado al conectar {dwh_host}: {e}")
         raise Exception from e
 
 
-def create_tbl_from_df(df, table_name, schema, engine, executed_at, updated_at):
+def create_tbl_from_backfill(
+    df,
+    table_name,
+    schema,
+    engine,
+    load_method="multi",
+    chunk_size=50000,
+    update_watermark=False,
+    rollup=False,
+    metrics=None,
+):
     """
-    Esta función se usa para crear una tabla usando un DataFrame
-    ->df: El DataFrame a convertir en tabla dentro de Redshift
-    ->table_name: Nombre de la tabla
-    ->schema: Nombre del esquema donde se va crear la tabla
+    Esta función carga en una sola pasada los datos de muchos intervalos y aplica un solo MERGE
+    ->df: DataFrame con las columnas de la tabla histórica, ver collect_backfill_snapshots
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Nombre del esquema de la tabla
     ->engine: motor de conexión a la DB de Redshift
+    ->load_method: Método de carga masiva: multi, copy, s3 o auto (ver load_df_to_stg)
+    ->chunk_size: Número de filas por bloque durante la carga masiva
+    ->update_watermark: Si es True se avanza la marca de agua de {table_name}_watermark
+    ->rollup: Si es True se actualiza {table_name}_hist_avg en la misma transacción del MERGE
+    ->metrics: StageMetrics donde se registran las etapas de carga y MERGE (opcional)
+    *Los datos se cargan en la tabla de trabajo {table_name}_backfill, el MERGE toma updated_at y
+    executed_at de cada fila para conservar las fechas de su intervalo
+    *Las filas de días ya compactados se omiten, ver filter_compacted_rows
     return: Void
     """
+    backfill_table = f"{table_name}_backfill"
 
     try:
         logging.warning(f"Conectandose a la base de datos")
         with engine.connect() as conn, conn.begin():
             logging.info(f"Conectado exitosamente")
+            df = filter_compacted_rows(df, read_compacted_until(conn, table_name, schema))
+            if df.empty:
+                logging.info(f"No hay filas para el backfill de {table_name}")
+                return
+
             logging.warning(
-                f"Actualizando tabla {table_name}_stg a partir del información del Data Frame"
+                f"Cargando {len(df)} filas en {backfill_table} a partir del Data Frame"
             )
-            conn.execute(f"TRUNCATE TABLE {table_name}_stg")
+            with measure_stage(metrics, "load_stg", rows=len(df)):
+                conn.execute(
+                    f"""
+                    DROP TABLE IF EXISTS {schema}.{backfill_table};
+                    CREATE TABLE {schema}.{backfill_table} (LIKE {schema}.{table_name});
+                    """
+                )
+                load_df_to_stg(
+                    df=df[
+                        ["Moneda", "Base", "Precio", "created_at", "updated_at", "executed_at"]
+                    ],
+                    table_name=backfill_table,
+                    schema=schema,
+                    conn=conn,
+                    load_method=load_method,
+                    chunk_size=chunk_size,
+                )
+            logging.info(f"Tabla: {backfill_table} cargada exitosamente")
 
-            df.to_sql(
-                f"{table_name}_stg",
-                con=conn,
+            logging.warning(f"Actualizando tabla {table_name} a partir de {backfill_table}")
+            time_range = (
+                df["created_at"].min().strftime("%Y-%m-%d %H:%M:%S.%f"),
+                df["created_at"].max().strftime("%Y-%m-%d %H:%M:%S.%f"),
+            )
+            merge_sql = build_merge_sql(
+                table_name=table_name,
                 schema=schema,
-                if_exists="append",
-                method="multi",
-                index=False,
+                stg_table=backfill_table,
+                updated_at=f"{backfill_table}.updated_at",
+                executed_at=f"{backfill_table}.executed_at",
+                time_range=time_range,
+            )
+            watermark_sql = (
+                build_watermark_sql(table_name, schema, backfill_table)
+                if update_watermark
+                else ""
+            )
+            rollup_sql = (
+                build_rollup_sql(table_name, schema, backfill_table, time_range)
+                if rollup
+                else ""
             )
-            logging.info(f"Tabla: {table_name}_stg actualizada exitosamente")
+            with measure_stage(metrics, "merge", rows=len(df)):
+                conn.execute(
+                    f"""
+                    BEGIN;
+                    {rollup_sql}
+                    {merge_sql}
+                    {watermark_sql}
+                    DROP TABLE {schema}.{backfill_table};
+                    COMMIT;
+                    """
+                )
+            logging.info(f"Tabla: {table_name} actualizada exitosamente")
 
-            logging.warning(
-                f"Actualizando tabla {table_name} a partir de {table_name}_stg"
+    except Exception as e:
+        logging.error(
+            f"Error al intentar cargar el backfill en la tabla: {table_name} del esquema: {schema}",
+            e,
+        )
+        raise Exception from e
+
+
+def build_batch_frame(df, batch_id, data_interval_end):
+    """
+    Esta función agrega a un snapshot las columnas de un micro-batch de {table_name}_stg_batch
+    ->df: DataFrame construido con build_dataframe
+    ->batch_id: Identificador ordenable del batch
+    ->data_interval_end: Fin del intervalo del batch, de aquí salen updated_at y executed_at (UTC)
+    ->return: DataFrame con las columnas de {table_name}_stg_batch
+    """
+    end = pd.Timestamp(data_interval_end).tz_convert("UTC")
+    return df.assign(
+        updated_at=end.tz_localize(None), executed_at=end.date(), batch_id=batch_id
+    )[["Moneda", "Base", "Precio", "created_at", "updated_at", "executed_at", "batch_id"]]
+
+
+def append_batch_to_stg(
+    df,
+    table_name,
+    schema,
+    engine,
+    batch_id,
+    data_interval_end,
+    load_method="multi",
+    chunk_size=50000,
+    metrics=None,
+):
+    """
+    Esta función agrega un micro-batch a la tabla staging append-only {table_name}_stg_batch
+    ->df: DataFrame construido con build_dataframe
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->engine: motor de conexión a la DB de Redshift
+    ->batch_id: Identificador ordenable del batch (ej: data_interval_end | ts_nodash)
+    ->data_interval_end: Fin del intervalo del batch, de aquí salen updated_at y executed_at
+    ->load_method: Método de carga masiva: multi, copy, s3 o auto (ver load_df_to_stg)
+    ->chunk_size: Número de filas por bloque durante la carga masiva
+    ->metrics: StageMetrics donde se registra la etapa de carga (opcional)
+    *No se ejecuta DDL ni MERGE, solo se borra el mismo batch_id (reintentos) y se carga el DataFrame
+    ->return: Número de filas agregadas
+    """
+    if df is None or df.empty:
+        logging.info(f"No hay filas para el batch {batch_id}")
+        return 0
+    batch_table = f"{table_name}_stg_batch"
+    df = build_batch_frame(df, batch_id, data_interval_end)
+
+    try:
+        with engine.connect() as conn, conn.begin():
+            with measure_stage(metrics, "load_batch", rows=len(df)):
+                conn.execute(
+                    f"DELETE FROM {schema}.{batch_table} WHERE batch_id = '{batch_id}'"
+                )
+                load_df_to_stg(
+                    df=df,
+                    table_name=batch_table,
+                    schema=schema,
+                    conn=conn,
+                    load_method=load_method,
+                    chunk_size=chunk_size,
+                )
+            logging.info(f"Batch {batch_id} agregado a {batch_table}, filas: {len(df)}")
+            return len(df)
+
+    except Exception as e:
+        logging.error(
+            f"Error al intentar agregar el batch {batch_id} a la tabla: {batch_table} del esquema: {schema}",
+            e,
+        )
+        raise Exception from e
+
+
+def build_consolidate_batches_sql(table_name, schema, batch_ids):
+    """
+    Esta función construye las sentencias que consolidan micro-batches de {table_name}_stg_batch en
+    {table_name}_batch_merge con una fila por moneda, moneda base y created_at (la del batch más reciente),
+    las filas de días ya compactados se omiten (ver filter_compacted_rows)
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->batch_ids: Lista de batch_id a consolidar
+    ->return: String con las sentencias
+    """
+    batch_table = f"{table_name}_stg_batch"
+    merge_table = f"{table_name}_batch_merge"
+    batch_filter = ", ".join(f"'{batch_id}'" for batch_id in batch_ids)
+    return f"""
+                    DELETE FROM {schema}.{merge_table};
+                    INSERT INTO {schema}.{merge_table} (Moneda, Base, Precio, created_at, updated_at, executed_at)
+                    SELECT Moneda, Base, Precio, created_at, updated_at, executed_at
+                    FROM (
+                        SELECT Moneda, Base, Precio, created_at, updated_at, executed_at,
+                               ROW_NUMBER() OVER (PARTITION BY Moneda, Base, created_at ORDER BY batch_id DESC) AS rn
+                        FROM {schema}.{batch_table}
+                        WHERE batch_id IN ({batch_filter})
+                        AND created_at >= {build_compacted_until_sql(table_name, schema)}
+                    ) batches
+                    WHERE rn = 1;
+                    """
+
+
+def merge_stg_batches(
+    table_name,
+    schema,
+    engine,
+    min_batches=1,
+    update_watermark=False,
+    rollup=False,
+    metrics=None,
+):
+    """
+    Esta función aplica en un solo MERGE todos los micro-batches acumulados en {table_name}_stg_batch
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->engine: motor de conexión a la DB de Redshift
+    ->min_batches: Número mínimo de batches acumulados para ejecutar el MERGE, si hay menos no se hace nada
+    ->update_watermark: Si es True se avanza la marca de agua de {table_name}_watermark
+    ->rollup: Si es True se actualiza {table_name}_hist_avg en la misma transacción del MERGE
+    ->metrics: StageMetrics donde se registran las etapas de consolidación y MERGE (opcional)
+    *Los batches se consolidan en {table_name}_batch_merge (tabla de trabajo creada por el DAG) con una fila
+    por moneda, moneda base y created_at
+    (la del batch más reciente), igual que al aplicar un MERGE por batch, después se borran de staging
+    ->return: Número de batches aplicados
+    """
+    batch_table = f"{table_name}_stg_batch"
+    merge_table = f"{table_name}_batch_merge"
+    try:
+        with engine.connect() as conn, conn.begin():
+            batch_ids = [
+                row[0]
+                for row in conn.execute(
+                    f"SELECT DISTINCT batch_id FROM {schema}.{batch_table} ORDER BY batch_id"
+                )
+            ]
+            if len(batch_ids) < max(1, min_batches):
+                logging.info(
+                    f"Batches acumulados en {batch_table}: {len(batch_ids)}, mínimo para aplicar: {min_batches}"
+                )
+                return 0
+            batch_filter = ", ".join(f"'{batch_id}'" for batch_id in batch_ids)
+
+            logging.warning(f"Consolidando {len(batch_ids)} batches de {batch_table}")
+            with measure_stage(metrics, "consolidate", batches=len(batch_ids)) as span:
+                conn.execute(build_consolidate_batches_sql(table_name, schema, batch_ids))
+                rows, min_created_at, max_created_at = conn.execute(
+                    f"SELECT COUNT(*), MIN(created_at), MAX(created_at) FROM {schema}.{merge_table}"
+                ).fetchone()
+                span["rows"] = rows
+            logging.info(f"Filas consolidadas en {merge_table}: {rows}")
+
+            logging.warning(f"Actualizando tabla {table_name} a partir de {merge_table}")
+            time_range = None
+            if rows:
+                time_range = (
+                    min_created_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                    max_created_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                )
+            merge_sql = (
+                build_merge_sql(
+                    table_name=table_name,
+                    schema=schema,
+                    stg_table=merge_table,
+                    updated_at=f"{merge_table}.updated_at",
+                    executed_at=f"{merge_table}.executed_at",
+                    time_range=time_range,
+                )
+                if rows
+                else ""
+            )
+            watermark_sql = (
+                build_watermark_sql(table_name, schema, merge_table)
+                if update_watermark and rows
+                else ""
             )
+            rollup_sql = (
+                build_rollup_sql(table_name, schema, merge_table, time_range)
+                if rollup and rows
+                else ""
+            )
+            with measure_stage(metrics, "merge", rows=rows):
+                conn.execute(
+                    f"""
+                    BEGIN;
+                    {rollup_sql}
+                    {merge_sql}
+                    {watermark_sql}
+                    DELETE FROM {schema}.{batch_table} WHERE batch_id IN ({batch_filter});
+                    COMMIT;
+                    """
+                )
             logging.info(
-                f"Aplicando SCD I (Slowly Changing Dimension) sobre {table_name}"
+                f"Tabla: {table_name} actualizada exitosamente con {len(batch_ids)} batches"
             )
-            conn.execute(
-                f"""
-                BEGIN;
-                MERGE INTO {schema}.{table_name}
-                USING {schema}.{table_name}_stg
-                ON {table_name}.Moneda={table_name}_stg.Moneda AND {table_name}.created_at={table_name}_stg.created_at
-                WHEN MATCHED THEN
-                    UPDATE SET 
-                    Precio = {table_name}_stg.Precio,
-                    created_at = {table_name}_stg.created_at,
-                    updated_at = {updated_at},
-                    executed_at = {executed_at}
-                WHEN NOT MATCHED THEN
-                    INSERT (Moneda, Base, Precio, created_at, updated_at, executed_at)
-                    VALUES ({table_name}_stg.Moneda, {table_name}_stg.Base, {table_name}_stg.Precio, {table_name}_stg.created_at, {updated_at}, {executed_at});
-                COMMIT;
+            return len(batch_ids)
+
+    except Exception as e:
+        logging.error(
+            f"Error al intentar aplicar los batches de {batch_table} en la tabla: {table_name} del esquema: {schema}",
+            e,
+        )
+        raise Exception from e
+
+
+def build_price_history_sql(table_name, schema, since, until):
+    """
+    ->return: Consulta de los precios de la tabla histórica ejecutados dentro de un rango de fechas,
+              ver read_price_history
+    """
+    return f"""
+                SELECT moneda, base, precio, created_at, executed_at
+                FROM {schema}.{table_name}
+                WHERE executed_at > '{since}' AND executed_at <= '{until}'
                 """
+
+
+def read_price_history(table_name, schema, engine, since, until):
+    """
+    Esta función lee los precios de la tabla histórica ejecutados dentro de un rango de fechas
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de la tabla
+    ->engine: motor de conexión a la DB de Redshift
+    ->since: Fecha de ejecución inicial, no incluida (ej: 2023-12-01)
+    ->until: Fecha de ejecución final, incluida
+    ->return: DataFrame con las columnas moneda, base, precio, created_at y executed_at
+    """
+    try:
+        logging.warning(f"Leyendo precios de {table_name} ejecutados entre {since} y {until}")
+        with engine.connect() as conn:
+            df = pd.read_sql_query(
+                build_price_history_sql(table_name, schema, since, until),
+                conn,
+                dtype=STG_DTYPES,
             )
-            logging.info(f"Tabla: {table_name} actualizada exitosamente")
+        logging.info(f"Precios leídos de {table_name}: {len(df)}")
+        return df
+    except Exception as e:
+        logging.error(
+            f"Error al intentar leer los precios de la tabla: {table_name} del esquema: {schema}",
+            e,
+        )
+        raise Exception from e
 
+
+def write_analytics(df, table_name, schema, engine, load_method="multi"):
+    """
+    Esta función guarda las métricas móviles en {table_name}_analytics reemplazando las fechas calculadas
+    ->df: DataFrame con las métricas, ver utils.analytics.compute_rolling_metrics
+    ->table_name: Nombre de la tabla histórica
+    ->schema: Esquema de las tablas
+    ->engine: motor de conexión a la DB de Redshift
+    ->load_method: Método de carga masiva: multi, copy, s3 o auto (ver load_df_to_stg)
+    return: Void
+    """
+    analytics_table = f"{table_name}_analytics"
+    dates = ", ".join(f"'{fecha}'" for fecha in df["fecha"].dt.date.unique())
+    try:
+        with engine.connect() as conn, conn.begin():
+            conn.execute(f"DELETE FROM {schema}.{analytics_table} WHERE fecha IN ({dates})")
+            load_df_to_stg(
+                df=df.assign(fecha=df["fecha"].dt.date),
+                table_name=analytics_table,
+                schema=schema,
+                conn=conn,
+                load_method=load_method,
+            )
+        logging.info(f"Tabla: {analytics_table} actualizada exitosamente, filas: {len(df)}")
     except Exception as e:
         logging.error(
-            f"Error al intentar cargar el Data Frame en la tabla: {table_name} del esquema: {schema}",
+            f"Error al intentar guardar las métricas en la tabla: {analytics_table} del esquema: {schema}",
             e,
         )
         raise Exception from e
 
 
-def build_df_summary(table_name, schema, updated_at, engine, min_price, max_price):
+def build_hist_avg_sql(
+    table_name, schema, updated_at, base_currency=None, use_rollup=False, use_tiers=False
+):
+    """
+    Esta función construye la consulta del precio promedio histórico por moneda sin considerar la última carga
+    ->table_name: Nombre de la tabla crypto (y staging al agregar _stg)
+    ->schema: Nombre del esquema de las tablas
+    ->updated_at: Fecha de la ultima actualización de la información cargada para cryptodivisas en Redshift
+    ->base_currency: Moneda base ej: USD (opcional)
+    ->use_rollup: Si es True el promedio se lee de {table_name}_hist_avg en lugar de recorrer toda la
+                  tabla histórica
+    ->use_tiers: Si es True (y use_rollup es False) la suma y el conteo se leen del nivel más agregado
+                 de cada periodo (ver build_tiers_history_sql), así el promedio incluye las filas
+                 podadas de la tabla histórica
+    *En todos los casos se excluyen las filas con updated_at del día de la última carga, al usar
+    use_rollup o use_tiers se restan su suma y conteo
+    ->return: String con la consulta de las columnas moneda, base y precio
+    """
+    if not use_rollup and not use_tiers:
+        base_filter = f"AND base = '{base_currency}'" if base_currency else ""
+        return f"SELECT moneda, base, AVG(precio) AS precio FROM {schema}.{table_name} WHERE updated_at::date != {updated_at} {base_filter} GROUP BY moneda,base"
+
+    source = f"{schema}.{table_name}_hist_avg"
+    if not use_rollup:
+        source = f"""(
+            SELECT moneda, base, SUM(suma_precio) AS suma_precio, SUM(conteo) AS conteo
+            FROM ({build_tiers_history_sql(table_name, schema)}) niveles
+            GROUP BY moneda, base
+        )"""
+    base_filter = f"AND r.base = '{base_currency}'" if base_currency else ""
+    return f"""
+        SELECT r.moneda, r.base,
+               (r.suma_precio - COALESCE(s.suma_precio, 0)) / (r.conteo - COALESCE(s.conteo, 0)) AS precio
+        FROM {source} r
+        LEFT JOIN (
+            SELECT moneda, base, SUM(precio) AS suma_precio, COUNT(*) AS conteo
+            FROM {schema}.{table_name} WHERE updated_at::date = {updated_at} GROUP BY moneda, base
+        ) s ON r.moneda = s.moneda AND r.base = s.base
+        WHERE r.conteo - COALESCE(s.conteo, 0) > 0 {base_filter}
+    """
+
+
+def summarize_stg_frame(df_stg, base_currency=None):
+    """
+    Esta función calcula el precio promedio por moneda de un DataFrame de staging, igual que la consulta
+    a {table_name}_stg de build_df_summary
+    ->df_stg: DataFrame con las columnas Moneda, Base y Precio
+    ->base_currency: Moneda base ej: USD (opcional)
+    ->return: DataFrame con las columnas moneda, base y precio
+    """
+    if base_currency:
+        df_stg = df_stg[df_stg["Base"] == base_currency]
+    return (
+        df_stg.groupby(["Moneda", "Base"], observed=True)["Precio"]
+        .mean()
+        .reset_index()
+        .rename(columns={"Moneda": "moneda", "Base": "base", "Precio": "precio"})
+        .astype(STG_DTYPES)
+    )
+
+
+def filter_price_band(df, min_price, max_price):
+    """
+    ->return: Filas de df con la columna precio entre min_price y max_price (incluidos)
+    """
+    return df[(df["precio"] >= min_price) & (df["precio"] <= max_price)]
+
+
+def build_df_summary(
+    table_name,
+    schema,
+    updated_at,
+    engine,
+    min_price,
+    max_price,
+    base_currency=None,
+    use_rollup=False,
+    df_stg=None,
+    use_tiers=False,
+):
     """
     Esta función construye dos DataFrame usando las tablas del DWH histórica sin considerar los registros más actuales
     ->table_name: Nombre de la tabla crypto o histórica (y staging al agregar _stg), esta tabla contiene tanto registros actuales como históricos
@@ -188,6 +1990,11 @@ def build_df_summary(table_name, schema, updated_at, engine, min_price, max_pric
     ->updated_at: Fecha de la ultima actualización de la información cargada para cryptodivisas en Redshift
     ->min_price: Precio mínimo deseado en el resumen de las cryptomonedas
     ->max_price: Precio máximo deseado en el resumen de las cryptomonedas
+    ->base_currency: Moneda base del resumen ej: USD (opcional), si no se da se usan todas las monedas base
+    ->use_rollup: Si es True el promedio histórico se lee de la tabla {table_name}_hist_avg
+    ->use_tiers: Si es True el promedio histórico se lee de los niveles diario y mensual (ver build_hist_avg_sql)
+    ->df_stg: DataFrame cargado en staging por la tarea de carga (opcional), si se da solo se consulta
+              el histórico en el DWH
     ->return: Dos DataFrame uno para staging y otro de crypto histórico
     """
     try:
@@ -195,29 +2002,30 @@ def build_df_summary(table_name, schema, updated_at, engine, min_price, max_pric
         with engine.connect() as conn, conn.begin():
             logging.info(f"Conectado exitosamente")
 
-            crypto_stg = f"SELECT moneda, base, AVG(precio) AS precio FROM {schema}.{table_name}_stg GROUP BY moneda,base"
-            crypto_hist = f"SELECT moneda, base, AVG(precio) AS precio FROM {schema}.{table_name} WHERE updated_at::date != {updated_at} GROUP BY moneda,base"
+            base_filter = f"AND base = '{base_currency}'" if base_currency else ""
+            crypto_stg = f"SELECT moneda, base, AVG(precio) AS precio FROM {schema}.{table_name}_stg WHERE 1=1 {base_filter} GROUP BY moneda,base"
+            crypto_hist = build_hist_avg_sql(
+                table_name, schema, updated_at, base_currency, use_rollup, use_tiers
+            )
 
-            logging.warning(f"Extrayendo datos de DWH para {table_name}_stg")
-            df_crypto_stg = pd.read_sql_query(crypto_stg, conn)
+            if df_stg is not None:
+                logging.warning(f"Usando el DataFrame entregado por la carga de {table_name}_stg")
+                df_crypto_stg = summarize_stg_frame(df_stg, base_currency)
+            else:
+                logging.warning(f"Extrayendo datos de DWH para {table_name}_stg")
+                df_crypto_stg = pd.read_sql_query(crypto_stg, conn, dtype=STG_DTYPES)
             logging.warning(
                 f"Aplicando filtros de precios para {table_name}_stg, precio máximo del resumen: {max_price}, precio mínimo del resumen: {min_price}"
             )
-            df_crypto_stg = df_crypto_stg[
-                (df_crypto_stg["precio"] >= min_price)
-                & (df_crypto_stg["precio"] <= max_price)
-            ]
+            df_crypto_stg = filter_price_band(df_crypto_stg, min_price, max_price)
             logging.info(f"Datos extraídos con éxito para {table_name}_stg")
             print(df_crypto_stg)
             logging.warning(f"Extrayendo datos de DWH para {table_name}")
-            df_crypto_hist = pd.read_sql_query(crypto_hist, conn)
+            df_crypto_hist = pd.read_sql_query(crypto_hist, conn, dtype=STG_DTYPES)
             logging.warning(
                 f"Aplicando filtros de precios para {table_name}, precio máximo del resumen: {max_price}, precio mínimo del resumen: {min_price}"
             )
-            df_crypto_hist = df_crypto_hist[
-                (df_crypto_hist["precio"] >= min_price)
-                & (df_crypto_hist["precio"] <= max_price)
-            ]
+            df_crypto_hist = filter_price_band(df_crypto_hist, min_price, max_price)
             logging.info(f"Datos extraídos con éxito para {table_name}")
 
             return df_crypto_stg, df_crypto_hist
@@ -230,18 +2038,185 @@ def build_df_summary(table_name, schema, updated_at, engine, min_price, max_pric
         raise Exception from e
 
 
-def calculate_summary_crypto(df_crypto_stg, df_crypto_hist):
+def build_summary_sql(
+    table_name,
+    schema,
+    updated_at,
+    min_price,
+    max_price,
+    base_currency=None,
+    top_k=5,
+    use_rollup=False,
+    use_tiers=False,
+):
+    """
+    Esta función construye una sola consulta que calcula el resumen completo dentro del DWH
+    ->table_name: Nombre de la tabla crypto (y staging al agregar _stg)
+    ->schema: Nombre del esquema de donde se van a extraer los datos en Redshift
+    ->updated_at: Fecha de la ultima actualización de la información cargada para cryptodivisas en Redshift
+    ->min_price: Precio mínimo deseado en el resumen de las cryptomonedas
+    ->max_price: Precio máximo deseado en el resumen de las cryptomonedas
+    ->base_currency: Moneda base del resumen ej: USD (opcional)
+    ->top_k: Número de cryptomonedas en cada lista del resumen
+    ->use_rollup: Si es True el promedio histórico se lee de la tabla {table_name}_hist_avg
+    ->use_tiers: Si es True el promedio histórico se lee de los niveles diario y mensual (ver build_hist_avg_sql)
+    ->return: String con la consulta, devuelve una fila por posición de cada lista (columna resumen)
+    """
+    base_filter = f"AND base = '{base_currency}'" if base_currency else ""
+    return f"""
+        WITH stg AS (
+            SELECT moneda, base, AVG(precio) AS precio
+            FROM {schema}.{table_name}_stg
+            WHERE 1=1 {base_filter}
+            GROUP BY moneda, base
+            HAVING AVG(precio) BETWEEN {min_price} AND {max_price}
+        ),
+        hist AS (
+            SELECT moneda, base, precio
+            FROM ({build_hist_avg_sql(table_name, schema, updated_at, base_currency, use_rollup, use_tiers)}) hist_avg
+            WHERE precio BETWEEN {min_price} AND {max_price}
+        ),
+        cambio AS (
+            SELECT
+                stg.moneda,
+                stg.precio AS precio_stg,
+                hist.precio AS precio_hist,
+                stg.base AS base_stg,
+                hist.base AS base_hist,
+                (stg.precio - hist.precio) / NULLIF(hist.precio, 0) * 100 AS porcentaje_cambio
+            FROM stg
+            JOIN hist ON stg.moneda = hist.moneda AND stg.base = hist.base
+        ),
+        ranking AS (
+            SELECT
+                cambio.*,
+                ROW_NUMBER() OVER (ORDER BY porcentaje_cambio DESC NULLS LAST) AS rank_max,
+                ROW_NUMBER() OVER (ORDER BY porcentaje_cambio ASC NULLS LAST) AS rank_min
+            FROM cambio
+        ),
+        valor AS (
+            SELECT moneda, precio, base, ROW_NUMBER() OVER (ORDER BY precio DESC) AS rank_valor
+            FROM stg
+        )
+        SELECT 'max_increment' AS resumen, rank_max AS posicion, moneda, precio_stg, precio_hist,
+               base_stg, base_hist, porcentaje_cambio, CAST(NULL AS FLOAT) AS precio, CAST(NULL AS VARCHAR(256)) AS base
+        FROM ranking WHERE rank_max <= {top_k}
+        UNION ALL
+        SELECT 'min_increment', rank_min, moneda, precio_stg, precio_hist,
+               base_stg, base_hist, porcentaje_cambio, NULL, NULL
+        FROM ranking WHERE rank_min <= {top_k}
+        UNION ALL
+        SELECT 'max_value', rank_valor, moneda, NULL, NULL,
+               NULL, NULL, NULL, precio, base
+        FROM valor WHERE rank_valor <= {top_k}
+        ORDER BY resumen, posicion
+    """
+
+
+def split_summary(df_summary):
+    """
+    Esta función separa el resultado de build_summary_sql en las tres listas del resumen
+    ->df_summary: DataFrame con la columna resumen (max_increment, min_increment o max_value)
+    ->return: Los mismos tres DataFrame que calculate_summary_crypto
+    """
+    increment_columns = [
+        "moneda",
+        "precio_stg",
+        "precio_hist",
+        "base_stg",
+        "base_hist",
+        "porcentaje_cambio",
+    ]
+    summary = {
+        name: group.reset_index(drop=True)
+        for name, group in df_summary.groupby("resumen", sort=False)
+    }
+    empty = df_summary.iloc[0:0].reset_index(drop=True)
+    df_crypto_max_increment = summary.get("max_increment", empty)[increment_columns]
+    df_crypto_min_increment = summary.get("min_increment", empty)[increment_columns]
+    df_crypto_max_value = summary.get("max_value", empty)[["moneda", "precio", "base"]]
+    return df_crypto_max_increment, df_crypto_min_increment, df_crypto_max_value
+
+
+def build_summary_pushdown(
+    table_name,
+    schema,
+    updated_at,
+    engine,
+    min_price,
+    max_price,
+    base_currency=None,
+    top_k=5,
+    use_rollup=False,
+    use_tiers=False,
+):
+    """
+    Esta función calcula el resumen de las cryptomonedas con una sola consulta en el DWH, el filtro de precios,
+    la unión con el histórico, el porcentaje de cambio y la selección de las listas se hacen en Redshift
+    ->table_name: Nombre de la tabla crypto (y staging al agregar _stg)
+    ->schema: Nombre del esquema de donde se van a extraer los datos en Redshift
+    ->updated_at: Fecha de la ultima actualización de la información cargada para cryptodivisas en Redshift
+    ->engine: motor de conexión a la DB de Redshift
+    ->min_price: Precio mínimo deseado en el resumen de las cryptomonedas
+    ->max_price: Precio máximo deseado en el resumen de las cryptomonedas
+    ->base_currency: Moneda base del resumen ej: USD (opcional)
+    ->top_k: Número de cryptomonedas en cada lista del resumen
+    ->use_rollup: Si es True el promedio histórico se lee de la tabla {table_name}_hist_avg
+    ->use_tiers: Si es True el promedio histórico se lee de los niveles diario y mensual (ver build_hist_avg_sql)
+    ->return: Los mismos tres DataFrame que calculate_summary_crypto
+    """
+    try:
+        logging.warning(f"Conectandose a la base de datos")
+        with engine.connect() as conn, conn.begin():
+            logging.info(f"Conectado exitosamente")
+            logging.warning(
+                f"Calculando resumen en DWH para {table_name} y {table_name}_stg, precio máximo del resumen: {max_price}, precio mínimo del resumen: {min_price}"
+            )
+            df_summary = pd.read_sql_query(
+                build_summary_sql(
+                    table_name=table_name,
+                    schema=schema,
+                    updated_at=updated_at,
+                    min_price=min_price,
+                    max_price=max_price,
+                    base_currency=base_currency,
+                    top_k=top_k,
+                    use_rollup=use_rollup,
+                    use_tiers=use_tiers,
+                ),
+                conn,
+                dtype=SUMMARY_DTYPES,
+            )
+            logging.info(f"Resumen calculado con éxito, filas obtenidas: {len(df_summary)}")
+
+        return split_summary(df_summary)
+
+    except Exception as e:
+        logging.error(
+            f"Error al intentar calcular el resumen de las tablas {table_name} y {table_name}_stg en el DWH",
+            e,
+        )
+        raise Exception from e
+
+
+def calculate_summary_crypto(df_crypto_stg, df_crypto_hist, top_k=5):
     """
     Esta función se utiliza para calcular el resumen de los datos de las cryptomonedas al día
     ->df_crypto_stg: DataFrame construido a partir de la tabla de datos de crypto staging
     ->df_crypto_hist: DataFrame construido a partir de la tabla con información histórica de la tabla crypto
+    ->top_k: Número de cryptomonedas en cada lista del resumen
+    *Las listas se obtienen con selección parcial (nlargest/nsmallest) sin ordenar todo el DataFrame
     return: Dataframe:
         ->df_crypto_max_increment: Máximo porcentaje de incremento en precio respecto al precio promedio histórico
         ->df_crypto_min_increment: Mñinimo porcentaje de incremento en precio respecto al precio promedio histórico
-        ->df_crypto_max_value: 5 Cryptomonedas con el precio más alto
+        ->df_crypto_max_value: top_k Cryptomonedas con el precio más alto
     """
     try:
         logging.warning(f"Uniendo los datos del Dataframe Staging con el histórico")
+        #  Same categories on both sides so the merge and the base comparison use the codes
+        df_crypto_stg, df_crypto_hist = unify_categories(
+            [df_crypto_stg, df_crypto_hist], ["moneda", "base"]
+        )
         merged_df = pd.merge(
             df_crypto_stg, df_crypto_hist, on="moneda", suffixes=("_stg", "_hist")
         )
@@ -254,21 +2229,23 @@ def calculate_summary_crypto(df_crypto_stg, df_crypto_hist):
             (merged_df["precio_stg"] - merged_df["precio_hist"])
             / merged_df["precio_hist"]
         ) * 100
+        #  Solo se comparan precios expresados en la misma moneda base
+        merged_df = merged_df[merged_df["base_stg"] == merged_df["base_hist"]]
         logging.info(f"Porcentaje de cambio calculado exitósamente")
 
         logging.warning(
-            f"Guardando DataFrame de las 5 cryptomonedas con mayor porcentaje de incremento en precio"
+            f"Guardando DataFrame de las {top_k} cryptomonedas con mayor porcentaje de incremento en precio"
         )
-        df_crypto_max_increment = merged_df.sort_values(
-            by=["porcentaje_cambio"], ascending=False
-        ).head(5)
+        df_crypto_max_increment = merged_df.nlargest(
+            top_k, "porcentaje_cambio"
+        ).reset_index(drop=True)
         logging.warning(
-            f"Guardando DataFrame de las 5 cryptomonedas con menor porcentaje de incremento en precio"
+            f"Guardando DataFrame de las {top_k} cryptomonedas con menor porcentaje de incremento en precio"
         )
 
-        df_crypto_min_increment = merged_df.sort_values(
-            by=["porcentaje_cambio"], ascending=True
-        ).head(5)
+        df_crypto_min_increment = merged_df.nsmallest(
+            top_k, "porcentaje_cambio"
+        ).reset_index(drop=True)
         logging.info(f"Porcentajes calculados exitósamente")
         print(
             df_crypto_max_increment[
@@ -281,10 +2258,12 @@ def calculate_summary_crypto(df_crypto_stg, df_crypto_hist):
             ]
         )
 
-        logging.warning(f"Guardando DataFrame de las 5 cryptomonedas con mayor precio")
-        df_crypto_max_value = df_crypto_stg.sort_values(
-            by=["precio"], ascending=False
-        ).head(5)
+        logging.warning(
+            f"Guardando DataFrame de las {top_k} cryptomonedas con mayor precio"
+        )
+        df_crypto_max_value = df_crypto_stg.nlargest(top_k, "precio").reset_index(
+            drop=True
+        )
         logging.info(f"Valores guardados exitósamente")
         print(df_crypto_max_value[["moneda", "precio", "base"]])
 
@@ -297,15 +2276,143 @@ def calculate_summary_crypto(df_crypto_stg, df_crypto_hist):
         raise Exception from e
 
 
+def build_subscribers(subscribers, email_receiver, min_price, max_price, top_k=5):
+    """
+    Esta función construye la tabla de suscriptores de la alerta
+    ->subscribers: Lista de diccionarios o string JSON, cada suscriptor tiene email y opcionalmente
+                   min_price, max_price y top_k ej: [{"email": "a@b.com", "max_price": 100, "top_k": 3}]
+    ->email_receiver: Destinatario usado cuando no hay suscriptores
+    ->min_price: Precio mínimo por defecto
+    ->max_price: Precio máximo por defecto
+    ->top_k: Número de cryptomonedas por defecto en cada lista
+    ->return: DataFrame con las columnas email, min_price, max_price y top_k
+    """
+    if isinstance(subscribers, str):
+        subscribers = json.loads(subscribers or "[]")
+    if not subscribers:
+        subscribers = [{"email": email_receiver}]
+    df_subscribers = pd.DataFrame(subscribers)
+    defaults = {"min_price": min_price, "max_price": max_price, "top_k": top_k}
+    for column, value in defaults.items():
+        if column not in df_subscribers:
+            df_subscribers[column] = value
+        df_subscribers[column] = df_subscribers[column].fillna(value)
+    return df_subscribers.astype(
+        {"min_price": "float64", "max_price": "float64", "top_k": "int64"}
+    )[["email", "min_price", "max_price", "top_k"]]
+
+
+def select_top_k(values, masks, top_k, ascending=False):
+    """
+    Esta función selecciona las top_k filas de cada suscriptor con un solo ordenamiento
+    ->values: Arreglo con el valor a ordenar de cada fila
+    ->masks: Matriz booleana suscriptores x filas, True si la fila está en la banda del suscriptor
+    ->top_k: Arreglo con el número de filas de cada suscriptor
+    ->ascending: Si es True se seleccionan los valores más pequeños
+    *El orden es estable, en empates se conserva la primera fila igual que nlargest/nsmallest
+    ->return: Tupla (suscriptor, fila) ordenada por suscriptor y posición en la lista
+    """
+    order = np.argsort(values if ascending else -values, kind="stable")
+    valid = masks[:, order] & ~np.isnan(values[order])
+    rank = np.cumsum(valid, axis=1)
+    subscriber, position = np.nonzero(valid & (rank <= top_k[:, None]))
+    return subscriber, order[position]
+
+
+def calculate_summary_subscribers(df_crypto_stg, df_crypto_hist, df_subscribers):
+    """
+    Esta función calcula el resumen de todos los suscriptores en una sola pasada, la unión con el histórico
+    y el porcentaje de cambio se calculan una vez y cada suscriptor se resuelve con máscaras de su banda
+    ->df_crypto_stg: DataFrame de staging filtrado con la banda más amplia de todos los suscriptores
+    ->df_crypto_hist: DataFrame histórico filtrado con la banda más amplia de todos los suscriptores
+    ->df_subscribers: DataFrame de suscriptores (ver build_subscribers)
+    ->return: Lista con una tupla por suscriptor con los mismos tres DataFrame que calculate_summary_crypto
+    """
+    try:
+        logging.warning(f"Calculando el resumen de {len(df_subscribers)} suscriptores")
+        df_crypto_stg, df_crypto_hist = unify_categories(
+            [df_crypto_stg, df_crypto_hist], ["moneda", "base"]
+        )
+        merged_df = pd.merge(
+            df_crypto_stg, df_crypto_hist, on="moneda", suffixes=("_stg", "_hist")
+        )
+        merged_df = merged_df[merged_df["base_stg"] == merged_df["base_hist"]]
+        merged_df = merged_df.reset_index(drop=True)
+        merged_df["porcentaje_cambio"] = (
+            (merged_df["precio_stg"] - merged_df["precio_hist"])
+            / merged_df["precio_hist"]
+        ) * 100
+
+        min_price = df_subscribers["min_price"].to_numpy()[:, None]
+        max_price = df_subscribers["max_price"].to_numpy()[:, None]
+        top_k = df_subscribers["top_k"].to_numpy()
+
+        #  Matrices suscriptores x filas con la banda de precios de cada suscriptor
+        def in_band(prices):
+            prices = prices.to_numpy(dtype=float)[None, :]
+            return (prices >= min_price) & (prices <= max_price)
+
+        increment_mask = in_band(merged_df["precio_stg"]) & in_band(
+            merged_df["precio_hist"]
+        )
+        value_mask = in_band(df_crypto_stg["precio"])
+        cambio = merged_df["porcentaje_cambio"].to_numpy(dtype=float)
+        precio = df_crypto_stg["precio"].to_numpy(dtype=float)
+
+        def split(source, selection):
+            subscriber, rows = selection
+            df = source.iloc[rows].reset_index(drop=True)
+            bounds = np.searchsorted(subscriber, np.arange(len(df_subscribers) + 1))
+            return [
+                df.iloc[start:end].reset_index(drop=True)
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ]
+
+        max_increment = split(
+            merged_df, select_top_k(cambio, increment_mask, top_k)
+        )
+        min_increment = split(
+            merged_df, select_top_k(cambio, increment_mask, top_k, ascending=True)
+        )
+        max_value = split(
+            df_crypto_stg.reset_index(drop=True),
+            select_top_k(precio, value_mask, top_k),
+        )
+        logging.info(f"Resumen de los suscriptores calculado exitósamente")
+        return list(zip(max_increment, min_increment, max_value))
+
+    except Exception as e:
+        logging.error(
+            f"Error al intentar construir el resumen de los suscriptores a partir de los DataFrame",
+            e,
+        )
+        raise Exception from e
+
+
+def render_lines(*parts):
+    """
+    Esta función construye las líneas de una lista del resumen concatenando columnas completas
+    ->parts: Arreglos de strings del mismo largo o strings fijos, en el orden en que se concatenan
+    ->return: String con una línea por fila terminada en salto de línea
+    """
+    if not len(parts[0]):
+        return ""
+    return "".join(functools.reduce(np.char.add, parts + ("\n",)).tolist())
+
+
 def build_string_summary(
-    df_crypto_max_increment, df_crypto_min_increment, df_crypto_max_value
+    df_crypto_max_increment,
+    df_crypto_min_increment,
+    df_crypto_max_value,
+    df_anomalies=None,
 ):
     """
     Esta función construye el mensaje principal que es enviado por correo a los usuarios por SMTP
     ->df_crypto_max_increment: Máximo porcentaje de incremento en precio respecto al precio promedio histórico
     ->df_crypto_min_increment: Mñinimo porcentaje de incremento en precio respecto al precio promedio histórico
-    ->df_crypto_max_value: 5 Cryptomonedas con el precio más alto
-    ->return: String con un resumen de los datos de las 5 cryptomonedas que tuvieron un porcentaje de aumento
+    ->df_crypto_max_value: Cryptomonedas con el precio más alto
+    ->df_anomalies: Movimientos anormales del snapshot (opcional), ver utils.anomaly.AnomalyDetector
+    ->return: String con un resumen de los datos de las cryptomonedas que tuvieron un porcentaje de aumento
             en precio mayor respecto al promedio histórico y aquellos que tienen menor aumento así como las monedas
             con mayor valor y menor valor al día
     """
@@ -316,31 +2423,97 @@ def build_string_summary(
             "Hola! Aqui tienes el resumen del dia de las cryptomonedas.\n\n"
         )
 
-        # Crear strings informativos
+        # Crear strings informativos, cada lista se formatea por columnas completas
+        def rank(df):
+            return np.arange(1, len(df) + 1).astype(str)
+
+        def text(df, column):
+            return df[column].to_numpy().astype(str)
+
+        def number(df, column, decimals):
+            return np.char.mod(f"%.{decimals}f", df[column].to_numpy(dtype=float))
+
+        df = df_crypto_max_increment
         info_max_increment = "Las Cryptomonedas que tuvieron mayor incremento son:\n\n"
-        for idx, row in df_crypto_max_increment.iterrows():
-            info_max_increment += f"{idx + 1}.  {row['moneda']} tuvo un aumento del {row['porcentaje_cambio']:.2f}% con un precio {row['precio_hist']:.8f} {row['base_hist']} -> {row['precio_stg']:.8f} {row['base_stg']}\n"
+        info_max_increment += render_lines(
+            rank(df),
+            ".  ",
+            text(df, "moneda"),
+            " tuvo un aumento del ",
+            number(df, "porcentaje_cambio", 2),
+            "% con un precio ",
+            number(df, "precio_hist", 8),
+            " ",
+            text(df, "base_hist"),
+            " -> ",
+            number(df, "precio_stg", 8),
+            " ",
+            text(df, "base_stg"),
+        )
 
+        df = df_crypto_min_increment
         info_min_increment = (
             "\nLas Cryptomonedas que tuvieron menor incremento son:\n\n"
         )
-        for idx, row in df_crypto_min_increment.iterrows():
-            info_min_increment += f"{idx + 1}.  {row['moneda']} tuvo una disminucion del {row['porcentaje_cambio']:.2f}% con un precio {row['precio_hist']:.8f} {row['base_hist']} -> {row['precio_stg']:.8f} {row['base_stg']}\n"
+        info_min_increment += render_lines(
+            rank(df),
+            ".  ",
+            text(df, "moneda"),
+            " tuvo una disminucion del ",
+            number(df, "porcentaje_cambio", 2),
+            "% con un precio ",
+            number(df, "precio_hist", 8),
+            " ",
+            text(df, "base_hist"),
+            " -> ",
+            number(df, "precio_stg", 8),
+            " ",
+            text(df, "base_stg"),
+        )
 
+        df = df_crypto_max_value
         info_max_value = "\nLas Cryptomonedas con los precios mas altos son:\n\n"
-        for idx, row in df_crypto_max_value.iterrows():
-            info_max_value += f"{idx + 1}.  {row['moneda']} con un precio {row['precio']:.2f} {row['base']}\n"
+        info_max_value += render_lines(
+            rank(df),
+            ".  ",
+            text(df, "moneda"),
+            " con un precio ",
+            number(df, "precio", 2),
+            " ",
+            text(df, "base"),
+        )
+
+        info_anomalies = ""
+        if df_anomalies is not None and len(df_anomalies):
+            df = df_anomalies
+            info_anomalies = "\nLas Cryptomonedas con movimientos anormales son:\n\n"
+            info_anomalies += render_lines(
+                rank(df),
+                ".  ",
+                text(df, "moneda"),
+                " tuvo un cambio del ",
+                number(df, "retorno", 2),
+                "% (z-score ",
+                number(df, "z", 2),
+                ") con un precio ",
+                number(df, "precio", 8),
+                " ",
+                text(df, "base"),
+            )
 
         # Mensaje persuasivo para el cliente
         goodbye_message = "\nEste es un resumen del dia de las cryptomonedas.\n\nTe invitamos a revisar tu wallet y considerar estas oportunidades de inversion para maximizar tus ganancias.\nNo pierdas la oportunidad de invertir en estas cryptomonedas en alza!"
 
         # Unir todo en un solo string
-        resume_message = (
-            introduction_message
-            + info_max_increment
-            + info_min_increment
-            + info_max_value
-            + goodbye_message
+        resume_message = "".join(
+            [
+                introduction_message,
+                info_max_increment,
+                info_min_increment,
+                info_max_value,
+                info_anomalies,
+                goodbye_message,
+            ]
         )
         logging.info(f"Mensaje de resumen diario construido exitósamente")
 
@@ -353,6 +2526,30 @@ def build_string_summary(
         raise Exception from e
 
 
+def connect_smtp(email_sender, email_smtp_secret):
+    """
+    Esta función abre una conexión autenticada al servicio SMTP
+    ->email_sender: Email que envía los mensajes
+    ->email_smtp_secret: Contraseña del servicio SMTP
+    ->return: smtplib.SMTP conectado
+    """
+    logging.warning(f"Conectandose al servicio SMTP")
+    obj_smtp = smtplib.SMTP("smtp.gmail.com", 587)
+    obj_smtp.starttls()
+    obj_smtp.login(email_sender, email_smtp_secret)
+    logging.info(f"Conectando exitósamente al servicio SMTP usando {email_sender}")
+    return obj_smtp
+
+
+def build_alert_message(resume_message, dag_name, ds):
+    """
+    Esta función construye el mensaje de la alerta con su asunto
+    ->return: String con el mensaje
+    """
+    subject = "Subject: {} - {}\n\n".format(dag_name, ds)
+    return subject + "\n\n" + resume_message
+
+
 def send_email_alert(
     resume_message, email_sender, email_receiver, email_smtp_secret, dag_name, ds
 ):
@@ -367,15 +2564,11 @@ def send_email_alert(
     return: void
     """
     try:
-        logging.warning(f"Conectandose al servicio SMTP")
-        obj_smtp = smtplib.SMTP("smtp.gmail.com", 587)
-        obj_smtp.starttls()
-        obj_smtp.login(email_sender, email_smtp_secret)
-        logging.info(f"Conectando exitósamente al servicio SMTP usando {email_sender}")
+        obj_smtp = connect_smtp(email_sender, email_smtp_secret)
 
         logging.warning(f"Construyendo mensaje de alerta")
-        subject = "Subject: {} - {}\n\n".format(dag_name, ds)
-        message = subject + "\n\n" + resume_message
+        message = build_alert_message(resume_message, dag_name, ds)
+        subject = message.split("\n", 1)[0]
         logging.info(f"Mensaje contruido")
         print(message)
         logging.warning(
@@ -387,3 +2580,78 @@ def send_email_alert(
     except Exception as e:
         logging.error(f"Error al intentar enviar la alerta de correo electrónico", e)
         raise Exception from e
+
+
+def send_email_alerts(
+    messages, email_sender, email_smtp_secret, dag_name, ds, pool_size=2
+):
+    """
+    Esta función envía los mensajes de varios destinatarios de forma concurrente reutilizando
+    un pool pequeño de conexiones SMTP autenticadas
+    ->messages: Lista de tuplas (email_receiver, resume_message)
+    ->email_sender: Email que envía los mensajes
+    ->email_smtp_secret: Contraseña del servicio SMTP
+    ->dag_name: Nombre del dag
+    ->ds: Fecha de ejecución del dag_name
+    ->pool_size: Número de conexiones SMTP abiertas y de envíos simultáneos
+    *Los envíos son concurrentes con un ThreadPoolExecutor, smtplib es bloqueante
+    *Si el servidor cierra una conexión se abre otra y se reintenta el envío una vez, una conexión con
+    error de red se cierra y el siguiente envío que la toma del pool abre una nueva
+    *Un destinatario con error no detiene a los demás, al final se levanta un error con los que fallaron
+    return: void
+    """
+    pool_size = max(1, min(pool_size, len(messages)))
+    pool = queue.Queue()
+
+    def send(item):
+        email_receiver, resume_message = item
+        obj_smtp = pool.get()
+        try:
+            message = build_alert_message(resume_message, dag_name, ds)
+            if obj_smtp is None:
+                obj_smtp = connect_smtp(email_sender, email_smtp_secret)
+            try:
+                obj_smtp.sendmail(email_sender, email_receiver, message)
+            except smtplib.SMTPServerDisconnected:
+                obj_smtp = None
+                obj_smtp = connect_smtp(email_sender, email_smtp_secret)
+                obj_smtp.sendmail(email_sender, email_receiver, message)
+            logging.info(f"Mensaje enviado exitósamente a {email_receiver}")
+            return None
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+            #  The server answered, the connection is still usable
+            logging.error(f"Error al enviar la alerta a {email_receiver}: {e}")
+            return email_receiver
+        except Exception as e:
+            logging.error(f"Error al enviar la alerta a {email_receiver}: {e}")
+            if obj_smtp is not None:
+                obj_smtp.close()
+            obj_smtp = None
+            return email_receiver
+        finally:
+            #  Only a healthy connection goes back, None makes the next send reconnect
+            pool.put(obj_smtp)
+
+    try:
+        for _ in range(pool_size):
+            pool.put(connect_smtp(email_sender, email_smtp_secret))
+        logging.warning(
+            f"Enviando {len(messages)} mensajes con {pool_size} conexiones SMTP, remitente: {email_sender}"
+        )
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            failed = [receiver for receiver in executor.map(send, messages) if receiver]
+    except Exception as e:
+        logging.error(f"Error al intentar enviar las alertas de correo electrónico", e)
+        raise Exception from e
+    finally:
+        while not pool.empty():
+            obj_smtp = pool.get_nowait()
+            try:
+                if obj_smtp is not None:
+                    obj_smtp.quit()
+            except Exception:
+                pass
+
+    if failed:
+        raise Exception(f"No se pudo enviar la alerta a: {failed}")
+    logging.info(f"{len(messages)} mensajes enviados exitósamente")